@@ -0,0 +1,229 @@
+"""
+In-process read cache for tables the exporter keeps in sync (sku_pricing, ingredients, ...).
+
+    from src.reference_cache import get_reference_cache
+
+    pricing = get_reference_cache(engine, "bigquery", "sku_pricing", lookup_columns=["sku"])
+    row = pricing.lookup_one("sku", "SKU-001")      # namedtuple, or None
+    row.price, row._asdict()
+    pricing.get("5b0c...")                           # by internal_uuid
+
+The whole table is loaded once and indexed by internal_uuid and by each lookup column. After
+that, at most once per check_interval seconds, a lookup reads the table's change_seq from
+<schema>.table_changes (one primary key lookup). The exporter moves that marker in the same
+transaction as every sync that inserts, updates or deletes rows, so the cache reloads only
+when the marker moved and serves from memory otherwise.
+
+Only needs SQLAlchemy; it does not import the exporter (and so not gspread / Google auth).
+"""
+import os
+import time
+import threading
+from collections import namedtuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+# how often (seconds) a lookup may check the change marker; 0 checks on every lookup
+REFERENCE_CACHE_CHECK_SECONDS = float(os.environ.get("REFERENCE_CACHE_CHECK_SECONDS", "5"))
+# rows fetched per round trip while loading
+REFERENCE_CACHE_FETCH_ROWS = int(os.environ.get("REFERENCE_CACHE_FETCH_ROWS", "5000"))
+# written by sheets_exporter.record_table_change
+CHANGE_MARKER_TABLE = "table_changes"
+
+
+class _Snapshot:
+    """One loaded copy of the table; replaced as a whole on reload, never mutated."""
+
+    __slots__ = ("marker", "rows", "by_uuid", "indexes", "loaded_at")
+
+    def __init__(self, marker, rows, by_uuid, indexes):
+        self.marker = marker
+        self.rows = rows
+        self.by_uuid = by_uuid
+        self.indexes = indexes
+        self.loaded_at = time.time()
+
+
+def _row_type(table, columns):
+    # columns that aren't valid field names (spaces, keywords, leading _) become _<position>
+    return namedtuple(table if table.isidentifier() else "Row", columns, rename=True)
+
+
+def _add_to_index(index, key, pos):
+    # unique keys map to one row position; a repeated key is promoted to a list of positions
+    seen = index.get(key)
+    if seen is None:
+        index[key] = pos
+    elif isinstance(seen, list):
+        seen.append(pos)
+    else:
+        index[key] = [seen, pos]
+
+
+class ReferenceCache:
+    """
+    Read-only, in-memory copy of <schema>.<table>.
+    Rows are namedtuples (no per-row dict); repeated string values share one object.
+    lookup_columns are indexed on load; columns limits what is loaded (internal_uuid and the
+    lookup columns are always included). Safe to share between threads.
+    """
+
+    def __init__(self, engine, schema, table, lookup_columns=(), columns=None,
+                 uuid_col="internal_uuid", check_interval=None):
+        self.engine = engine
+        self.schema = schema
+        self.table = table
+        self.uuid_col = uuid_col
+        self.lookup_columns = list(lookup_columns)
+        self.columns = None
+        if columns:
+            self.columns = list(dict.fromkeys([uuid_col, *self.lookup_columns, *columns]))
+        self.check_interval = REFERENCE_CACHE_CHECK_SECONDS if check_interval is None else check_interval
+        self.loads = 0
+        self.checks = 0
+        self.row_type = None
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- marker / loading ---
+
+    def _read_marker(self, conn):
+        try:
+            with conn.begin_nested():
+                return conn.execute(text(f"""
+                    SELECT change_seq FROM {self.schema}.{CHANGE_MARKER_TABLE}
+                    WHERE table_name = :table
+                """), {"table": self.table}).scalar()
+        except ProgrammingError:
+            # exporter older than the marker table: cached data is never invalidated
+            return None
+
+    def current_marker(self):
+        self.checks += 1
+        with self.engine.connect() as conn:
+            with conn.begin():
+                return self._read_marker(conn)
+
+    def _load(self):
+        select = "*" if self.columns is None else ", ".join(f'"{c}"' for c in self.columns)
+        # marker and rows come from one snapshot, so a sync committing mid-load can't leave
+        # new rows cached under the old marker (or the reverse)
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+            with conn.begin():
+                marker = self._read_marker(conn)
+                result = conn.execution_options(stream_results=True).execute(
+                    text(f'SELECT {select} FROM {self.schema}."{self.table}"')
+                )
+                columns = list(result.keys())
+                missing = [c for c in [self.uuid_col, *self.lookup_columns] if c not in columns]
+                if missing:
+                    raise KeyError(f"{self.schema}.{self.table} has no column(s) {missing}")
+
+                row_type = _row_type(self.table, columns)
+                uuid_i = columns.index(self.uuid_col)
+                lookup_i = [(c, columns.index(c)) for c in self.lookup_columns]
+                rows = []
+                by_uuid = {}
+                indexes = {c: {} for c in self.lookup_columns}
+                shared = {}
+                for part in result.partitions(REFERENCE_CACHE_FETCH_ROWS):
+                    for raw in part:
+                        values = [shared.setdefault(v, v) if isinstance(v, str) else v for v in raw]
+                        row = row_type._make(values)
+                        pos = len(rows)
+                        rows.append(row)
+                        if row[uuid_i] is not None:
+                            by_uuid[str(row[uuid_i])] = pos
+                        for c, i in lookup_i:
+                            _add_to_index(indexes[c], row[i], pos)
+
+        self.row_type = row_type
+        self.loads += 1
+        return _Snapshot(marker, tuple(rows), by_uuid, indexes)
+
+    def refresh(self, force=False):
+        """Reload if the change marker moved (or always with force). Returns True when reloaded."""
+        with self._lock:
+            snap = self._snapshot
+            self._checked_at = time.monotonic()
+            if snap is not None and not force and self.current_marker() == snap.marker:
+                return False
+            self._snapshot = self._load()
+            return True
+
+    def _current(self):
+        snap = self._snapshot
+        if snap is None:
+            self.refresh()
+        elif time.monotonic() - self._checked_at >= self.check_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep serving what we have; the next check interval tries again
+                print(f"[reference_cache] {self.schema}.{self.table}: revalidation failed, serving cached rows: {e}")
+        return self._snapshot
+
+    # --- reads ---
+
+    def get(self, uuid, default=None):
+        snap = self._current()
+        pos = snap.by_uuid.get(str(uuid))
+        return default if pos is None else snap.rows[pos]
+
+    def lookup(self, column, value):
+        """All rows whose lookup column equals value (a list, possibly empty)."""
+        snap = self._current()
+        if column not in snap.indexes:
+            raise KeyError(f"{column!r} is not a lookup column of {self.schema}.{self.table}")
+        pos = snap.indexes[column].get(value)
+        if pos is None:
+            return []
+        if isinstance(pos, list):
+            return [snap.rows[p] for p in pos]
+        return [snap.rows[pos]]
+
+    def lookup_one(self, column, value, default=None):
+        rows = self.lookup(column, value)
+        return rows[0] if rows else default
+
+    def rows(self):
+        return self._current().rows
+
+    def __len__(self):
+        return len(self._current().rows)
+
+    def __iter__(self):
+        return iter(self._current().rows)
+
+    @property
+    def marker(self):
+        snap = self._snapshot
+        return snap.marker if snap is not None else None
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_reference_cache(engine, schema, table, lookup_columns=(), columns=None,
+                        uuid_col="internal_uuid", check_interval=None):
+    """One shared ReferenceCache per (engine, table, lookup columns, columns) in this process."""
+    key = (
+        id(engine), schema, table, tuple(lookup_columns),
+        tuple(columns) if columns else None, uuid_col,
+    )
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = ReferenceCache(
+                engine, schema, table,
+                lookup_columns=lookup_columns,
+                columns=columns,
+                uuid_col=uuid_col,
+                check_interval=check_interval,
+            )
+            _CACHES[key] = cache
+    return cache
@@ -7,13 +7,39 @@ from sqlalchemy import create_engine, text
 import gspread
 import traceback
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
 from google.oauth2 import service_account
 from typing import Tuple, List
 import uuid
 import yaml
 import warnings
 import re
+import datetime
+import hashlib
+import json
+import fnmatch
+import csv
+import io
+import math
+import operator
+import threading
+import importlib.util
+import time
+import random
+import bisect
+import codecs
+import hmac
+import argparse
+import cProfile
+import pstats
+import tracemalloc
+import concurrent.futures as cf
+from collections import deque
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
 from typing import Iterable, List, Union
+from contextlib import contextmanager
 from psycopg2.extras import Json
 print("done")
 
@@ -27,6 +53,58 @@ POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
 SERVICE_ACCOUNT_JSON = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
 MODULE_DIR = os.path.dirname(__file__)
 MAPPINGS_PATH = os.path.join(MODULE_DIR, "mappings.yml")
+# deleted_rows_log partitions older than this many months are rolled up and dropped (0 = keep forever)
+DELETED_LOG_RETENTION_MONTHS = int(os.environ.get("DELETED_LOG_RETENTION_MONTHS", "0"))
+# TOAST compression for archived row images; falls back to the server default if unsupported
+DELETED_LOG_COMPRESSION = os.environ.get("DELETED_LOG_COMPRESSION", "lz4")
+# max cells per values.batchUpdate request during write-back (keeps payloads well under the API size limit)
+WRITE_BACK_MAX_CELLS = int(os.environ.get("WRITE_BACK_MAX_CELLS", "40000"))
+WRITE_BACK_FLUSH_ATTEMPTS = int(os.environ.get("WRITE_BACK_FLUSH_ATTEMPTS", "3"))
+# where per-mapping last-sync snapshots (uuid -> row digest) are kept between runs
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(MODULE_DIR, ".snapshots"))
+# post-sync ANALYZE only when a table's churn (inserted + updated + deleted) passes both thresholds
+ANALYZE_MIN_CHURN_ROWS = int(os.environ.get("ANALYZE_MIN_CHURN_ROWS", "500"))
+ANALYZE_CHURN_RATIO = float(os.environ.get("ANALYZE_CHURN_RATIO", "0.1"))
+# --profile: per-phase cProfile/tracemalloc output goes to PROFILE_DIR/<run>/
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(MODULE_DIR, ".profiles"))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "15"))
+# --receiver: HTTP endpoint the sheet-side trigger posts edit notifications to
+RECEIVER_PORT = int(os.environ.get("RECEIVER_PORT", "8085"))
+RECEIVER_TOKEN = os.environ.get("RECEIVER_TOKEN")
+# dirty ranges of one tab are merged into a single read; wider bursts fall back to a full sync
+DIRTY_RANGE_MAX_SPAN = int(os.environ.get("DIRTY_RANGE_MAX_SPAN", "2000"))
+# Google calls: per-request deadlines, retries of transient errors (429/5xx/timeouts) drawn from
+# one budget per run, optional hedging of slow reads, and an overall deadline per mapping
+GOOGLE_CONNECT_TIMEOUT = float(os.environ.get("GOOGLE_CONNECT_TIMEOUT", "10"))
+GOOGLE_READ_TIMEOUT = float(os.environ.get("GOOGLE_READ_TIMEOUT", "120"))
+GOOGLE_MAX_ATTEMPTS = int(os.environ.get("GOOGLE_MAX_ATTEMPTS", "8"))
+GOOGLE_RETRY_BUDGET = int(os.environ.get("GOOGLE_RETRY_BUDGET", "30"))
+# hedge a read once it runs longer than this latency percentile of its call type (0 = off)
+GOOGLE_HEDGE_PERCENTILE = float(os.environ.get("GOOGLE_HEDGE_PERCENTILE", "0"))
+GOOGLE_HEDGE_MIN_SAMPLES = int(os.environ.get("GOOGLE_HEDGE_MIN_SAMPLES", "20"))
+MAPPING_DEADLINE_SECONDS = float(os.environ.get("MAPPING_DEADLINE_SECONDS", "0"))
+# read_engine: csv mappings download the tab from this URL ({sheet_id}, {gid}); a file:// template
+# reads local exports instead (tests, replaying a saved export)
+CSV_EXPORT_URL = os.environ.get(
+    "CSV_EXPORT_URL", "https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
+)
+CSV_EXPORT_CHUNK_BYTES = int(os.environ.get("CSV_EXPORT_CHUNK_BYTES", str(256 * 1024)))
+# write-backs go through <schema>.write_back_queue and are sent by a background thread while the
+# next mappings sync; queued tabs are batched together, failed flushes are retried with backoff
+WRITE_BACK_BATCH_WAIT = float(os.environ.get("WRITE_BACK_BATCH_WAIT", "1"))
+WRITE_BACK_RETRY_SECONDS = float(os.environ.get("WRITE_BACK_RETRY_SECONDS", "5"))
+# per-phase database counters (WAL, buffers, rows, lock waits) in the run summary and sync_runs;
+# opt-in (or --db-cost): it holds a connection and polls pg_stat_activity while phases run
+DB_COST_REPORT = os.environ.get("DB_COST_REPORT", "0") not in ("0", "false", "no", "")
+DB_COST_LOCK_SAMPLE_MS = int(os.environ.get("DB_COST_LOCK_SAMPLE_MS", "100"))
+# parquet_snapshot mappings: versioned Parquet copies of changed target tables (needs pyarrow)
+PARQUET_DIR = os.environ.get("PARQUET_DIR", os.path.join(MODULE_DIR, ".parquet"))
+PARQUET_ROW_GROUP_ROWS = int(os.environ.get("PARQUET_ROW_GROUP_ROWS", "50000"))
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+PARQUET_KEEP_VERSIONS = int(os.environ.get("PARQUET_KEEP_VERSIONS", "5"))
+# publish_changes mappings: NOTIFY channel and how long <schema>.change_outbox rows are kept
+CHANGE_OUTBOX_CHANNEL = os.environ.get("CHANGE_OUTBOX_CHANNEL", "sheet_changes")
+CHANGE_OUTBOX_RETENTION_DAYS = int(os.environ.get("CHANGE_OUTBOX_RETENTION_DAYS", "7"))
 print("done")
 
 # --- when loading the file, guard for missing file ---
@@ -40,6 +118,15 @@ except FileNotFoundError:
 if not isinstance(MAPPINGS, list) or len(MAPPINGS) == 0:
     raise RuntimeError("mappings.yml must contain a non-empty list at the top level.")
 
+# pyarrow stays optional (it is not in requirements.txt), so a mapping that asks for Parquet
+# snapshots without it installed fails here instead of skipping every export at run time
+wants_parquet = any(isinstance(m, dict) and m.get("parquet_snapshot") for m in MAPPINGS)
+if wants_parquet and importlib.util.find_spec("pyarrow") is None:
+    raise RuntimeError(
+        "mappings.yml enables parquet_snapshot but pyarrow is not installed; "
+        "add pyarrow to requirements.txt before building the image."
+    )
+
 # barkdb credentials
 def get_engine() -> Engine:
     """
@@ -49,6 +136,451 @@ def get_engine() -> Engine:
     url = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
     return create_engine(url, pool_pre_ping=True)
 
+class MappingSession:
+    """
+    One connection + unit of work for a single mapping's pipeline.
+
+    Exposes the same connect()/begin() context managers as an Engine, so every helper
+    that takes `engine` can be handed a session instead:
+    - connect() reuses the held connection inside the current transaction
+    - begin() wraps the block in a SAVEPOINT; a failing phase rolls back only itself
+    - commit() marks a phase boundary and makes everything so far durable
+
+    The connection is checked out (and pre-pinged) once, and SQLAlchemy's compiled
+    statement cache is shared for the lifetime of the connection. Leaving the
+    `with` block commits on success and rolls back on error.
+    """
+
+    def __init__(self, engine, name=None):
+        self.engine = engine
+        self.name = name
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.engine.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.conn.close()
+            self.conn = None
+        return False
+
+    @contextmanager
+    def connect(self):
+        yield self.conn
+
+    @contextmanager
+    def begin(self):
+        with self.conn.begin_nested():
+            yield self.conn
+
+    def commit(self):
+        if self.conn.in_transaction():
+            self.conn.commit()
+
+    def rollback(self):
+        if self.conn.in_transaction():
+            self.conn.rollback()
+
+def open_lease_connection(engine):
+    """
+    One connection outside the engine's pool for all of a run's leases: holding a pooled
+    connection per leased mapping would use up the pool (pool_size + max_overflow) that the
+    syncs, the write-back drainer and the cost meter need.
+    """
+    return create_engine(engine.url, poolclass=NullPool).connect()
+
+class MappingLease:
+    """
+    Exclusive, crash-safe claim on one target table across processes/containers.
+
+    Backed by a session-level Postgres advisory lock on a dedicated connection:
+    the lock lives exactly as long as that connection, so a worker that dies
+    releases its leases automatically, while a slow worker keeps others off
+    its tables (and its staging table) instead of doubling the work.
+    Pass conn (see open_lease_connection) to hold several leases on one connection;
+    it is then left open on release.
+    """
+
+    def __init__(self, engine, schema, table, conn=None):
+        self.engine = engine
+        self.key = f"{schema}.{table}"
+        self.shared = conn
+        self.conn = None
+
+    def acquire(self):
+        conn = self.shared if self.shared is not None else self.engine.connect()
+        got = conn.execute(
+            text("SELECT pg_try_advisory_lock(hashtext('sheets_exporter'), hashtext(:key))"),
+            {"key": self.key},
+        ).scalar()
+        # session-level lock survives the commit; don't sit idle in a transaction
+        conn.commit()
+        if not got:
+            if self.shared is None:
+                conn.close()
+            return False
+        self.conn = conn
+        return True
+
+    def release(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(
+                text("SELECT pg_advisory_unlock(hashtext('sheets_exporter'), hashtext(:key))"),
+                {"key": self.key},
+            )
+            self.conn.commit()
+        finally:
+            if self.shared is None:
+                self.conn.close()
+            self.conn = None
+
+class MappingStats:
+    """
+    Per-mapping performance record for one run (one row in <schema>.sync_runs).
+    Phases are timed lap-style: phase("x") closes the running phase and starts x.
+    """
+
+    def __init__(self, run_id, m, profiler=None, cost_meter=None):
+        self.run_id = run_id
+        self.profiler = profiler
+        self.cost_meter = cost_meter
+        self.db_cost = {}
+        self.name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+        self.schema = m.get("schema")
+        self.target_table = m.get("target_table")
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.ended_at = None
+        self.phase_seconds = {}
+        self.counts = {
+            "rows_read": 0, "rows_staged": 0, "inserted": 0, "updated": 0,
+            "unchanged": 0, "deleted": 0, "formatting_only_updates": 0,
+        }
+        self.google_calls = 0
+        self.google_bytes = 0
+        self.retries = 0
+        self.outcome = None
+        self.error = None
+        self._phase = None
+        self._phase_started = None
+
+    def phase(self, name):
+        self._close_phase()
+        self._phase = name
+        if self.profiler is not None:
+            self.profiler.start(name)
+        if self.cost_meter is not None:
+            self.cost_meter.start(name)
+        self._phase_started = time.perf_counter()
+
+    def _close_phase(self):
+        if self._phase is not None:
+            if self.profiler is not None:
+                self.profiler.stop()
+            if self.cost_meter is not None:
+                delta = self.cost_meter.stop()
+                if delta:
+                    acc = self.db_cost.setdefault(self._phase, {})
+                    for k, v in delta.items():
+                        acc[k] = acc.get(k, 0) + v
+            elapsed = time.perf_counter() - self._phase_started
+            self.phase_seconds[self._phase] = self.phase_seconds.get(self._phase, 0.0) + elapsed
+        self._phase = None
+
+    def finish(self, result):
+        self._close_phase()
+        self.ended_at = datetime.datetime.now(datetime.timezone.utc)
+        self.outcome = result.get("status")
+        self.error = result.get("error")
+        for k in ("inserted", "updated", "unchanged", "deleted", "formatting_only_updates"):
+            if k in result:
+                self.counts[k] = result[k]
+
+    def as_row(self):
+        return {
+            "run_id": self.run_id,
+            "mapping_name": self.name,
+            "target_table": self.target_table,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "outcome": self.outcome,
+            "error": self.error,
+            "phase_seconds": Json({k: round(v, 4) for k, v in self.phase_seconds.items()}),
+            "db_cost": Json(self.db_cost) if self.db_cost else None,
+            **self.counts,
+            "google_calls": self.google_calls,
+            "google_bytes": self.google_bytes,
+            "retries": self.retries,
+        }
+
+class DbCostMeter:
+    """
+    Database-side cost of each phase, from counters sampled on a separate connection:
+    - pg_stat_statements (when loaded): WAL bytes, shared buffer hits/reads and rows of this
+      user's statements in this database
+    - otherwise pg_current_wal_insert_lsn() for WAL and pg_stat_database for buffers / rows
+      written (flushed by the backends at commit, so it can lag a phase slightly)
+    - lock waits: a background thread samples pg_stat_activity for the mapping's backend
+      every DB_COST_LOCK_SAMPLE_MS and counts the samples spent waiting on a Lock
+    Counters and lock samples share the meter's one connection (taken in turns) and the
+    sampler only queries while a phase is running.
+    The counters are database-wide: concurrent activity shows up in them too.
+    Any error turns the meter off for the rest of the run instead of failing the sync.
+    """
+
+    def __init__(self, engine, lock_sample_ms=None):
+        self.engine = engine
+        self.interval = (lock_sample_ms or DB_COST_LOCK_SAMPLE_MS) / 1000.0
+        self.source = None
+        self.pid = None
+        self.enabled = True
+        self._conn = None
+        self._phase = None
+        self._before = None
+        self._lock_samples = 0
+        self._thread = None
+        self._stop = None
+        self._conn_lock = threading.Lock()
+
+    def _open(self):
+        if self._conn is not None:
+            return
+        self._conn = self.engine.connect()
+        try:
+            self._conn.execute(text("SELECT 1 FROM pg_stat_statements LIMIT 1"))
+            self.source = "pg_stat_statements"
+        except Exception:
+            self._conn.rollback()
+            self.source = "pg_stat_database"
+        self._conn.rollback()
+
+    def _sample(self):
+        if self.source == "pg_stat_statements":
+            sql = """
+                SELECT pg_current_wal_insert_lsn()::text AS lsn,
+                       COALESCE(SUM(wal_bytes), 0)::bigint AS wal_bytes,
+                       COALESCE(SUM(shared_blks_hit), 0)::bigint AS blks_hit,
+                       COALESCE(SUM(shared_blks_read), 0)::bigint AS blks_read,
+                       COALESCE(SUM(rows), 0)::bigint AS rows
+                FROM pg_stat_statements
+                WHERE userid = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+                  AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            """
+        else:
+            sql = """
+                SELECT pg_current_wal_insert_lsn()::text AS lsn,
+                       NULL::bigint AS wal_bytes,
+                       blks_hit, blks_read,
+                       tup_inserted + tup_updated + tup_deleted AS rows
+                FROM pg_stat_database
+                WHERE datname = current_database()
+            """
+        with self._conn_lock:
+            row = dict(self._conn.execute(text(sql)).mappings().one())
+            # a fresh snapshot next time (stats views are cached per transaction)
+            self._conn.rollback()
+        return row
+
+    def _wal_diff(self, after, before):
+        with self._conn_lock:
+            diff = self._conn.execute(
+                text("SELECT pg_wal_lsn_diff(CAST(:a AS pg_lsn), CAST(:b AS pg_lsn))"),
+                {"a": after, "b": before},
+            ).scalar()
+            self._conn.rollback()
+        return int(diff)
+
+    def _sampler(self):
+        try:
+            while not self._stop.wait(self.interval):
+                pid, phase = self.pid, self._phase
+                if pid is None or phase is None:
+                    continue
+                with self._conn_lock:
+                    if self._conn is None:
+                        return
+                    waiting = self._conn.execute(text(
+                        "SELECT wait_event_type FROM pg_stat_activity WHERE pid = :pid"
+                    ), {"pid": pid}).scalar()
+                    self._conn.rollback()
+                if waiting == "Lock" and phase == self._phase:
+                    self._lock_samples += 1
+        except Exception as e:
+            print(f"[db_cost] lock sampler stopped: {e}")
+
+    def watch(self, session):
+        # the backend the mapping's MappingSession runs on (psycopg2: no round trip)
+        if self.enabled:
+            self.pid = session.conn.connection.dbapi_connection.get_backend_pid()
+
+    def start(self, phase):
+        if not self.enabled:
+            return
+        try:
+            self._open()
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._sampler, name="db-cost-locks", daemon=True)
+                self._thread.start()
+            self._before = self._sample()
+            self._lock_samples = 0
+            self._phase = phase
+        except Exception as e:
+            self._disable(e)
+
+    def stop(self):
+        if not self.enabled or self._phase is None:
+            return None
+        self._phase = None
+        try:
+            after = self._sample()
+            before = self._before
+            if self.source == "pg_stat_statements":
+                wal = after["wal_bytes"] - before["wal_bytes"]
+            else:
+                wal = self._wal_diff(after["lsn"], before["lsn"])
+            return {
+                "wal_bytes": wal,
+                "blks_hit": after["blks_hit"] - before["blks_hit"],
+                "blks_read": after["blks_read"] - before["blks_read"],
+                "rows": after["rows"] - before["rows"],
+                "lock_wait_s": round(self._lock_samples * self.interval, 3),
+            }
+        except Exception as e:
+            self._disable(e)
+            return None
+
+    def _disable(self, e):
+        print(f"[db_cost] database cost report disabled for this run: {e}")
+        self.enabled = False
+        self._phase = None
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class PhaseProfiler:
+    """
+    --profile only: CPU (cProfile) and memory (tracemalloc) per MappingStats phase.
+    Time spent taking memory snapshots is outside the profiled windows.
+    write() dumps <out_dir>/<mapping>.<phase>.prof (open with snakeviz / pstats) and
+    a <mapping>.txt with the top-N hot functions and allocation sites per phase.
+    """
+
+    def __init__(self, out_dir, top_n=None):
+        self.out_dir = out_dir
+        self.top_n = top_n or PROFILE_TOP_N
+        self.phases = {}
+        self._phase = None
+        self._base = 0
+        self._snapshot = None
+
+    def start(self, phase):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        entry = self.phases.setdefault(phase, {"profile": cProfile.Profile(), "peak": 0, "allocs": []})
+        self._phase = phase
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+        self._snapshot = self._take_snapshot()
+        entry["profile"].enable()
+
+    def stop(self):
+        if self._phase is None:
+            return
+        entry = self.phases[self._phase]
+        entry["profile"].disable()
+        peak = tracemalloc.get_traced_memory()[1] - self._base
+        entry["peak"] = max(entry["peak"], peak)
+        entry["allocs"].extend(self._take_snapshot().compare_to(self._snapshot, "lineno")[:self.top_n])
+        self._phase = None
+        self._snapshot = None
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+
+    def hot_functions(self, n=None):
+        # (self seconds, "file:line(func)") across all phases, hottest first
+        merged = {}
+        for entry in self.phases.values():
+            for (filename, line, func), row in pstats.Stats(entry["profile"]).stats.items():
+                key = f"{os.path.basename(filename)}:{line}({func})"
+                merged[key] = merged.get(key, 0.0) + row[2]
+        return sorted(((t, k) for k, t in merged.items()), reverse=True)[:n or self.top_n]
+
+    def write(self, name):
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe = re.sub(r"[^\w.-]", "_", name)
+        lines = []
+        for phase, entry in self.phases.items():
+            entry["profile"].dump_stats(os.path.join(self.out_dir, f"{safe}.{phase}.prof"))
+            buf = io.StringIO()
+            pstats.Stats(entry["profile"], stream=buf).sort_stats("tottime").print_stats(self.top_n)
+            lines.append(f"==== {phase}: peak {entry['peak'] / 1024:.0f} kB ====")
+            lines.append(buf.getvalue())
+            lines.append("top allocation sites (net):")
+            allocs = sorted(entry["allocs"], key=lambda st: st.size_diff, reverse=True)
+            lines.extend(f"  {st}" for st in allocs[:self.top_n])
+            lines.append("")
+
+        path = os.path.join(self.out_dir, f"{safe}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        return path
+
+def stop_profiling():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def _report_profile(stats):
+    if stats.profiler is None or not stats.profiler.phases:
+        return
+    path = stats.profiler.write(stats.name)
+    peaks = ", ".join(f"{p}={e['peak'] / 1024:.0f}kB" for p, e in stats.profiler.phases.items())
+    print(f"[{stats.name}] profile: {path} (peak {peaks})")
+    for seconds, func in stats.profiler.hot_functions(5):
+        print(f"[{stats.name}]   {seconds:8.3f}s  {func}")
+
+# stats of the mapping currently being synced; Google calls/retries are attributed to it
+_ACTIVE_STATS = None
+# background threads (the write-back drainer) set .stats here: their calls are counted there
+# and are not bound by the deadline of whichever mapping the main thread is syncing.
+# Hedge pool threads also set .deadline, copied from the thread that made the call
+_THREAD_CONTEXT = threading.local()
+
+def _current_stats():
+    return getattr(_THREAD_CONTEXT, "stats", _ACTIVE_STATS)
+
+def _count_google_response(response, *args, **kwargs):
+    # requests response hook: count every Google API round trip and its payload size
+    stats = _current_stats()
+    if stats is None:
+        return
+    stats.google_calls += 1
+    length = response.headers.get("Content-Length")
+    if length is not None:
+        stats.google_bytes += int(length)
+    elif not kwargs.get("stream"):
+        stats.google_bytes += len(response.content)
+
 # google API credentials
 def get_gspread_client(scopes: List[str] = None):
     """
@@ -63,29 +595,883 @@ def get_gspread_client(scopes: List[str] = None):
         scopes = ["https://www.googleapis.com/auth/spreadsheets"]
 
     creds = service_account.Credentials.from_service_account_file(sa_path, scopes=scopes)
-    return gspread.authorize(creds)
+    gc = gspread.authorize(creds)
+    # (connect, read) deadline for every HTTP request; a hung call now fails instead of blocking the run
+    gc.http_client.set_timeout((GOOGLE_CONNECT_TIMEOUT, GOOGLE_READ_TIMEOUT))
+    gc.http_client.session.hooks["response"].append(_count_google_response)
+    return gc
+
+# --- Google call policy ---
+class DeadlineExceeded(RuntimeError):
+    pass
+
+class LatencyHistogram:
+    """Per call type: fixed buckets for reporting plus recent samples for percentiles."""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, max_samples=500):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.samples = deque(maxlen=max_samples)
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.samples.append(seconds)
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def as_dict(self):
+        labels = [f"<={b}s" for b in self.BUCKETS] + [f">{self.BUCKETS[-1]}s"]
+        return {
+            "count": self.total,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+# call type -> LatencyHistogram, for the whole process (worker passes keep refining it)
+GOOGLE_LATENCY = {}
+_RETRY_BUDGET = {"left": GOOGLE_RETRY_BUDGET}
+# time.monotonic() by which the mapping being synced must be done (None = no deadline)
+_MAPPING_DEADLINE = None
+_HEDGE_POOL = None
+
+def reset_google_retry_budget(budget=None):
+    _RETRY_BUDGET["left"] = GOOGLE_RETRY_BUDGET if budget is None else budget
+
+def _current_deadline():
+    if hasattr(_THREAD_CONTEXT, "deadline"):
+        return _THREAD_CONTEXT.deadline
+    return None if hasattr(_THREAD_CONTEXT, "stats") else _MAPPING_DEADLINE
+
+def check_deadline(label):
+    deadline = _current_deadline()
+    if deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded(f"[{label}] mapping deadline exceeded")
+
+def is_transient_google_error(e):
+    if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    # only a real HTTP status counts, never digits in the message: gspread's APIError.code, or the
+    # response's status when there is none (an HTML error page leaves APIError.code at -1)
+    code = getattr(e, "code", None)
+    if not (isinstance(code, int) and code > 0):
+        code = getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+def _hedged(kind, fn, threshold):
+    # start fn; if it has not answered within threshold, race a second copy and take the first result
+    global _HEDGE_POOL
+    if _HEDGE_POOL is None:
+        _HEDGE_POOL = cf.ThreadPoolExecutor(max_workers=4, thread_name_prefix="google-hedge")
+    # pool threads run on behalf of the caller: its stats and deadline, not the active mapping's
+    stats, deadline = _current_stats(), _current_deadline()
+
+    def call():
+        _THREAD_CONTEXT.stats, _THREAD_CONTEXT.deadline = stats, deadline
+        try:
+            return fn()
+        finally:
+            del _THREAD_CONTEXT.stats, _THREAD_CONTEXT.deadline
+
+    first = _HEDGE_POOL.submit(call)
+    try:
+        return first.result(timeout=threshold)
+    except cf.TimeoutError:
+        pass
+    print(f"[google] {kind} slower than {threshold:.2f}s, sending a hedged request")
+    second = _HEDGE_POOL.submit(call)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                return f.result()
+            error = f.exception()
+    raise error
+
+def google_call(kind, label, fn, hedge=False, attempts=None):
+    """
+    Run one Google call (kind: read/header/open/write, used for its latency histogram).
+    Transient errors are retried with exponential backoff while the run's retry budget and
+    the mapping deadline allow; hedge=True (idempotent reads only) races a second request
+    once the call is slower than GOOGLE_HEDGE_PERCENTILE of earlier calls of the same kind.
+    """
+
+    attempts = attempts or GOOGLE_MAX_ATTEMPTS
+    hist = GOOGLE_LATENCY.setdefault(kind, LatencyHistogram())
+    for attempt in range(attempts):
+        check_deadline(label)
+        threshold = None
+        if hedge and GOOGLE_HEDGE_PERCENTILE and len(hist.samples) >= GOOGLE_HEDGE_MIN_SAMPLES:
+            threshold = hist.percentile(GOOGLE_HEDGE_PERCENTILE)
+        started = time.monotonic()
+        try:
+            result = _hedged(kind, fn, threshold) if threshold else fn()
+            hist.record(time.monotonic() - started)
+            return result
+
+        except Exception as e:
+            hist.record(time.monotonic() - started)
+            print(f"[{label}] FULL ERROR:", repr(e))
+            if not is_transient_google_error(e) or attempt + 1 >= attempts:
+                raise
+            if _RETRY_BUDGET["left"] <= 0:
+                print(f"[{label}] Google retry budget for this run is used up, not retrying")
+                raise
+            _RETRY_BUDGET["left"] -= 1
+            stats = _current_stats()
+            if stats is not None:
+                stats.retries += 1
+            wait = (2 ** attempt) + random.uniform(0, 1)
+            deadline = _current_deadline()
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            print(f"[{label}] Transient Google error. Sleeping {wait:.1f}s then retrying...")
+            time.sleep(wait)
+
+def print_google_latency():
+    if not GOOGLE_LATENCY:
+        return
+    print("==== google latency ====")
+    for kind, hist in sorted(GOOGLE_LATENCY.items()):
+        d = hist.as_dict()
+        if not d["count"]:
+            continue
+        buckets = " ".join(f"{k}:{n}" for k, n in d["buckets"].items())
+        print(f"[{kind}] n={d['count']} p50={d['p50']:.2f}s p95={d['p95']:.2f}s "
+              f"p99={d['p99']:.2f}s max={d['max']:.2f}s  {buckets}")
+
+# --- canonical value reading ---
+# read_mode: canonical asks Google for unformatted values and renders them to text ourselves,
+# so a display-format change ("1" -> "1.0" -> "1,000") no longer looks like a data change.
+SHEETS_EPOCH = datetime.datetime(1899, 12, 30)
+
+def _serial_to_iso(v):
+    dt = SHEETS_EPOCH + datetime.timedelta(days=float(v))
+    dt = (dt + datetime.timedelta(microseconds=500000)).replace(microsecond=0)
+    if dt.time() == datetime.time(0, 0):
+        return dt.date().isoformat()
+    return dt.isoformat(sep=" ")
+
+def canonical_cell_text(v, is_date=False):
+    """
+    Canonical text for an UNFORMATTED_VALUE cell:
+    numbers without grouping or trailing zeros, booleans as true/false,
+    date serials (for declared date columns) as ISO dates/timestamps.
+    """
+    if v is None or v == "":
+        return ""
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, (int, float)):
+        if is_date:
+            return _serial_to_iso(v)
+        if isinstance(v, float):
+            if v.is_integer() and abs(v) < 1e15:
+                return str(int(v))
+            return repr(v)
+        return str(v)
+    return str(v)
+
+def canonical_records(header, values, date_columns=None):
+    # like records_from_values(), but for unformatted grids: canonical text instead of numericise
+    header = [canonical_cell_text(h) for h in header]
+    date_columns = set(date_columns or [])
+    is_date = [normalize_columns(h) in date_columns for h in header]
+    width = len(header)
+    records = []
+    for row in values:
+        row = list(row) + [""] * (width - len(row))
+        records.append({
+            header[i]: canonical_cell_text(row[i], is_date[i])
+            for i in range(width)
+        })
+    return records
+
+CANONICAL_RENDER = {
+    "value_render_option": gspread.utils.ValueRenderOption.unformatted,
+    "date_time_render_option": gspread.utils.DateTimeOption.serial_number,
+}
 
 # read the data
-def read_sheet(sheet_id, sheet_name):
+def read_sheet(sheet_id, sheet_name, read_mode=None, date_columns=None):
     gc = get_gspread_client()
-    import time
-    import random
 
-    for attempt in range(8):
-        try:
-            ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+    def _read():
+        ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+        if read_mode == "canonical":
+            grid = ws.get(pad_values=True, **CANONICAL_RENDER)
+            rows = canonical_records(grid[0], grid[1:], date_columns) if grid and grid[0] else []
+        else:
             rows = ws.get_all_records()
-            return rows, ws
+        return rows, ws
 
-        except Exception as e:
-            print(f"[{sheet_name}] FULL ERROR:", repr(e))
+    return google_call("read", sheet_name, _read, hedge=True)
 
-            if "429" in str(e):
-                wait = (2 ** attempt) + random.uniform(0, 1)
-                print(f"[{sheet_name}] Hit Google rate limit. Sleeping {wait:.1f}s then retrying...")
-                time.sleep(wait)
-                continue
-            raise
+def records_from_values(keys, values):
+    # same shaping as Worksheet.get_all_records(): pad short rows, numericise, key by header
+    width = len(keys)
+    values = [
+        gspread.utils.numericise_all(list(row) + [""] * (width - len(row)))
+        for row in values
+    ]
+    return gspread.utils.to_records(keys, values)
+
+# --- column projection (include_columns / exclude_columns) ---
+def column_selector(m, always=()):
+    """
+    Build select(normalized_col) -> bool from a mapping's include_columns / exclude_columns
+    glob patterns (matched against normalized names). `always` columns are never dropped.
+    Returns None when the mapping doesn't project.
+    """
+    include = m.get("include_columns") or []
+    exclude = m.get("exclude_columns") or []
+    if not include and not exclude:
+        return None
+    always = set(always)
+
+    def select(col):
+        if col in always:
+            return True
+        if include and not any(fnmatch.fnmatchcase(col, p) for p in include):
+            return False
+        return not any(fnmatch.fnmatchcase(col, p) for p in exclude)
+
+    return select
+
+def header_names(header_row):
+    # the names the pipeline will use for each header cell (blank headers -> col_<n>)
+    return normalize_columns([(h.strip().lstrip("\ufeff") or f"_col_{i}") for i, h in enumerate(header_row, start=1)])
+
+def _column_letter(col):
+    return re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, col))
+
+def _column_blocks(indexes):
+    # contiguous runs of 0-based column indexes -> [(first, last)]
+    blocks = []
+    for i in indexes:
+        if blocks and blocks[-1][1] == i - 1:
+            blocks[-1][1] = i
+        else:
+            blocks.append([i, i])
+    return [tuple(b) for b in blocks]
+
+def _read_column_blocks(ws, select, read_mode=None):
+    # header row + one values.batchGet of the kept column blocks, stitched into one grid
+    header_row = ws.row_values(1)
+    keep = [i for i, c in enumerate(header_names(header_row)) if select(c)]
+    blocks = _column_blocks(keep)
+    if not blocks:
+        return header_row, []
+
+    ranges = [f"{_column_letter(a + 1)}:{_column_letter(b + 1)}" for a, b in blocks]
+    if read_mode == "canonical":
+        parts = ws.batch_get(ranges, **CANONICAL_RENDER)
+    else:
+        parts = ws.batch_get(ranges)
+
+    # pad short rows per block so every column keeps its position
+    height = max(len(p) for p in parts)
+    grid = []
+    for r in range(height):
+        row = []
+        for (a, b), part in zip(blocks, parts):
+            cells = list(part[r]) if r < len(part) else []
+            row.extend(cells + [""] * (b - a + 1 - len(cells)))
+        grid.append(row)
+    return header_row, grid
+
+def read_sheet_columns(sheet_id, sheet_name, select, read_mode=None, date_columns=None):
+    """
+    Full read of only the projected columns: the header row, then one values.batchGet
+    with a whole-column range per contiguous block of kept columns.
+    Returns (header_row, records, worksheet); header_row is the full, unprojected header.
+    """
+    gc = get_gspread_client()
+
+    def _read():
+        ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+        header_row, grid = _read_column_blocks(ws, select, read_mode)
+        if not grid:
+            return header_row, [], ws
+        if read_mode == "canonical":
+            return header_row, canonical_records(grid[0], grid[1:], date_columns), ws
+        return header_row, records_from_values(grid[0], grid[1:]), ws
+
+    return google_call("read", sheet_name, _read, hedge=True)
+
+def read_sheet_grid(sheet_id, sheet_name, read_mode=None, select=None):
+    """
+    Full read as a raw values grid (row 0 = header) for the columnar stage; no per-row dicts.
+    Returns (header_row, grid, worksheet); header_row is the full, unprojected header.
+    """
+    gc = get_gspread_client()
+
+    def _read():
+        ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+        if select:
+            header_row, grid = _read_column_blocks(ws, select, read_mode)
+        else:
+            if read_mode == "canonical":
+                grid = ws.get(pad_values=True, **CANONICAL_RENDER)
+            else:
+                grid = ws.get_values()
+            grid = [list(r) for r in grid]
+            header_row = grid[0] if grid else []
+        if read_mode == "canonical":
+            header_row = [canonical_cell_text(h) for h in header_row]
+        return header_row, grid, ws
+
+    return google_call("read", sheet_name, _read, hedge=True)
+
+def read_sheet_tail(sheet_id, sheet_name, start_row, read_mode=None, date_columns=None, end_row=None):
+    """
+    Read the header row and every row from start_row (1-based) to end_row (default: the end
+    of the tab) in a single values.batchGet. Returns (header_row, records, worksheet).
+    """
+    gc = get_gspread_client()
+
+    def _read():
+        ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+        last_row = end_row or max(ws.row_count, start_row)
+        ranges = ["1:1", f"{start_row}:{last_row}"]
+        if read_mode == "canonical":
+            header_range, tail_range = ws.batch_get(ranges, **CANONICAL_RENDER)
+            header_row = [canonical_cell_text(h) for h in header_range[0]] if header_range else []
+            return header_row, canonical_records(header_row, list(tail_range), date_columns), ws
+        header_range, tail_range = ws.batch_get(ranges)
+        header_row = list(header_range[0]) if header_range else []
+        return header_row, records_from_values(header_row, list(tail_range)), ws
+
+    return google_call("read", sheet_name, _read, hedge=True)
+
+# --- CSV export read engine (mapping: read_engine: csv) ---
+# The values API returns the tab as a JSON array of arrays that is decoded in one piece; the CSV
+# export of the same tab (formatted values, like get_all_records()) is a smaller download and is
+# parsed here while it streams in.
+def parse_csv_stream(chunks, encoding="utf-8-sig"):
+    """
+    Bytes chunks of a CSV download -> iterator of row lists.
+    Chunks may split multi-byte characters and quoted multi-line cells anywhere; lines are cut
+    on \n only so other line-break characters inside cells survive.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def lines():
+        tail = ""
+        for chunk in chunks:
+            parts = (tail + decoder.decode(chunk)).split("\n")
+            tail = parts.pop()
+            for part in parts:
+                yield part + "\n"
+        tail += decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    return csv.reader(lines())
+
+def csv_grid(rows):
+    # the export can carry blank rows and columns past the data (formatted but empty cells);
+    # cut them so the grid matches get_values()
+    grid = []
+    last_row = width = 0
+    for row in rows:
+        grid.append(row)
+        end = len(row)
+        while end and row[end - 1] == "":
+            end -= 1
+        if end:
+            last_row = len(grid)
+            width = max(width, end)
+    del grid[last_row:]
+    for i, row in enumerate(grid):
+        if len(row) > width:
+            grid[i] = row[:width]
+    return grid
+
+def _csv_export_chunks(gc, url):
+    # yields the body in CSV_EXPORT_CHUNK_BYTES pieces and adds them to the mapping's google_bytes
+    if url.startswith("file://"):
+        with open(url[len("file://"):], "rb") as f:
+            while True:
+                chunk = f.read(CSV_EXPORT_CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+    response = gc.http_client.session.get(
+        url, stream=True, timeout=(GOOGLE_CONNECT_TIMEOUT, GOOGLE_READ_TIMEOUT)
+    )
+    with response:
+        response.raise_for_status()
+        counted = response.headers.get("Content-Length") is not None
+        for chunk in response.iter_content(chunk_size=CSV_EXPORT_CHUNK_BYTES):
+            stats = _current_stats()
+            if stats is not None and not counted:
+                stats.google_bytes += len(chunk)
+            yield chunk
+
+def read_sheet_csv(sheet_id, sheet_name):
+    """
+    Full read of a tab through its CSV export, parsed as it streams.
+    Returns (header_row, grid, worksheet) like read_sheet_grid() (row 0 = header, all columns).
+    """
+    gc = get_gspread_client()
+
+    def _read():
+        ws = gc.open_by_key(sheet_id).worksheet(sheet_name)
+        url = CSV_EXPORT_URL.format(sheet_id=sheet_id, gid=ws.id)
+        grid = csv_grid(parse_csv_stream(_csv_export_chunks(gc, url)))
+        header_row = grid[0] if grid else []
+        return header_row, grid, ws
+
+    return google_call("read", sheet_name, _read, hedge=True)
+
+def rows_checksum(rows, skip_cols=()):
+    # order-sensitive digest of row contents; system columns are skipped because write-back changes them
+    h = hashlib.sha256()
+    for r in rows:
+        items = [[k, "" if v is None else str(v)] for k, v in sorted(r.items()) if k not in skip_cols]
+        h.update(json.dumps(items).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+# --- last-sync snapshot store ---
+# File layout: magic line, one JSON header line, then fixed 32-byte records
+# (16-byte uuid + 16-byte blake2b row digest) sorted by uuid.
+SNAPSHOT_MAGIC = b"BWSNAP1\n"
+
+def snapshot_path(schema, table):
+    return os.path.join(SNAPSHOT_DIR, f"{schema}.{table}.snap")
+
+def _canonical_cell(v):
+    # sheet "" and DB NULL/'' are the same thing; everything else compares as text
+    if v is None or v == "":
+        return None
+    return str(v)
+
+def row_digest(row, compare_cols):
+    payload = json.dumps([_canonical_cell(row.get(c)) for c in compare_cols])
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+def load_snapshot(path):
+    try:
+        with open(path, "rb") as f:
+            if f.readline() != SNAPSHOT_MAGIC:
+                return None
+            header = json.loads(f.readline())
+            body = f.read()
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if len(body) != header.get("rows", -1) * 32:
+        return None
+
+    header["digests"] = {body[i:i + 16]: body[i + 16:i + 32] for i in range(0, len(body), 32)}
+    return header
+
+def save_snapshot(path, columns_key, digests, fingerprint, verified_at=None):
+    # write to a temp file and rename so a crash never leaves a half-written snapshot
+    # verified_at: when the digests were last rebuilt from the target itself (ISO, UTC)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = {
+        "columns_key": columns_key,
+        "rows": len(digests),
+        "fingerprint": fingerprint,
+        "verified_at": verified_at,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        for k in sorted(digests):
+            f.write(k)
+            f.write(digests[k])
+    os.replace(tmp, path)
+
+def target_fingerprint(engine, schema, table):
+    """
+    The target's change_seq: it moves in the same transaction as every exporter write, and is
+    one primary-key lookup, so checking it costs the same whatever the table's size.
+    Rows inserted, deleted or edited outside the exporter are caught by the periodic rebuild
+    (snapshot_is_stale); out-of-band inserts are also removed by the deletion scan of every full sync.
+    """
+    change = get_table_change(engine, schema, table)
+    return change["change_seq"] if change else None
+
+def snapshot_is_stale(snapshot, columns_key, fingerprint, revalidate_hours, now=None):
+    """A snapshot is rebuilt from the target when its columns or fingerprint moved, or when its
+    last rebuild is older than revalidate_hours (0 / None: never on age alone)."""
+    if snapshot is None or snapshot["columns_key"] != columns_key or snapshot.get("fingerprint") != fingerprint:
+        return True
+    if not revalidate_hours:
+        return False
+    verified_at = snapshot.get("verified_at")
+    if not verified_at:
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    age = now - datetime.datetime.fromisoformat(verified_at)
+    return age > datetime.timedelta(hours=revalidate_hours)
+
+def rebuild_snapshot_from_target(engine, schema, table, compare_cols, uuid_col="internal_uuid"):
+    col_list = ", ".join([f'"{c}"' for c in compare_cols])
+    sql = text(f'''
+        SELECT "{uuid_col}"::text{", " + col_list if compare_cols else ""}
+        FROM {schema}."{table}"
+    ''').execution_options(stream_results=True)
+
+    digests = {}
+    with engine.connect() as conn:
+        for r in conn.execute(sql):
+            row = dict(zip(compare_cols, r[1:]))
+            digests[uuid.UUID(r[0]).bytes] = row_digest(row, compare_cols)
+    return digests
+
+def diff_against_snapshot(rows, snapshot_digests, compare_cols, uuid_col="internal_uuid"):
+    """
+    Split rows (all carrying a uuid) into changed vs unchanged using the snapshot,
+    and list snapshot uuids no longer present in the sheet.
+    Returns (changed_rows, unchanged_count, deleted_uuid_strings, new_digests).
+    """
+    changed = []
+    unchanged = 0
+    seen = set()
+    new_digests = {}
+
+    for r in rows:
+        try:
+            key = uuid.UUID(str(r.get(uuid_col)).strip()).bytes
+        except ValueError:
+            # malformed uuid: let the database decide
+            changed.append(r)
+            continue
+        d = row_digest(r, compare_cols)
+        seen.add(key)
+        new_digests[key] = d
+        if snapshot_digests.get(key) == d:
+            unchanged += 1
+        else:
+            changed.append(r)
+
+    deleted = [str(uuid.UUID(bytes=k)) for k in snapshot_digests if k not in seen]
+    return changed, unchanged, deleted, new_digests
+
+def add_columns_if_missing(conn, schema, table, columns):
+    """
+    Add bookkeeping columns introduced after a table was first created. Existing columns are
+    looked up in the catalog first: ALTER TABLE ... ADD COLUMN IF NOT EXISTS takes an ACCESS
+    EXCLUSIVE lock even when it has nothing to do, and these helpers run inside every mapping's
+    transaction, so concurrent workers would queue (or deadlock) on each other's bookkeeping.
+    """
+    existing = set(conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :table
+    """), {"schema": schema, "table": table}).scalars())
+    for column, col_type in columns.items():
+        if column not in existing:
+            conn.execute(text(f'ALTER TABLE {schema}."{table}" ADD COLUMN IF NOT EXISTS "{column}" {col_type}'))
+
+def create_sync_state_table_if_not_exists(engine, schema):
+    # per-mapping bookkeeping between runs (append-only tail position etc.)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.sync_state (
+                mapping_name TEXT PRIMARY KEY,
+                target_table TEXT,
+                row_count INTEGER,
+                tail_checksum TEXT,
+                header_checksum TEXT,
+                full_synced_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            );
+        """))
+        add_columns_if_missing(conn, schema, "sync_state", {"last_success_at": "TIMESTAMPTZ"})
+
+def get_sync_state(engine, schema, mapping_name):
+    create_sync_state_table_if_not_exists(engine, schema)
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT *
+            FROM {schema}.sync_state
+            WHERE mapping_name = :name
+        """), {"name": mapping_name}).mappings().fetchone()
+    return dict(row) if row else None
+
+def save_sync_state(engine, schema, mapping_name, target_table, row_count, tail_checksum, header_checksum, full_sync):
+    create_sync_state_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.sync_state
+            (mapping_name, target_table, row_count, tail_checksum, header_checksum, full_synced_at, updated_at)
+            VALUES (:name, :target, :row_count, :tail, :header, CASE WHEN :full THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+            ON CONFLICT (mapping_name) DO UPDATE SET
+                target_table = EXCLUDED.target_table,
+                row_count = EXCLUDED.row_count,
+                tail_checksum = EXCLUDED.tail_checksum,
+                header_checksum = EXCLUDED.header_checksum,
+                full_synced_at = COALESCE(EXCLUDED.full_synced_at, {schema}.sync_state.full_synced_at),
+                updated_at = CURRENT_TIMESTAMP
+        """), {
+            "name": mapping_name,
+            "target": target_table,
+            "row_count": row_count,
+            "tail": tail_checksum,
+            "header": header_checksum,
+            "full": bool(full_sync),
+        })
+
+def reset_sync_state(engine, schema, mapping_name):
+    # forget the tail position so the next run does a full sync (scheduling info is kept)
+    create_sync_state_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {schema}.sync_state
+            SET row_count = NULL,
+                tail_checksum = NULL,
+                header_checksum = NULL,
+                full_synced_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE mapping_name = :name
+        """), {"name": mapping_name})
+
+def mark_mapping_synced(engine, schema, mapping_name, target_table):
+    create_sync_state_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.sync_state (mapping_name, target_table, last_success_at, updated_at)
+            VALUES (:name, :target, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT (mapping_name) DO UPDATE SET
+                last_success_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+        """), {"name": mapping_name, "target": target_table})
+
+# --- per-table change markers ---
+# change_seq moves in the same transaction as every sync that changes a target's rows; readers
+# (src/reference_cache.py) compare it with the value they loaded and reload only when it moved.
+def create_table_changes_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.table_changes (
+                table_name TEXT PRIMARY KEY,
+                change_seq BIGINT NOT NULL,
+                run_id TEXT,
+                changed_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            );
+        """))
+
+def record_table_change(engine, schema, table_name, run_id=None):
+    create_table_changes_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.table_changes (table_name, change_seq, run_id, changed_at)
+            VALUES (:table, 1, :run_id, CURRENT_TIMESTAMP)
+            ON CONFLICT (table_name) DO UPDATE SET
+                change_seq = {schema}.table_changes.change_seq + 1,
+                run_id = EXCLUDED.run_id,
+                changed_at = CURRENT_TIMESTAMP
+        """), {"table": table_name, "run_id": str(run_id) if run_id else None})
+
+def get_table_change(engine, schema, table_name):
+    create_table_changes_table_if_not_exists(engine, schema)
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT change_seq, run_id, changed_at
+            FROM {schema}.table_changes
+            WHERE table_name = :table
+        """), {"table": table_name}).mappings().fetchone()
+    return dict(row) if row else None
+
+def mapping_last_success(engine, m):
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    state = get_sync_state(engine, m.get("schema"), name)
+    return state.get("last_success_at") if state else None
+
+def is_mapping_due(engine, m, now=None):
+    # interval_minutes: 0 / unset means "every run"
+    interval = m.get("interval_minutes") or 0
+    if interval <= 0:
+        return True
+    last = mapping_last_success(engine, m)
+    if last is None:
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now - last >= datetime.timedelta(minutes=interval)
+
+# --- per-mapping phase checkpoints ---
+# phase: [merging ->] upserted -> deleted -> written_back. While a checkpoint is "upserted" or
+# "deleted" the DB holds rows whose UUIDs have not reached the sheet yet; the stored write-back
+# lets the next run finish the job instead of inserting those rows a second time.
+# "merging" (chunked merges only) records the new UUIDs and the last merged key, so an
+# interrupted merge continues from there with the same UUIDs.
+PENDING_CHECKPOINT_PHASES = ("upserted", "deleted")
+
+def create_sync_checkpoints_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.sync_checkpoints (
+                mapping_name TEXT PRIMARY KEY,
+                target_table TEXT,
+                run_id TEXT,
+                phase TEXT NOT NULL,
+                write_back JSONB,
+                start_row INTEGER,
+                row_count INTEGER,
+                identity_checksum TEXT,
+                new_uuids JSONB,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        add_columns_if_missing(conn, schema, "sync_checkpoints", {"merge_position": "TEXT"})
+
+def row_identities(uuids, row_values):
+    """
+    One identity per read row: its uuid, or for rows that don't have one yet their
+    contents (row_values(i) -> list of cell values), so shifted new rows are noticed.
+    """
+    out = []
+    for i, u in enumerate(uuids):
+        u = "" if u is None else str(u).strip()
+        out.append(u or json.dumps(["" if v is None else str(v) for v in row_values(i)]))
+    return out
+
+def identity_checksum(identities):
+    h = hashlib.sha256()
+    for v in identities:
+        h.update(v.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+def get_checkpoint(engine, schema, mapping_name):
+    create_sync_checkpoints_table_if_not_exists(engine, schema)
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT mapping_name, target_table, run_id, phase, write_back, start_row, row_count,
+                   identity_checksum, new_uuids, merge_position, updated_at
+            FROM {schema}.sync_checkpoints
+            WHERE mapping_name = :name
+        """), {"name": mapping_name}).mappings().fetchone()
+    return dict(row) if row else None
+
+def save_checkpoint(engine, schema, mapping_name, target_table, run_id, phase,
+                    write_back=None, start_row=None, row_count=None, identity_checksum=None, new_uuids=None):
+    create_sync_checkpoints_table_if_not_exists(engine, schema)
+    dumps = lambda o: json.dumps(o, default=str)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.sync_checkpoints (
+                mapping_name, target_table, run_id, phase, write_back, start_row, row_count,
+                identity_checksum, new_uuids, merge_position, updated_at
+            ) VALUES (
+                :name, :target, :run_id, :phase, :write_back, :start_row, :row_count,
+                :identity_checksum, :new_uuids, NULL, CURRENT_TIMESTAMP
+            )
+            ON CONFLICT (mapping_name) DO UPDATE SET
+                target_table = EXCLUDED.target_table,
+                run_id = EXCLUDED.run_id,
+                phase = EXCLUDED.phase,
+                write_back = EXCLUDED.write_back,
+                start_row = EXCLUDED.start_row,
+                row_count = EXCLUDED.row_count,
+                identity_checksum = EXCLUDED.identity_checksum,
+                new_uuids = EXCLUDED.new_uuids,
+                merge_position = NULL,
+                updated_at = CURRENT_TIMESTAMP
+        """), {
+            "name": mapping_name,
+            "target": target_table,
+            "run_id": run_id,
+            "phase": phase,
+            "write_back": Json(write_back, dumps=dumps) if write_back is not None else None,
+            "start_row": start_row,
+            "row_count": row_count,
+            "identity_checksum": identity_checksum,
+            "new_uuids": Json(list(new_uuids or []), dumps=dumps),
+        })
+
+def set_checkpoint_phase(engine, schema, mapping_name, phase):
+    # written_back is terminal: the stored payload is no longer needed
+    create_sync_checkpoints_table_if_not_exists(engine, schema)
+    clear = ", write_back = NULL, new_uuids = NULL" if phase == "written_back" else ""
+    settled = phase in ("written_back", "discarded")
+    if settled:
+        create_write_back_queue_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {schema}.sync_checkpoints
+            SET phase = :phase, updated_at = CURRENT_TIMESTAMP{clear}
+            WHERE mapping_name = :name
+        """), {"name": mapping_name, "phase": phase})
+        if settled:
+            # landed, or stale (its inserts were discarded): a queued copy must not be sent
+            conn.execute(text(f"""
+                DELETE FROM {schema}.write_back_queue WHERE mapping_name = :name
+            """), {"name": mapping_name})
+
+def set_merge_position(engine, schema, mapping_name, position):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {schema}.sync_checkpoints
+            SET merge_position = :position, updated_at = CURRENT_TIMESTAMP
+            WHERE mapping_name = :name
+        """), {"name": mapping_name, "position": position})
+
+def confirm_write_backs(engine, write_backs, flushed):
+    # written UUIDs close the checkpoint; a failed flush leaves it pending for the next run
+    for wb in write_backs:
+        if flushed.get(wb["name"]) and wb.get("schema"):
+            set_checkpoint_phase(engine, wb["schema"], wb["name"], "written_back")
+
+def discard_unsynced_inserts(engine, schema, target_table, new_uuids, uuid_col="internal_uuid"):
+    """
+    Remove rows a failed run inserted but never wrote back to the sheet. The sheet rows
+    are still uuid-less, so the next sync inserts them again under fresh UUIDs.
+    """
+    if not new_uuids:
+        return 0
+    with engine.begin() as conn:
+        res = conn.execute(text(f"""
+            DELETE FROM {schema}."{target_table}"
+            WHERE "{uuid_col}"::text = ANY(:uuids)
+        """), {"uuids": [str(u) for u in new_uuids]})
+    if res.rowcount:
+        record_table_change(engine, schema, target_table)
+    return res.rowcount
+
+def plan_append_tail(state, window, full_sync_interval_hours):
+    """
+    Decide whether an append-only mapping can read just its tail.
+    Returns (start_row, window_len) or None for a full sync.
+    """
+    if not state or state.get("row_count") is None or not state.get("tail_checksum"):
+        return None
+
+    full_synced_at = state.get("full_synced_at")
+    if full_synced_at is None:
+        return None
+    if full_sync_interval_hours:
+        age = datetime.datetime.now(datetime.timezone.utc) - full_synced_at
+        if age > datetime.timedelta(hours=full_sync_interval_hours):
+            return None
+
+    row_count = state["row_count"]
+    window_len = min(window, row_count)
+    # sheet row 1 is the header, data row i lives on sheet row i + 1
+    start_row = row_count - window_len + 2
+    return start_row, window_len
 
 # Figure out which rows to insert and which to update, depending on whether they already have an internal_uuid
 def split_rows(rows, uuid_col):
@@ -214,6 +1600,151 @@ def drop_table(engine, schema, table):
     with engine.begin() as conn:
         conn.execute(text(ddl))
 
+# --- columnar transform (mapping: columnar: true) ---
+# The stage works on one list per column instead of one dict per row: every transform is a
+# single comprehension over a column, and the result is COPYed into staging as-is.
+UUID_TEXT_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+# only strings containing a digit (or nan/inf) can be numericised; everything else is skipped
+NUMBERISH_RE = re.compile(r"\d|nan|inf", re.IGNORECASE)
+
+def grid_columns(grid, read_mode=None, date_columns=None):
+    """
+    Transpose a values grid (row 0 = header) into ({normalized column: [values]}, row_count).
+    Canonical grids are rendered to canonical text, formatted grids get the same
+    numericise text get_all_records() rows end up stored as.
+    """
+    if not grid:
+        return {}, 0
+    header = [canonical_cell_text(h) for h in grid[0]]
+    names = normalize_columns([h.strip().lstrip("\ufeff") for h in header])
+    width = len(names)
+    values = [
+        row if len(row) == width else (row + [""] * (width - len(row)))[:width]
+        for row in grid[1:]
+    ]
+    n_rows = len(values)
+    columns = list(zip(*values)) if values else [()] * width
+
+    date_columns = set(date_columns or [])
+    out = {}
+    for name, col in zip(names, columns):
+        if read_mode == "canonical":
+            is_date = name in date_columns
+            out[name] = [canonical_cell_text(v, is_date) for v in col]
+        else:
+            out[name] = coerce_text_column(col)
+    return out, n_rows
+
+def _numeric_text(v):
+    return _stored_text(gspread.utils.numericise(v))
+
+def _stored_text(n):
+    # the text Postgres stored for a numericise()d value sent through psycopg2
+    if n is None or n.__class__ is str:
+        return n
+    if isinstance(n, float) and not math.isfinite(n):
+        return "NaN" if n != n else ("Infinity" if n > 0 else "-Infinity")
+    return str(n)
+
+def rows_to_columns(rows):
+    """get_all_records()-style row dicts -> ({column: [stored text]}, row_count)."""
+    keys = list(rows[0].keys()) if rows else []
+    return {k: [_stored_text(r.get(k)) for r in rows] for k in keys}, len(rows)
+
+def coerce_text_column(values):
+    """Bulk equivalent of get_all_records()' numericise + TEXT storage for one column."""
+    search = NUMBERISH_RE.search
+    return [_numeric_text(v) if v.__class__ is str and search(v) else v for v in values]
+
+def clean_text_column(values):
+    """Trim whitespace and store empty cells as NULL (mapping: clean_values: true)."""
+    return [(v.strip() or None) if v.__class__ is str else v for v in values]
+
+def _take(values, order):
+    if len(order) == 1:
+        return [values[order[0]]]
+    return list(operator.itemgetter(*order)(values)) if order else []
+
+def columnar_stage(columns, n_rows, final_cols, uuid_col, processed_col, table_name, clean=False):
+    """
+    Turn sheet columns into staging columns in [existing uuids..., new rows...] order
+    (the order prepare_sheet_write_back expects from staging).
+    Returns (staged_columns, sheet_uuids, new_uuids); sheet_uuids is every row's uuid in
+    sheet order, new ones included (what the row path leaves in its row dicts).
+    """
+    raw = columns.get(uuid_col) or [""] * n_rows
+    sheet_uuids = [u.strip() if u.__class__ is str else ("" if u is None else str(u)) for u in raw]
+
+    bad = [i for i, u in enumerate(sheet_uuids, start=2) if u and not UUID_TEXT_RE.fullmatch(u)]
+    if bad:
+        raise RuntimeError(
+            f"[{table_name}] Invalid {uuid_col} values in sheet rows {bad[:10]}"
+            f"{' ...' if len(bad) > 10 else ''}. Aborting before staging."
+        )
+
+    upd_idx = [i for i, u in enumerate(sheet_uuids) if u]
+    ins_idx = [i for i, u in enumerate(sheet_uuids) if not u]
+    new_uuids = [str(uuid.uuid4()) for _ in ins_idx]
+    order = upd_idx + ins_idx
+
+    staged = {uuid_col: _take(sheet_uuids, upd_idx) + new_uuids}
+    for i, u in zip(ins_idx, new_uuids):
+        sheet_uuids[i] = u
+    for c in final_cols:
+        if c in (uuid_col, processed_col):
+            continue
+        col = columns.get(c)
+        if col is None:
+            # column exists in the DB but not on the sheet
+            print(f"[{table_name}] WARNING: column '{c}' exists in DB but not in sheet. Filling NULLs.")
+            staged[c] = [None] * n_rows
+            continue
+        if clean:
+            col = clean_text_column(col)
+        staged[c] = _take(col, order)
+
+    return staged, sheet_uuids, new_uuids
+
+def _copy_csv_field(v):
+    # CSV COPY reads an unquoted empty field as NULL and a quoted one as text, so every value is
+    # quoted and None is left empty: "", "\N" or "NULL" in a cell all stay text
+    if v is None:
+        return ""
+    return '"' + str(v).replace('"', '""') + '"'
+
+def copy_staging(engine, schema, target_table, staging_table, columns, processed_col="processed_at"):
+    """
+    Bulk-load staging columns with a single COPY ... FROM STDIN (CSV).
+    processed_col is filled by a NOW() column default, as load_staging does per row.
+    """
+    cols = [c for c in columns if c != processed_col]
+    n_rows = len(columns[cols[0]]) if cols else 0
+    if not n_rows:
+        print("no rows to load into staging")
+        return
+
+    data = [[_copy_csv_field(v) for v in columns[c]] for c in cols]
+    buf = io.StringIO("".join(",".join(row) + "\n" for row in zip(*data)))
+
+    quoted_cols = ", ".join([f'"{c}"' for c in cols])
+    copy_sql = (
+        f'COPY {schema}."{staging_table}" ({quoted_cols}) '
+        "FROM STDIN WITH (FORMAT csv)"
+    )
+
+    with engine.begin() as conn:
+        conn.execute(text(f'TRUNCATE {schema}."{staging_table}"'))
+        conn.execute(text(
+            f'ALTER TABLE {schema}."{staging_table}" ALTER COLUMN "{processed_col}" SET DEFAULT NOW()'
+        ))
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(copy_sql, buf)
+        finally:
+            cursor.close()
+
+    print(f"[{target_table}] Copied {n_rows} rows into staging")
+
 # Load data into staging table
 def load_staging(engine, schema, target_table, staging_table, rows, batch_size=300):
     if not rows:
@@ -240,10 +1771,141 @@ def load_staging(engine, schema, target_table, staging_table, rows, batch_size=3
 
     print(f"[{target_table}] Loaded {len(rows)} rows into staging")
 
-def create_target_table_if_not_exists(engine, schema, table, cols):
+# --- range-partitioned targets (mapping: partition_by) ---
+# The partition column is stored as DATE (parsed from the sheet text by Postgres); everything else
+# stays TEXT. A partitioned table can't have a unique key without the partition column, so
+# (internal_uuid, <column>) is UNIQUE NULLS NOT DISTINCT and the merge deletes every copy of a
+# merged uuid under another date in the same statement: a row whose date moved it to another
+# partition keeps its uuid, and no uuid is ever stored twice.
+PARTITION_INTERVALS = {"month": "1 month", "year": "1 year"}
+
+def partition_spec(m):
+    """partition_by: order_date | {column: order_date, interval: month|year} -> (column, interval) or None."""
+    spec = m.get("partition_by")
+    if not spec:
+        return None
+    if isinstance(spec, str):
+        spec = {"column": spec}
+    column = normalize_columns([spec["column"]])[0]
+    interval = spec.get("interval", "month")
+    if interval not in PARTITION_INTERVALS:
+        raise RuntimeError(f"partition_by interval must be one of {', '.join(PARTITION_INTERVALS)}, got {interval!r}")
+    if column in (m.get("uuid_col", "internal_uuid"), m.get("processed_col", "processed_at")):
+        raise RuntimeError(f"partition_by can't use the system column {column}")
+    return column, interval
+
+def partition_key_sql(expr):
+    # sheet text -> DATE; blank cells become NULL and land in the default partition
+    return f"NULLIF(btrim({expr}::text), '')::date"
+
+def check_partition_dates(engine, table_name, column, values, first_row=2):
+    """
+    Ask Postgres which partition_by values its ::date cast would reject, before anything is
+    staged: one bad cell would otherwise abort the whole merge with a bare cast error.
+    values are in sheet order starting at sheet row first_row. Needs Postgres 16 (pg_input_is_valid).
+    """
+    values = [None if v is None else str(_stored_text(v)) for v in values]
+    if not values:
+        return
+    with engine.connect() as conn:
+        bad = conn.execute(text("""
+            SELECT n, v
+            FROM unnest(CAST(:vals AS text[])) WITH ORDINALITY AS t(v, n)
+            WHERE NULLIF(btrim(v), '') IS NOT NULL
+            AND NOT pg_input_is_valid(btrim(v), 'date')
+            ORDER BY n
+            LIMIT 11
+        """), {"vals": values}).fetchall()
+    if bad:
+        listed = ", ".join(f"row {first_row + n - 1}: {v!r}" for n, v in bad[:10])
+        raise RuntimeError(
+            f"[{table_name}] partition_by column {column} has values that aren't dates ({listed}"
+            f"{' ...' if len(bad) > 10 else ''}). Aborting before staging."
+        )
+
+def partition_name(table, start, interval):
+    suffix = f"{start:%Y}" if interval == "year" else f"{start:%Y_%m}"
+    return f"{table}_p{suffix}"
+
+def is_partitioned_table(engine, schema, table):
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT c.relkind = 'p' FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = :table
+        """), {"schema": schema, "table": table}).scalar() or False
+
+def create_partitioned_table(conn, schema, table, cols, partition):
+    # parent + DEFAULT partition; no unique index yet (see ensure_partitioned_uuid_index)
+    column, _ = partition
+    if column not in cols:
+        raise RuntimeError(f"[{table}] partition_by column {column} is not a sheet column")
+    col_defs = []
+    for c, d in zip(cols, build_col_defs(cols)):
+        if c == column:
+            d = f'"{c}" DATE'
+        col_defs.append(d.replace(" PRIMARY KEY", " NOT NULL"))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {schema}."{table}" (
+            {", ".join(col_defs)}
+        ) PARTITION BY RANGE ("{column}")
+    """))
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {schema}."{table}_default" PARTITION OF {schema}."{table}" DEFAULT'))
+
+def ensure_partitioned_uuid_index(conn, schema, table, partition, pk="internal_uuid"):
+    column, _ = partition
+    conn.execute(text(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS "{table}_uuid_key"
+        ON {schema}."{table}" ("{pk}", "{column}") NULLS NOT DISTINCT
+    """))
+
+def ensure_target_partitions(conn, schema, table, partition, source):
+    """
+    Create the range partitions the rows of `source` (a table or CTE name) fall into.
+    Existing partitions are recognised by their bounds, not their names. Returns the created names.
+    """
+    column, interval = partition
+    unit = "year" if interval == "year" else "month"
+    key = partition_key_sql(f'"{column}"')
+    starts = conn.execute(text(f"""
+        SELECT DISTINCT date_trunc('{unit}', {key})::date FROM {source} WHERE {key} IS NOT NULL
+    """)).scalars().all()
+    bounds = conn.execute(text(f"""
+        SELECT pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:parent)
+    """), {"parent": f'{schema}."{table}"'}).scalars().all()
+    existing = set()
+    for b in bounds:
+        found = re.match(r"FOR VALUES FROM \('([0-9-]+)'\)", b or "")
+        if found:
+            existing.add(found.group(1))
+
+    created = []
+    for start in sorted(starts):
+        if start.isoformat() in existing:
+            continue
+        name = partition_name(table, start, interval)
+        conn.execute(text(f"""
+            CREATE TABLE {schema}."{name}" PARTITION OF {schema}."{table}"
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{start.isoformat()}'::date + interval '{PARTITION_INTERVALS[interval]}')
+        """))
+        created.append(name)
+    if created:
+        print(f"[{table}] created partition(s): {', '.join(created)}")
+    return created
+
+def create_target_table_if_not_exists(engine, schema, table, cols, partition=None):
     cols = normalize_columns(cols)
     col_defs = build_col_defs(cols)
 
+    if partition:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+            create_partitioned_table(conn, schema, table, cols, partition)
+            ensure_partitioned_uuid_index(conn, schema, table, partition)
+        return
+
     ddl_schema = text(f'CREATE SCHEMA IF NOT EXISTS {schema};')
     ddl_table = text(f"""
         CREATE TABLE IF NOT EXISTS {schema}."{table}" (
@@ -255,17 +1917,127 @@ def create_target_table_if_not_exists(engine, schema, table, cols):
         conn.execute(ddl_schema)
         conn.execute(ddl_table)
 
-def upsert_staging_into_target(engine, schema, staging, target, cols):
-    # defensive checks
-    if not isinstance(cols, (list, tuple)):
-        raise TypeError("cols must be a list/tuple of column names")
-    if "internal_uuid" not in cols:
-        raise ValueError("cols must include 'internal_uuid'")
-    if "processed_at" not in cols:
-        raise ValueError("cols must include 'processed_at'")
+NUMERIC_TEXT_RE = re.compile(r"[-+]?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?")
+
+def _display_insensitive(v):
+    # collapse differences that only come from display formatting: 1 / 1.0 / 1,000.00 / TRUE
+    if v is None:
+        return ""
+    s = str(v).strip()
+    if s.lower() in ("true", "false"):
+        return s.lower()
+    if NUMERIC_TEXT_RE.fullmatch(s):
+        return format(Decimal(s.replace(",", "")).normalize(), "f")
+    return s
 
+def count_formatting_only_updates(engine, schema, staging, target, cols, pk="internal_uuid", processed_col="processed_at"):
+    """
+    Of the rows the upsert is about to rewrite, count those whose differences are
+    purely display formatting. Must run before the upsert.
+    """
+    compare_cols = [c for c in cols if c not in (pk, processed_col)]
+    if not compare_cols:
+        return 0
+
+    select_list = ", ".join([f't."{c}"::text, s."{c}"::text' for c in compare_cols])
+    change_conditions = " OR ".join(
+        [f't."{c}"::text IS DISTINCT FROM s."{c}"::text' for c in compare_cols]
+    )
+    sql = text(f"""
+        SELECT {select_list}
+        FROM {schema}."{target}" t
+        JOIN {schema}."{staging}" s ON s."{pk}" = t."{pk}"
+        WHERE {change_conditions}
+    """)
+
+    formatting_only = 0
+    with engine.connect() as conn:
+        for row in conn.execute(sql):
+            pairs = zip(row[0::2], row[1::2])
+            if all(_display_insensitive(a) == _display_insensitive(b) for a, b in pairs):
+                formatting_only += 1
+    return formatting_only
+
+# --- change outbox ---
+# Mappings with publish_changes record every inserted/updated/deleted UUID in
+# <schema>.change_outbox, in the transaction that made the change, and NOTIFY
+# CHANGE_OUTBOX_CHANNEL once per table. Consumers keep the last outbox id they processed.
+def create_change_outbox_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.change_outbox (
+                id BIGSERIAL PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                internal_uuid UUID NOT NULL,
+                op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_change_outbox_created_brin
+            ON {schema}.change_outbox USING BRIN (created_at)
+        """))
+
+def lock_change_outbox(conn, schema):
+    # ids are handed out at insert time; serializing outbox writers until commit makes
+    # ids become visible in order, so "id > last seen" never skips a late commit
+    conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+        {"key": f"{schema}.change_outbox"},
+    )
+
+def notify_changes(conn, schema, table, run_id, last_id):
+    # delivered when the surrounding transaction commits, never for a rolled-back one;
+    # last_id comes back from the outbox insert itself (RETURNING id), no lookup needed
+    payload = json.dumps({"schema": schema, "table": table, "run_id": run_id, "last_id": last_id})
+    conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                 {"channel": CHANGE_OUTBOX_CHANNEL, "payload": payload})
+
+def read_change_outbox(engine, schema, after_id=0, tables=None, limit=10000):
+    """
+    Consumer side: changes after the last processed outbox id, oldest first.
+    Returns [{"id", "run_id", "table_name", "internal_uuid", "op", "created_at"}].
+    """
+    params = {"after": after_id, "limit": limit}
+    table_filter = ""
+    if tables:
+        table_filter = "AND table_name = ANY(:tables)"
+        params["tables"] = list(tables)
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT id, run_id, table_name, internal_uuid, op, created_at
+            FROM {schema}.change_outbox
+            WHERE id > :after {table_filter}
+            ORDER BY id
+            LIMIT :limit
+        """), params).mappings().all()
+    return [dict(r) for r in rows]
+
+def prune_change_outbox(engine, schema, retention_days=None):
+    retention_days = CHANGE_OUTBOX_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.change_outbox"}).scalar() is None:
+            return 0
+        return conn.execute(text(f"""
+            DELETE FROM {schema}.change_outbox
+            WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => :days)
+        """), {"days": retention_days}).rowcount
+
+def outbox_last_id_sql(outbox_run_id):
+    return "(SELECT MAX(id) FROM outboxed)" if outbox_run_id else "NULL::bigint"
+
+def _merge_ctes(schema, source, target, cols, pk, outbox_run_id=None, partition=None):
+    """
+    CTEs for one merge: upserted AS (INSERT ... SELECT FROM source ON CONFLICT DO UPDATE
+    ... RETURNING pk, inserted) plus, for publish_changes, the outbox insert fed by it.
+    Partitioned targets (partition=(column, interval)) also delete the old version of rows
+    whose partition key changed; they come back as updates.
+    """
     col_list = ", ".join([f'"{c}"' for c in cols])
-    pk = "internal_uuid"
     compare_cols = [c for c in cols if c not in (pk, "processed_at")]
 
     update_assignments = ", ".join(
@@ -276,21 +2048,81 @@ def upsert_staging_into_target(engine, schema, staging, target, cols):
         [f'target."{c}" IS DISTINCT FROM EXCLUDED."{c}"' for c in compare_cols]
     )
 
-    sql = f"""
-        WITH upserted AS (
+    # publish_changes: the outbox rows are written by the same statement as the merge
+    # (select outbox_last_id_sql(outbox_run_id) next to the counts for notify_changes)
+    outbox_cte = ""
+    if outbox_run_id:
+        outbox_cte = f"""
+        , outboxed AS (
+            INSERT INTO {schema}.change_outbox (run_id, table_name, internal_uuid, op)
+            SELECT :run_id, :table, "{pk}", CASE WHEN inserted THEN 'insert' ELSE 'update' END
+            FROM upserted
+            RETURNING id
+        )"""
+
+    if partition:
+        column, _ = partition
+        select_list = ", ".join(
+            partition_key_sql(f'"{c}"') if c == column else f'"{c}"' for c in cols
+        )
+        # xmax can't be read back from a partitioned table; every CTE sees the target as it was
+        # before the statement, so "inserted" is simply "uuid not there yet"
+        return f"""
+        moved AS (
+            DELETE FROM {schema}."{target}" t
+            USING {source} s
+            WHERE t."{pk}" = s."{pk}"
+            AND t."{column}" IS DISTINCT FROM {partition_key_sql(f's."{column}"')}
+        ),
+        merged AS (
+            INSERT INTO {schema}."{target}" AS target ({col_list})
+            SELECT {select_list}
+            FROM {source}
+            ON CONFLICT ("{pk}", "{column}") DO UPDATE SET
+                {update_assignments}
+            WHERE {change_conditions}
+            RETURNING "{pk}"
+        ),
+        upserted AS (
+            SELECT m."{pk}", NOT EXISTS (
+                SELECT 1 FROM {schema}."{target}" t WHERE t."{pk}" = m."{pk}"
+            ) AS inserted
+            FROM merged m
+        ){outbox_cte}"""
+
+    return f"""
+        upserted AS (
             INSERT INTO {schema}."{target}" AS target ({col_list})
             SELECT {col_list}
-            FROM {schema}."{staging}"
+            FROM {source}
             ON CONFLICT ("{pk}") DO UPDATE SET
                 {update_assignments}
             WHERE {change_conditions}
             RETURNING
                 "{pk}",
                 (xmax = 0) AS inserted
-        )
+        ){outbox_cte}"""
+
+def upsert_staging_into_target(engine, schema, staging, target, cols, outbox_run_id=None, partition=None):
+    # defensive checks
+    if not isinstance(cols, (list, tuple)):
+        raise TypeError("cols must be a list/tuple of column names")
+    if "internal_uuid" not in cols:
+        raise ValueError("cols must include 'internal_uuid'")
+    if "processed_at" not in cols:
+        raise ValueError("cols must include 'processed_at'")
+
+    pk = "internal_uuid"
+    if outbox_run_id:
+        create_change_outbox_table_if_not_exists(engine, schema)
+    merge = _merge_ctes(schema, f'{schema}."{staging}"', target, cols, pk, outbox_run_id, partition)
+
+    sql = f"""
+        WITH {merge}
         SELECT
             COUNT(*) FILTER (WHERE inserted) AS inserted,
-            COUNT(*) FILTER (WHERE NOT inserted) AS updated
+            COUNT(*) FILTER (WHERE NOT inserted) AS updated,
+            {outbox_last_id_sql(outbox_run_id)} AS last_id
         FROM upserted;
     """
 
@@ -301,11 +2133,18 @@ def upsert_staging_into_target(engine, schema, staging, target, cols):
         # print("FIRST TARGET ROW:")
         # print(conn.execute(text(f'SELECT * FROM {schema}."{target}" LIMIT 1')).fetchone())
 
-        result = conn.execute(text(sql)).fetchone()
+        if partition:
+            ensure_target_partitions(conn, schema, target, partition, f'{schema}."{staging}"')
+        if outbox_run_id:
+            lock_change_outbox(conn, schema)
+        result = conn.execute(text(sql), {"run_id": outbox_run_id, "table": target}).fetchone()
 
         inserted = result[0] or 0
         updated = result[1] or 0
 
+        if outbox_run_id and inserted + updated:
+            notify_changes(conn, schema, target, outbox_run_id, result[2])
+
         total = conn.execute(
             text(f'SELECT COUNT(*) FROM {schema}."{staging}"')
         ).scalar()
@@ -326,33 +2165,130 @@ def upsert_staging_into_target(engine, schema, staging, target, cols):
             "processed_uuids": processed_uuids,
         }
 
-def update_sheet_with_results(engine, worksheet, processed_uuids, schema, target_table, uuid_col, processed_col, insert_count, update_count, original_rows=None):
+def upsert_staging_in_chunks(engine, schema, staging, target, cols, chunk_rows,
+                             after=None, outbox_run_id=None, on_chunk=None, partition=None):
+    """
+    Same merge as upsert_staging_into_target, in staging-key order, chunk_rows keys per
+    statement, so row locks and WAL are bounded per chunk. on_chunk(last_key, chunk_result)
+    runs after every chunk; with a MappingSession it is where the chunk gets committed.
+    after: resume behind this key (keys up to it were merged by an interrupted run).
+    Returns the combined counts and processed_uuids like upsert_staging_into_target.
+    """
+
+    if not isinstance(cols, (list, tuple)):
+        raise TypeError("cols must be a list/tuple of column names")
+    if "internal_uuid" not in cols or "processed_at" not in cols:
+        raise ValueError("cols must include 'internal_uuid' and 'processed_at'")
+    if int(chunk_rows) < 1:
+        raise ValueError("chunk_rows must be a positive integer")
+
+    pk = "internal_uuid"
+    col_list = ", ".join([f'"{c}"' for c in cols])
+    if outbox_run_id:
+        create_change_outbox_table_if_not_exists(engine, schema)
+    merge = _merge_ctes(schema, "chunk", target, cols, pk, outbox_run_id, partition)
+    # keyset chunk: the staging primary key index makes every chunk an index range scan
+    sql = text(f"""
+        WITH chunk AS (
+            SELECT {col_list}
+            FROM {schema}."{staging}"
+            WHERE "{pk}" > CAST(:after AS UUID)
+            ORDER BY "{pk}"
+            LIMIT :limit
+        ),
+        {merge}
+        SELECT
+            (SELECT COUNT(*) FROM chunk) AS rows,
+            (SELECT "{pk}"::text FROM chunk ORDER BY "{pk}" DESC LIMIT 1) AS last_key,
+            COUNT(*) FILTER (WHERE inserted) AS inserted,
+            COUNT(*) FILTER (WHERE NOT inserted) AS updated,
+            {outbox_last_id_sql(outbox_run_id)} AS last_id
+        FROM upserted
+    """)
+
+    with engine.connect() as conn:
+        total = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."{staging}"')).scalar()
+        if after:
+            skipped = conn.execute(text(f"""
+                SELECT COUNT(*) FROM {schema}."{staging}" WHERE "{pk}" <= CAST(:after AS UUID)
+            """), {"after": after}).scalar()
+        else:
+            skipped = 0
+    if skipped:
+        print(f"[{target}] resuming chunked merge after key {after} ({skipped}/{total} rows already merged)")
+    if partition:
+        with engine.begin() as conn:
+            ensure_target_partitions(conn, schema, target, partition, f'{schema}."{staging}"')
+
+    position = after or "00000000-0000-0000-0000-000000000000"
+    inserted = updated = 0
+    done = skipped
+    chunk_no = 0
+    while True:
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            if outbox_run_id:
+                lock_change_outbox(conn, schema)
+            row = conn.execute(sql, {
+                "after": position, "limit": int(chunk_rows), "run_id": outbox_run_id, "table": target,
+            }).fetchone()
+            if not row[0]:
+                break
+            chunk = {"rows": row[0], "inserted": row[2] or 0, "updated": row[3] or 0}
+            if outbox_run_id and chunk["inserted"] + chunk["updated"]:
+                notify_changes(conn, schema, target, outbox_run_id, row[4])
+        position = row[1]
+        chunk_no += 1
+        done += chunk["rows"]
+        inserted += chunk["inserted"]
+        updated += chunk["updated"]
+        if on_chunk is not None:
+            on_chunk(position, chunk)
+        print(
+            f"[{target}] merge chunk {chunk_no}: {chunk['rows']} rows "
+            f"(+{chunk['inserted']} ~{chunk['updated']}) {done}/{total} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    with engine.connect() as conn:
+        processed_uuids = [r[0] for r in conn.execute(
+            text(f'SELECT "{pk}" FROM {schema}."{staging}"')
+        ).fetchall()]
+
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": total - (inserted + updated),
+        "processed_uuids": processed_uuids,
+        "chunks": chunk_no,
+    }
+
+# Write-back payloads are built right after the upsert commits but only sent once every
+# mapping is done, so all tabs of a spreadsheet go out in as few values.batchUpdate calls as possible.
+def prepare_sheet_write_back(engine, worksheet, processed_uuids, schema, target_table, uuid_col, processed_col, insert_count, update_count, original_rows=None, headers=None, sheet_id=None, name=None, start_row=2):
+    """
+    Build (but do not send) the uuid / processed_at column write-back for one tab.
+    Returns None when the tab has no data rows.
+    """
 
        # defensive checks
     if processed_uuids is None or not isinstance(processed_uuids, (list, tuple)):
         raise ValueError("processed_uuids must be a list/tuple of uuid strings")
 
-    # read header row from sheet and ensure columns exist
-    headers = worksheet.row_values(1)
+    # header row: reuse the caller's copy when given, otherwise read it
+    if headers is None:
+        headers = worksheet.row_values(1)
     # normalize header values (strip BOM/spaces)
     headers = [h.strip().lstrip("\ufeff") for h in headers]
 
-    # add missing header columns to the sheet (append to end)
-    header_modified = False
-    if header_modified:
-        # write full header back (safe: small operation)
-        worksheet.update("1:1", [headers])
-
-    # refresh headers & compute column indexes (1-based)
-    headers = worksheet.row_values(1)
-    headers = [h.strip().lstrip("\ufeff") for h in headers]
+    # compute column indexes (1-based)
     try:
         uuid_idx = headers.index(uuid_col) + 1
         processed_idx = headers.index(processed_col) + 1
     except ValueError as e:
         raise RuntimeError("Failed to locate uuid/processed columns after ensuring headers.") from e
 
-     # original_rows corresponds to sheet rows starting at row 2
+     # original_rows corresponds to sheet rows starting at start_row (row 2 unless syncing a tail)
     if original_rows is None:
         # get_all_records() caller already had rows; fallback: re-read so function can operate alone
         original_rows = worksheet.get_all_records()
@@ -360,12 +2296,12 @@ def update_sheet_with_results(engine, worksheet, processed_uuids, schema, target
     total_rows = len(original_rows)
     if total_rows == 0:
         print("No data rows found to update.")
-        return
+        return None
 
         # Build list of sheet row numbers (1-based) and determine which rows lacked uuid originally
     rows_missing_uuid_idx = []   # list of 1-based sheet row numbers that need uuids
     existing_uuids = []          # uuids already present in sheet (for updates)
-    for i, r in enumerate(original_rows, start=2):  # sheet rows start at 2
+    for i, r in enumerate(original_rows, start=start_row):  # sheet rows start at start_row
         uid = (r.get(uuid_col, "") or "").strip()
         if uid:
             existing_uuids.append(uid)
@@ -432,47 +2368,621 @@ def update_sheet_with_results(engine, worksheet, processed_uuids, schema, target
     processed_col_values = [[ uuid_to_processed.get(val, "") ] for val in final_uuids]
 
     # Build range strings for batch updates
-    start_row = 2
-    end_row = total_rows + 1
+    end_row = start_row + total_rows - 1
     uuid_range = gspread.utils.rowcol_to_a1(start_row, uuid_idx) + ":" + gspread.utils.rowcol_to_a1(end_row, uuid_idx)
     processed_range = gspread.utils.rowcol_to_a1(start_row, processed_idx) + ":" + gspread.utils.rowcol_to_a1(end_row, processed_idx)
 
-    worksheet.update(
-        values=internal_uuid_column_values,
-        range_name=uuid_range,
-        value_input_option="RAW"
-    )
+    return {
+        "name": name or target_table,
+        "schema": schema,
+        "sheet_id": sheet_id,
+        "sheet_name": worksheet.title,
+        "target_table": target_table,
+        "data": [
+            {"range": uuid_range, "values": internal_uuid_column_values},
+            {"range": processed_range, "values": processed_col_values},
+        ],
+        "insert_count": insert_count,
+        "update_count": update_count,
+    }
 
-    worksheet.update(
-        values=processed_col_values,
-        range_name=processed_range,
-        value_input_option="RAW"
+def update_sheet_with_results(engine, worksheet, processed_uuids, schema, target_table, uuid_col, processed_col, insert_count, update_count, original_rows=None):
+    # immediate, single-tab write-back (one request for both columns)
+    write_back = prepare_sheet_write_back(
+        engine, worksheet, processed_uuids, schema, target_table, uuid_col, processed_col,
+        insert_count, update_count, original_rows=original_rows
     )
+    if write_back is None:
+        return
+
+    worksheet.batch_update(write_back["data"], value_input_option="RAW")
 
     print(f"[{target_table}] Sheet updated")
     print(f"[{target_table}] Internal_uuid written: {insert_count}")
     print(f"[{target_table}] Processed_at updated: {update_count}")
 
-def create_deleted_log_table_if_not_exists(engine, schema):
-    create_table_sql = f"""
-        CREATE TABLE IF NOT EXISTS {schema}.deleted_rows_log (
-            internal_uuid UUID,
-            table_name TEXT,
-            deleted_timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-            deleted_row_json JSONB
-        );
+def _split_write_back(write_back, max_cells):
+    # split a tab's column ranges into row chunks so no single chunk exceeds max_cells
+    chunks = []
+    for d in write_back["data"]:
+        grid = gspread.utils.a1_range_to_grid_range(d["range"])
+        start_row = grid["startRowIndex"] + 1
+        start_col = grid["startColumnIndex"] + 1
+        end_col = grid["endColumnIndex"]
+        width = max(end_col - start_col + 1, 1)
+        step = max(max_cells // width, 1)
+        for i in range(0, len(d["values"]), step):
+            values = d["values"][i:i + step]
+            rng = (
+                gspread.utils.rowcol_to_a1(start_row + i, start_col) + ":" +
+                gspread.utils.rowcol_to_a1(start_row + i + len(values) - 1, end_col)
+            )
+            chunks.append({
+                "range": gspread.utils.absolute_range_name(write_back["sheet_name"], rng),
+                "values": values,
+                "cells": len(values) * width,
+            })
+    return chunks
+
+def flush_write_backs(write_backs, max_cells=None, attempts=None):
+    """
+    Send pending write-backs grouped per spreadsheet, packing as many tabs as fit
+    into each values.batchUpdate request (bounded by max_cells).
+    Returns {mapping name: True/False}; failed tabs can be flushed again later
+    without re-running any DB phase.
+    """
+    if max_cells is None:
+        max_cells = WRITE_BACK_MAX_CELLS
+    if attempts is None:
+        attempts = WRITE_BACK_FLUSH_ATTEMPTS
+
+    results = {}
+    by_spreadsheet = {}
+    for wb in write_backs:
+        if wb is None:
+            continue
+        by_spreadsheet.setdefault(wb["sheet_id"], []).append(wb)
+
+    if not by_spreadsheet:
+        return results
+
+    gc = get_gspread_client()
+
+    for sheet_id, tabs in by_spreadsheet.items():
+        # pack tabs into batches; a tab that is bigger than max_cells gets split across batches
+        batches = []
+        current, current_cells = [], 0
+        for wb in tabs:
+            for chunk in _split_write_back(wb, max_cells):
+                if current and current_cells + chunk["cells"] > max_cells:
+                    batches.append(current)
+                    current, current_cells = [], 0
+                current.append((wb["name"], chunk))
+                current_cells += chunk["cells"]
+        if current:
+            batches.append(current)
+
+        try:
+            spreadsheet = google_call("open", sheet_id, lambda: gc.open_by_key(sheet_id), hedge=True)
+        except Exception as e:
+            print(f"[{sheet_id}] Write-back failed to open spreadsheet: {e}")
+            for wb in tabs:
+                results[wb["name"]] = False
+            continue
+
+        for wb in tabs:
+            results[wb["name"]] = True
+
+        for batch in batches:
+            names = {n for n, _ in batch}
+            # a tab already failed in an earlier batch: don't half-write it further
+            batch = [(n, c) for n, c in batch if results[n]]
+            if not batch:
+                continue
+
+            body = {
+                "valueInputOption": "RAW",
+                "data": [{"range": c["range"], "values": c["values"]} for _, c in batch],
+            }
+            # RAW values at fixed ranges: safe to retry, but never hedged
+            try:
+                google_call("write", sheet_id, lambda: spreadsheet.values_batch_update(body), attempts=attempts)
+            except Exception as e:
+                print(f"[{sheet_id}] Write-back batch failed: {e}")
+                for n in names:
+                    results[n] = False
+
+        print(f"[{sheet_id}] Write-back: {len(tabs)} tab(s) in {len(batches)} request(s)")
+
+    for wb in write_backs:
+        if wb is None:
+            continue
+        if results.get(wb["name"]):
+            print(f"[{wb['target_table']}] Sheet updated")
+            print(f"[{wb['target_table']}] Internal_uuid written: {wb['insert_count']}")
+            print(f"[{wb['target_table']}] Processed_at updated: {wb['update_count']}")
+        else:
+            print(f"[{wb['target_table']}] Sheet update FAILED; DB is up to date, retry write-back only")
+
+    return results
+
+# --- durable write-back queue ---
+# One outstanding write-back per mapping, stored once the mapping's DB phases have committed.
+# Only the run that queued an entry sends it: a later run first re-validates the mapping's
+# checkpoint (resume_checkpoint), which re-queues the payload or settles it and drops the entry.
+def create_write_back_queue_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.write_back_queue (
+                mapping_name TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                sheet_id TEXT,
+                payload JSONB NOT NULL,
+                enqueued_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT
+            )
+        """))
+
+def enqueue_write_back(engine, write_back, run_id):
+    schema = write_back["schema"]
+    create_write_back_queue_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.write_back_queue (mapping_name, run_id, sheet_id, payload)
+            VALUES (:name, :run_id, :sheet_id, :payload)
+            ON CONFLICT (mapping_name) DO UPDATE SET
+                run_id = EXCLUDED.run_id,
+                sheet_id = EXCLUDED.sheet_id,
+                payload = EXCLUDED.payload,
+                enqueued_at = CURRENT_TIMESTAMP,
+                attempts = 0,
+                next_attempt_at = CURRENT_TIMESTAMP,
+                last_error = NULL
+        """), {
+            "name": write_back["name"],
+            "run_id": run_id,
+            "sheet_id": write_back["sheet_id"],
+            "payload": Json(write_back, dumps=lambda o: json.dumps(o, default=str)),
+        })
+
+def pending_write_backs(engine, schema, run_id, ready_only=True):
+    # this run's queued payloads, oldest first; ready_only skips entries still backing off
+    ready = "AND next_attempt_at <= CURRENT_TIMESTAMP" if ready_only else ""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT payload FROM {schema}.write_back_queue
+            WHERE run_id = :run_id {ready}
+            ORDER BY enqueued_at
+        """), {"run_id": run_id}).fetchall()
+    return [r[0] for r in rows]
+
+def retry_write_back_later(engine, schema, mapping_name, error, base_seconds=None):
+    base = WRITE_BACK_RETRY_SECONDS if base_seconds is None else base_seconds
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {schema}.write_back_queue
+            SET attempts = attempts + 1,
+                last_error = :error,
+                next_attempt_at = CURRENT_TIMESTAMP
+                    + make_interval(secs => LEAST(:base * power(2, attempts), 300))
+            WHERE mapping_name = :name
+        """), {"name": mapping_name, "error": error, "base": base})
+
+def write_back_queue_metrics(engine, schema):
+    """Depth, age of the oldest entry (seconds) and entries that already failed at least once."""
+    create_write_back_queue_table_if_not_exists(engine, schema)
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT COUNT(*) AS depth,
+                   COALESCE(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(enqueued_at)), 0)::float AS oldest_age_s,
+                   COUNT(*) FILTER (WHERE attempts > 0) AS retrying
+            FROM {schema}.write_back_queue
+        """)).mappings().one()
+    return dict(row)
+
+def print_write_back_queue(engine, schemas):
+    lines = []
+    for schema in sorted(schemas):
+        try:
+            q = write_back_queue_metrics(engine, schema)
+        except Exception as e:
+            print(f"[{schema}.write_back_queue] metrics failed: {e}")
+            continue
+        if q["depth"]:
+            lines.append(f"[{schema}] depth={q['depth']} oldest={q['oldest_age_s']:.0f}s retrying={q['retrying']}")
+    if lines:
+        print("==== write-back queue ====")
+        for line in lines:
+            print(line)
+
+class WriteBackDrainer:
+    """
+    Sends a run's queued write-backs from a background thread, so a slow or throttled Google
+    write never holds up the next mapping. Whatever is queued when the thread wakes goes out
+    together (flush_write_backs packs it per spreadsheet); a failed tab is retried with
+    exponential backoff, and close() makes a last attempt at everything still queued.
+    A flushed tab closes its checkpoint, which also removes the queue entry.
+    """
+
+    def __init__(self, engine, run_id, stats, batch_wait=None):
+        self.engine = engine
+        self.run_id = run_id
+        self.stats = stats
+        self.batch_wait = WRITE_BACK_BATCH_WAIT if batch_wait is None else batch_wait
+        self.schemas = set()
+        self.results = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def enqueue(self, write_back):
+        enqueue_write_back(self.engine, write_back, self.run_id)
+        self.schemas.add(write_back["schema"])
+        self.results.pop(write_back["name"], None)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-back-drainer", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        _THREAD_CONTEXT.stats = self.stats
+        while not self._stopping.is_set():
+            if self._wake.wait(1.0):
+                self._wake.clear()
+                # give mappings finishing right now a moment to join this batch
+                self._stopping.wait(self.batch_wait)
+            self._drain(ready_only=True)
+        self._drain(ready_only=False)
+
+    def _drain(self, ready_only):
+        try:
+            payloads = []
+            for schema in sorted(self.schemas):
+                payloads += pending_write_backs(self.engine, schema, self.run_id, ready_only)
+            if not payloads:
+                return
+            self.stats.phase("write_back_flush")
+            try:
+                flushed = flush_write_backs(payloads)
+            finally:
+                self.stats._close_phase()
+            for wb in payloads:
+                self.results[wb["name"]] = bool(flushed.get(wb["name"]))
+                if self.results[wb["name"]]:
+                    set_checkpoint_phase(self.engine, wb["schema"], wb["name"], "written_back")
+                else:
+                    retry_write_back_later(self.engine, wb["schema"], wb["name"], f"flush failed in run {self.run_id}")
+        except Exception as e:
+            print(f"[write_back] drain failed: {e}")
+            traceback.print_exc()
+
+    def close(self):
+        """Stop the thread after a final pass; returns {mapping name: flushed} for this run."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        return dict(self.results)
+
+# --- sheet-side archival (mapping: archive) ---
+# Rows matching the mapping's archive predicate are recorded in <schema>.archived_rows and
+# deleted from the tab; they stay in the target table, and deletion detection skips them.
+def create_archived_rows_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.archived_rows (
+                table_name TEXT NOT NULL,
+                internal_uuid UUID NOT NULL,
+                archived_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                run_id TEXT,
+                PRIMARY KEY (table_name, internal_uuid)
+            )
+        """))
+
+def archive_predicate_sql(spec):
+    """
+    archive: {column: sold_on, older_than_months: 6} (or older_than_days), or
+    archive: {where: "status = 'closed'"} -- a SQL condition on the target's columns.
+    where is trusted config: it goes into the query as written, so only a single condition
+    (no ";") is accepted.
+    """
+    if spec.get("where"):
+        if ";" in spec["where"]:
+            raise RuntimeError("archive: where must be a single SQL condition (no ';')")
+        return f"({spec['where']})"
+    if not spec.get("column"):
+        raise RuntimeError("archive needs either where, or column with older_than_months / older_than_days")
+    months = int(spec.get("older_than_months") or 0)
+    days = int(spec.get("older_than_days") or 0)
+    if months <= 0 and days <= 0:
+        raise RuntimeError("archive: older_than_months or older_than_days must be positive")
+    key = partition_key_sql('"' + normalize_columns([spec["column"]])[0] + '"')
+    return f"{key} < CURRENT_DATE - make_interval(months => {months}, days => {days})"
+
+def archive_sheet_rows(engine, m, run_id=None):
+    """
+    Move the rows matching the mapping's archive predicate off the sheet:
+    1. the matching uuids are read from the target
+    2. the tab's uuid column is re-read so positions are current
+    3. those uuids are recorded in archived_rows (committed before the sheet is touched, so a
+       failure never turns them into deletions)
+    4. the uuid column is read once more; if any row moved since 2 (an edit, insert or sort
+       meanwhile), the entries made in 3 are removed and the archival waits for the next run
+    5. one spreadsheets.batchUpdate deletes the row ranges, bottom-most first; if it fails, the
+       entries made in 3 are removed again for every row still on the sheet
+    Must run after the tab's write-back landed. Returns {"archived": rows removed, "ranges": n}.
+    """
+    spec = m.get("archive") or {}
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    sheet_name = m.get("sheet_name")
+    uuid_col = m.get("uuid_col", "internal_uuid")
+    predicate = archive_predicate_sql(spec)
+
+    create_archived_rows_table_if_not_exists(engine, schema)
+    with engine.connect() as conn:
+        candidates = {str(u) for u in conn.execute(text(f"""
+            SELECT t."{uuid_col}" FROM {schema}."{target_table}" t
+            WHERE {predicate}
+            AND NOT EXISTS (
+                SELECT 1 FROM {schema}.archived_rows a
+                WHERE a.table_name = :table AND a.internal_uuid = t."{uuid_col}"::uuid
+            )
+        """), {"table": target_table}).scalars()}
+    if not candidates:
+        return {"archived": 0, "ranges": 0}
+
+    gc = get_gspread_client()
+
+    def _read():
+        spreadsheet = gc.open_by_key(m.get("sheet_id"))
+        ws = spreadsheet.worksheet(sheet_name)
+        header = header_names(ws.row_values(1))
+        if uuid_col not in header:
+            raise RuntimeError(f"[{name}] {uuid_col} column not found on the sheet")
+        return spreadsheet, ws, ws.col_values(header.index(uuid_col) + 1)
+
+    spreadsheet, ws, sheet_uuids = google_call("read", sheet_name, _read, hedge=True)
+    rows = [i for i, u in enumerate(sheet_uuids, start=1) if i > 1 and str(u).strip() in candidates]
+    max_rows = int(spec.get("max_rows") or 0)
+    if max_rows:
+        rows = rows[:max_rows]
+    if not rows:
+        return {"archived": 0, "ranges": 0}
+
+    with engine.begin() as conn:
+        recorded = [str(u) for u in conn.execute(text(f"""
+            INSERT INTO {schema}.archived_rows (table_name, internal_uuid, run_id)
+            SELECT :table, u::uuid, :run_id FROM unnest(CAST(:uuids AS text[])) u
+            ON CONFLICT (table_name, internal_uuid) DO NOTHING
+            RETURNING internal_uuid
+        """), {"table": target_table, "run_id": run_id, "uuids": [str(sheet_uuids[i - 1]).strip() for i in rows]}).scalars()]
+
+    # deleteDimension goes by position: make sure every row is still where it was read
+    expected = {i: str(sheet_uuids[i - 1]).strip() for i in rows}
+    _, _, fresh = google_call("read", sheet_name, _read, hedge=True)
+    moved = [i for i, u in expected.items() if i > len(fresh) or str(fresh[i - 1]).strip() != u]
+    if moved:
+        drop_archived_entries(engine, schema, target_table, recorded)
+        print(f"[{name}] {len(moved)} row(s) to archive moved on the sheet since it was read; "
+              f"archival skipped until the next run")
+        return {"archived": 0, "ranges": 0}
+
+    # bottom-most range first so the positions of the remaining ranges don't move
+    requests = [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last,
+        }}}
+        for first, last in reversed(_column_blocks(rows))
+    ]
+    # not idempotent: a retry after a lost response would delete other rows
+    try:
+        google_call("write", sheet_name, lambda: spreadsheet.batch_update({"requests": requests}), attempts=1)
+    except Exception:
+        unarchive_rows_still_on_sheet(engine, m, recorded, _read)
+        raise
+    print(f"[{name}] archived {len(rows)} rows off the sheet in {len(requests)} range(s)")
+    return {"archived": len(rows), "ranges": len(requests)}
+
+def unarchive_rows_still_on_sheet(engine, m, recorded, read):
     """
+    After a failed archival batchUpdate: drop this run's archived_rows entries for the rows the
+    tab still has, so they are synced (and archived on a later run) like any other row.
+    The tab is re-read first, since a lost response may hide a delete that did go through; if that
+    read fails too, the entries stay (a row kept on the sheet beats a row deleted from the target).
+    """
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    sheet_name = m.get("sheet_name")
+    if not recorded:
+        return 0
+    try:
+        _, _, sheet_uuids = google_call("read", sheet_name, read, hedge=True)
+    except Exception as e:
+        print(f"[{target_table}] archival failed and the tab couldn't be re-read, keeping {len(recorded)} archived_rows entries: {e}")
+        return 0
+    on_sheet = {str(u).strip() for u in sheet_uuids}
+    still_there = [u for u in recorded if u in on_sheet]
+    if still_there:
+        drop_archived_entries(engine, schema, target_table, still_there)
+        print(f"[{target_table}] archival failed, {len(still_there)} rows left on the sheet and un-archived")
+    return len(still_there)
+
+def drop_archived_entries(engine, schema, target_table, uuids):
+    if not uuids:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            DELETE FROM {schema}.archived_rows
+            WHERE table_name = :table AND internal_uuid = ANY(CAST(:uuids AS uuid[]))
+        """), {"table": target_table, "uuids": list(uuids)})
+
+def deleted_log_partition_name(month_start):
+    # one partition per calendar month, e.g. deleted_rows_log_2025_03
+    return f"deleted_rows_log_{month_start:%Y_%m}"
+
+def _add_months(d, months):
+    total = d.year * 12 + (d.month - 1) + months
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+def ensure_deleted_log_partition(conn, schema, month_start):
+    # Create the monthly partition that holds rows deleted during month_start's month
+    month_start = datetime.date(month_start.year, month_start.month, 1)
+    month_end = _add_months(month_start, 1)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {schema}."{deleted_log_partition_name(month_start)}"
+        PARTITION OF {schema}.deleted_rows_log
+        FOR VALUES FROM ('{month_start.isoformat()}') TO ('{month_end.isoformat()}')
+    """))
+
+def _deleted_log_relkind(conn, schema):
+    # 'p' = partitioned (current layout), 'r' = plain heap (pre-1.6.0 layout), None = missing
+    return conn.execute(text("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema
+        AND c.relname = 'deleted_rows_log'
+    """), {"schema": schema}).scalar()
+
+def _deleted_log_compression_clause(conn):
+    # only ask for a compression method the server was actually built with
+    if not DELETED_LOG_COMPRESSION:
+        return ""
+    supported = conn.execute(text("""
+        SELECT :method = ANY(enumvals)
+        FROM pg_settings
+        WHERE name = 'default_toast_compression'
+    """), {"method": DELETED_LOG_COMPRESSION}).scalar()
+    if not supported:
+        print(f"[deleted_rows_log] compression '{DELETED_LOG_COMPRESSION}' not supported by server, using default")
+        return ""
+    return f" COMPRESSION {DELETED_LOG_COMPRESSION}"
 
-    create_index_sql = f"""
-        CREATE INDEX IF NOT EXISTS idx_deleted_uuid_table
-        ON {schema}.deleted_rows_log (internal_uuid, table_name);
+def create_deleted_log_table_if_not_exists(engine, schema):
+    """
+    deleted_rows_log is range partitioned by month on deleted_timestamp so that
+    retention can drop whole partitions instead of DELETE-ing rows.
+    A pre-existing unpartitioned log is migrated in place (same transaction).
+    """
+    with engine.begin() as conn:
+        relkind = _deleted_log_relkind(conn, schema)
+
+        if relkind == "r":
+            print(f"[{schema}.deleted_rows_log] migrating unpartitioned log to monthly partitions")
+            conn.execute(text(f"ALTER TABLE {schema}.deleted_rows_log RENAME TO deleted_rows_log_legacy"))
+
+        compression = _deleted_log_compression_clause(conn)
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.deleted_rows_log (
+                internal_uuid UUID,
+                table_name TEXT,
+                deleted_timestamp TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                deleted_row_json JSONB{compression}
+            ) PARTITION BY RANGE (deleted_timestamp);
+        """))
+
+        if relkind == "r":
+            months = conn.execute(text(f"""
+                SELECT DISTINCT date_trunc('month', COALESCE(deleted_timestamp, CURRENT_TIMESTAMP))::date
+                FROM {schema}.deleted_rows_log_legacy
+            """)).fetchall()
+            for (month_start,) in months:
+                ensure_deleted_log_partition(conn, schema, month_start)
+
+            moved = conn.execute(text(f"""
+                INSERT INTO {schema}.deleted_rows_log
+                (internal_uuid, table_name, deleted_timestamp, deleted_row_json)
+                SELECT internal_uuid, table_name, COALESCE(deleted_timestamp, CURRENT_TIMESTAMP), deleted_row_json
+                FROM {schema}.deleted_rows_log_legacy
+            """)).rowcount
+            # legacy table owns the old idx_deleted_uuid_table name, drop it before re-creating indexes
+            conn.execute(text(f"DROP TABLE {schema}.deleted_rows_log_legacy"))
+            print(f"[{schema}.deleted_rows_log] migrated rows: {moved}")
+
+        # lookups by row / table
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_deleted_uuid_table
+            ON {schema}.deleted_rows_log (internal_uuid, table_name);
+        """))
+        # rows arrive in deleted_timestamp order, so a BRIN index stays tiny and prunes time-range audits
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_deleted_timestamp_brin
+            ON {schema}.deleted_rows_log USING brin (deleted_timestamp);
+        """))
+
+        current_month = conn.execute(text("SELECT date_trunc('month', CURRENT_TIMESTAMP)::date")).scalar()
+        ensure_deleted_log_partition(conn, schema, current_month)
+
+def apply_deleted_log_retention(engine, schema, retention_months=None):
     """
+    Roll up and drop deleted_rows_log partitions whose whole month is older than
+    retention_months. Per-table counts are kept in deleted_rows_log_rollup.
+    """
+    if retention_months is None:
+        retention_months = DELETED_LOG_RETENTION_MONTHS
+    if not retention_months or retention_months <= 0:
+        return []
 
+    dropped = []
     with engine.begin() as conn:
-        conn.execute(text(create_table_sql))
-        conn.execute(text(create_index_sql))
+        if _deleted_log_relkind(conn, schema) != "p":
+            return []
+
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.deleted_rows_log_rollup (
+                table_name TEXT,
+                month DATE,
+                rows_deleted BIGINT,
+                rolled_up_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (table_name, month)
+            );
+        """))
+
+        current_month = conn.execute(text("SELECT date_trunc('month', CURRENT_TIMESTAMP)::date")).scalar()
+        cutoff = _add_months(current_month, -retention_months)
+
+        partitions = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = :schema
+            AND p.relname = 'deleted_rows_log'
+        """), {"schema": schema}).fetchall()
+
+        for (relname,) in partitions:
+            m = re.fullmatch(r"deleted_rows_log_(\d{4})_(\d{2})", relname)
+            if not m:
+                continue
+            month_start = datetime.date(int(m.group(1)), int(m.group(2)), 1)
+            if month_start >= cutoff:
+                continue
 
-def handle_deleted_rows(engine, schema, target_table, sheet_uuids):
+            conn.execute(text(f"""
+                INSERT INTO {schema}.deleted_rows_log_rollup (table_name, month, rows_deleted)
+                SELECT table_name, :month, COUNT(*)
+                FROM {schema}."{relname}"
+                GROUP BY table_name
+                ON CONFLICT (table_name, month) DO UPDATE
+                SET rows_deleted = {schema}.deleted_rows_log_rollup.rows_deleted + EXCLUDED.rows_deleted,
+                    rolled_up_at = CURRENT_TIMESTAMP
+            """), {"month": month_start})
+            conn.execute(text(f'DROP TABLE {schema}."{relname}"'))
+            dropped.append(relname)
+
+    if dropped:
+        print(f"[{schema}.deleted_rows_log] retention dropped partitions: {', '.join(sorted(dropped))}")
+    return dropped
+
+def handle_deleted_rows(engine, schema, target_table, sheet_uuids, outbox_run_id=None):
     # ---- SAFETY: if sheet has zero uuids, do NOT delete anything ----
     if not sheet_uuids:
         raise RuntimeError(
@@ -487,14 +2997,21 @@ def handle_deleted_rows(engine, schema, target_table, sheet_uuids):
     """
 
     create_deleted_log_table_if_not_exists(engine, schema)
+    create_archived_rows_table_if_not_exists(engine, schema)
+    if outbox_run_id:
+        create_change_outbox_table_if_not_exists(engine, schema)
 
     with engine.begin() as conn:
 
-        # get target uuids
+        # get target uuids (rows archived off the sheet are expected to be missing from it)
         res = conn.execute(text(f'''
-            SELECT internal_uuid
-            FROM {schema}."{target_table}"
-        '''))
+            SELECT t.internal_uuid
+            FROM {schema}."{target_table}" t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {schema}.archived_rows a
+                WHERE a.table_name = :table AND a.internal_uuid = t.internal_uuid
+            )
+        '''), {"table": target_table})
         target_uuids = {str(r[0]) for r in res.fetchall() if r[0]}
 
         sheet_uuid_set = {str(u) for u in sheet_uuids if u}
@@ -541,7 +3058,7 @@ def handle_deleted_rows(engine, schema, target_table, sheet_uuids):
         def make_json_safe(v):
             if isinstance(v, uuid.UUID):
                 return str(v)
-            if isinstance(v, datetime.datetime):
+            if isinstance(v, (datetime.datetime, datetime.date)):
                 return v.isoformat()
             return v
 
@@ -574,6 +3091,18 @@ def handle_deleted_rows(engine, schema, target_table, sheet_uuids):
 
         conn.execute(delete_sql, params)
 
+        if outbox_run_id:
+            lock_change_outbox(conn, schema)
+            last_id = conn.execute(text(f'''
+                WITH outboxed AS (
+                    INSERT INTO {schema}.change_outbox (run_id, table_name, internal_uuid, op)
+                    SELECT :run_id, :table, u, 'delete' FROM unnest(CAST(:uuids AS uuid[])) u
+                    RETURNING id
+                )
+                SELECT MAX(id) FROM outboxed
+            '''), {"run_id": outbox_run_id, "table": target_table, "uuids": [str(p["uuid"]) for p in archive_payload]}).scalar()
+            notify_changes(conn, schema, target_table, outbox_run_id, last_id)
+
         # insert into deleted log
         insert_sql = text(f'''
             INSERT INTO {schema}.deleted_rows_log
@@ -586,95 +3115,699 @@ def handle_deleted_rows(engine, schema, target_table, sheet_uuids):
         deleted_count = len(to_delete)
         return {"deleted": deleted_count}
 
-def main():
-    eng = get_engine()
-
-    for m in MAPPINGS:
-        name = m.get("name") or f"mapping_{m.get('sheet_name')}"
-        sheet_id = m.get("sheet_id")
-        sheet_name = m.get("sheet_name")
-        schema = m.get("schema")
-        target_table = m.get("target_table")
-        staging_table = m.get("staging_table") or f"{target_table}_stg"
-        uuid_col = m.get("uuid_col", "internal_uuid")
-        processed_col = m.get("processed_col", "processed_at")
-
-        if not sheet_name or not target_table:
-            print(f"[{name}] skipping invalid mapping (missing sheet_name or target_table): {m}")
-            continue
+def resume_checkpoint(eng, m, checkpoint, read_ids, read_uuids, stats):
+    """
+    Finish a mapping whose previous run committed its merge but never confirmed the write-back.
+    - none of its new rows is still on the sheet without a UUID: the write-back landed, close
+      the checkpoint (rows deleted from the sheet since are logged by the normal sync)
+    - the covered rows are still the rows it was built from, or only some of the write-back's
+      batchUpdate requests landed before the run died and every row is where the write-back
+      puts it: the DB is up to date, so run the missing deletion phase and hand back the
+      stored write-back
+    - anything else: positions are stale; discard that run's inserts that never reached the sheet
+    Returns a result dict when resumed, None when the caller should run a normal sync.
+    """
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    write_back = checkpoint["write_back"]
+    start = checkpoint["start_row"] or 2
+    current = read_ids[start - 2:start - 2 + (checkpoint["row_count"] or 0)]
+    written = [str(row[0]) for row in write_back["data"][0]["values"]]
+    new_uuids = checkpoint["new_uuids"] or []
+    on_sheet = set(read_ids)
+
+    # sheet row of written[i] is first_row + i (the stored UUID range)
+    first_row = gspread.utils.a1_range_to_grid_range(write_back["data"][0]["range"])["startRowIndex"] + 1
+
+    def uuid_less(i):
+        pos = first_row - 2 + i
+        return 0 <= pos < len(read_uuids) and not str(read_uuids[pos] or "").strip()
+
+    any_landed = any(u in on_sheet for u in new_uuids)
+    if any_landed:
+        # unlanded: rows still at the write-back's position without a UUID. A landed UUID whose
+        # row is gone from the sheet is a deletion, and is left to handle_deleted_rows
+        new_set = set(new_uuids)
+        unlanded = [w for i, w in enumerate(written) if w in new_set and w not in on_sheet and uuid_less(i)]
+    else:
+        unlanded = list(new_uuids)
+
+    if current == written or (new_uuids and not unlanded):
+        set_checkpoint_phase(eng, schema, name, "written_back")
+        print(f"[{name}] write-back of run {checkpoint['run_id']} had landed; checkpoint closed")
+        return None
+
+    if any_landed:
+        # every row must be where the write-back puts it: landed ones by their UUID,
+        # the rest still without one
+        pending = set(unlanded)
+        in_place = len(current) == len(written) and all(
+            c == w or (w in pending and uuid_less(i)) for i, (c, w) in enumerate(zip(current, written))
+        )
+    else:
+        in_place = (len(current) == checkpoint["row_count"]
+                    and identity_checksum(current) == checkpoint["identity_checksum"])
+
+    if not in_place:
+        n = discard_unsynced_inserts(eng, schema, target_table, unlanded, m.get("uuid_col", "internal_uuid"))
+        set_checkpoint_phase(eng, schema, name, "discarded")
+        print(f"[{name}] sheet changed since run {checkpoint['run_id']} failed before write-back; "
+              f"discarded {n} unsynced inserts, running a normal sync")
+        return None
+
+    print(f"[{name}] resuming run {checkpoint['run_id']} at phase '{checkpoint['phase']}'")
+    deleted = 0
+    if checkpoint["phase"] == "upserted" and start == 2:
+        stats.phase("deletion")
+        try:
+            outbox_run_id = stats.run_id if m.get("publish_changes") else None
+            deleted = (handle_deleted_rows(eng, schema, target_table, written, outbox_run_id) or {}).get("deleted", 0)
+            if deleted:
+                record_table_change(eng, schema, target_table, stats.run_id)
+            mark_mapping_synced(eng, schema, name, target_table)
+            set_checkpoint_phase(eng, schema, name, "deleted")
+        except Exception as e:
+            print(f"[{name}] Deletion handling failed while resuming: {e}")
+            traceback.print_exc()
+            return {"name": name, "status": "failed", "error": f"deletion: {e}"}
+
+    return {
+        "name": name,
+        "status": "ok",
+        "resumed": True,
+        "write_back": write_back,
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "deleted": deleted,
+    }
+
+def _storage_options(conn, schema, table):
+    # reloptions of a table; for a partitioned one, those every partition has in common
+    found = conn.execute(text("""
+        SELECT c.relkind, c.reloptions FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relname = :table
+    """), {"schema": schema, "table": table}).first()
+    if found is None:
+        return set(), []
+    if found.relkind != "p":
+        return set(found.reloptions or []), [table]
+    leaves = conn.execute(text("""
+        SELECT c.relname, c.reloptions
+        FROM pg_partition_tree(to_regclass(:parent)) t JOIN pg_class c ON c.oid = t.relid
+        WHERE t.isleaf
+    """), {"parent": f'{schema}."{table}"'}).fetchall()
+    shared = set(leaves[0].reloptions or []) if leaves else set()
+    for leaf in leaves[1:]:
+        shared &= set(leaf.reloptions or [])
+    return shared, [leaf.relname for leaf in leaves]
+
+def copy_table_attributes(conn, schema, source, dest):
+    """
+    Before a rebuild swap: give `dest` what DROP TABLE `source` would lose -- storage
+    parameters (per partition when dest is partitioned), table and column comments, and
+    table-level grants. Column grants, row security policies and triggers are not copied.
+    """
+    options, _ = _storage_options(conn, schema, source)
+    _, dest_tables = _storage_options(conn, schema, dest)
+    if options:
+        for t in dest_tables:
+            conn.execute(text(f'ALTER TABLE {schema}."{t}" SET ({", ".join(sorted(options))})'))
+
+    src = f'{schema}."{source}"'
+    comment = conn.execute(text("SELECT obj_description(to_regclass(:t), 'pg_class')"), {"t": src}).scalar()
+    if comment is not None:
+        conn.execute(text(f'COMMENT ON TABLE {schema}."{dest}" IS ' + _sql_literal(conn, comment)))
+    column_comments = conn.execute(text("""
+        SELECT a.attname, col_description(a.attrelid, a.attnum)
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(:t) AND a.attnum > 0 AND NOT a.attisdropped
+        AND col_description(a.attrelid, a.attnum) IS NOT NULL
+        AND EXISTS (
+            SELECT 1 FROM pg_attribute d
+            WHERE d.attrelid = to_regclass(:d) AND d.attname = a.attname AND NOT d.attisdropped
+        )
+    """), {"t": src, "d": f'{schema}."{dest}"'}).fetchall()
+    for column, text_ in column_comments:
+        conn.execute(text(f'COMMENT ON COLUMN {schema}."{dest}"."{column}" IS ' + _sql_literal(conn, text_)))
+
+    grants = conn.execute(text("""
+        SELECT g.privilege_type,
+               CASE WHEN g.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(g.grantee)) END,
+               g.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) g
+        WHERE c.oid = to_regclass(:t) AND g.grantee <> c.relowner
+    """), {"t": src}).fetchall()
+    for privilege, grantee, grantable in grants:
+        conn.execute(text(
+            f'GRANT {privilege} ON {schema}."{dest}" TO {grantee}{" WITH GRANT OPTION" if grantable else ""}'
+        ))
+
+def _sql_literal(conn, value):
+    # quoted by Postgres; colons escaped so text() doesn't read them as bind parameters
+    return conn.execute(text("SELECT quote_literal(:v)"), {"v": value}).scalar().replace(":", "\\:")
+
+def bootstrap_mapping(eng, m, stats, columns, n_rows, cols, sheet_headers, worksheet, read_ids,
+                      rebuild=False, sync_state=None):
+    """
+    Bulk path for a target that does not exist yet (or is being rebuilt): COPY every sheet row
+    straight into a bare table, then add the primary key and declared indexes, ANALYZE, and
+    queue one write-back for the whole tab. A rebuild loads <target>__rebuild, archives rows
+    that are gone from the sheet like a normal deletion and swaps the tables in one transaction.
+    """
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    uuid_col = m.get("uuid_col", "internal_uuid")
+    processed_col = m.get("processed_col", "processed_at")
+    outbox_run_id = stats.run_id if m.get("publish_changes") else None
+    partition = partition_spec(m)
+    load_table = f"{target_table}__rebuild" if rebuild else target_table
+    for c in (uuid_col, processed_col):
+        if c not in cols:
+            cols = cols + [c]
+
+    print(f"[{name}] bootstrap ({'rebuild' if rebuild else 'initial load'}): "
+          f"bulk load of {n_rows} rows into {schema}.{load_table}")
+
+    stats.phase("stage")
+    with MappingSession(eng, name) as db:
+        if stats.cost_meter is not None:
+            stats.cost_meter.watch(db)
+        staged, sheet_uuids, new_uuids = columnar_stage(
+            columns, n_rows, cols, uuid_col, processed_col, target_table,
+            clean=bool(m.get("clean_values")),
+        )
+        stats.counts["rows_staged"] = n_rows
+        if outbox_run_id:
+            create_change_outbox_table_if_not_exists(db, schema)
+        if rebuild:
+            create_deleted_log_table_if_not_exists(db, schema)
+            create_archived_rows_table_if_not_exists(db, schema)
+
+        # no primary key or indexes while loading: they are built once, after the COPY.
+        # Partitioned targets are COPYed into a plain text table first: its dates decide which
+        # partitions to create before the rows are moved in with one INSERT ... SELECT.
+        copy_table = f"{load_table}__copy" if partition else load_table
+        col_defs = [d.replace(" PRIMARY KEY", " NOT NULL") for d in build_col_defs(cols)]
+        with db.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+            conn.execute(text(f'DROP TABLE IF EXISTS {schema}."{load_table}"'))
+            if partition:
+                conn.execute(text(f'DROP TABLE IF EXISTS {schema}."{copy_table}"'))
+                conn.execute(text(f'CREATE UNLOGGED TABLE {schema}."{copy_table}" ({", ".join(col_defs)})'))
+                create_partitioned_table(conn, schema, load_table, cols, partition)
+            else:
+                conn.execute(text(f'CREATE TABLE {schema}."{load_table}" ({", ".join(col_defs)})'))
+
+        stats.phase("bulk_load")
+        copy_staging(db, schema, target_table, copy_table, staged, processed_col)
+        with db.begin() as conn:
+            if partition:
+                ensure_target_partitions(conn, schema, load_table, partition, f'{schema}."{copy_table}"')
+                column = partition[0]
+                col_list = ", ".join(f'"{c}"' for c in cols)
+                select_list = ", ".join(partition_key_sql(f'"{c}"') if c == column else f'"{c}"' for c in cols)
+                conn.execute(text(f"""
+                    INSERT INTO {schema}."{load_table}" ({col_list})
+                    SELECT {select_list} FROM {schema}."{copy_table}"
+                """))
+                conn.execute(text(f'DROP TABLE {schema}."{copy_table}"'))
+                ensure_partitioned_uuid_index(conn, schema, load_table, partition, uuid_col)
+            else:
+                conn.execute(text(f'ALTER TABLE {schema}."{load_table}" ALTER COLUMN "{processed_col}" DROP DEFAULT'))
+                conn.execute(text(
+                    f'ALTER TABLE {schema}."{load_table}" ADD CONSTRAINT "{load_table}_pkey" PRIMARY KEY ("{uuid_col}")'
+                ))
+        indexes = ensure_declared_indexes(db, schema, load_table, m.get("indexes"))
+
+        deleted = 0
+        inserted = n_rows
+        if rebuild:
+            # rows no longer on the sheet go to deleted_rows_log, exactly as a normal sync would;
+            # an empty sheet raises here and aborts the rebuild before the swap
+            deleted = handle_deleted_rows(db, schema, target_table, sheet_uuids, outbox_run_id)["deleted"]
+            with db.begin() as conn:
+                inserted = conn.execute(text(f"""
+                    SELECT COUNT(*) FROM {schema}."{load_table}" n
+                    WHERE NOT EXISTS (SELECT 1 FROM {schema}."{target_table}" o WHERE o."{uuid_col}" = n."{uuid_col}")
+                """)).scalar()
+                if outbox_run_id:
+                    lock_change_outbox(conn, schema)
+                    last_id = conn.execute(text(f"""
+                        WITH outboxed AS (
+                            INSERT INTO {schema}.change_outbox (run_id, table_name, internal_uuid, op)
+                            SELECT :run_id, :table, n."{uuid_col}",
+                                   CASE WHEN o."{uuid_col}" IS NULL THEN 'insert' ELSE 'update' END
+                            FROM {schema}."{load_table}" n
+                            LEFT JOIN {schema}."{target_table}" o ON o."{uuid_col}" = n."{uuid_col}"
+                            RETURNING id
+                        )
+                        SELECT MAX(id) FROM outboxed
+                    """), {"run_id": outbox_run_id, "table": target_table}).scalar()
+                    notify_changes(conn, schema, target_table, outbox_run_id, last_id)
+                # archived rows are only in the DB: carry them over to the rebuilt table
+                old_cols = set(get_table_columns(db, schema, target_table))
+                common = [c for c in cols if c in old_cols]
+                archived = f"""(
+                    SELECT o.* FROM {schema}."{target_table}" o
+                    JOIN {schema}.archived_rows a
+                      ON a.table_name = :table AND a.internal_uuid = o."{uuid_col}"
+                    WHERE NOT EXISTS (SELECT 1 FROM {schema}."{load_table}" n WHERE n."{uuid_col}" = o."{uuid_col}")
+                ) archived"""
+                if partition:
+                    ensure_target_partitions(
+                        conn, schema, load_table, partition, archived.replace(":table", f"'{target_table}'")
+                    )
+                conn.execute(text(f"""
+                    INSERT INTO {schema}."{load_table}" ({", ".join(f'"{c}"' for c in common)})
+                    SELECT {", ".join(
+                        partition_key_sql(f'"{c}"') if partition and c == partition[0] else f'"{c}"' for c in common
+                    )} FROM {archived}
+                """), {"table": target_table})
+                copy_table_attributes(conn, schema, target_table, load_table)
+                # swap; fails (and keeps the old table) if views depend on it
+                conn.execute(text(f'ALTER TABLE {schema}."{target_table}" RENAME TO "{target_table}__old"'))
+                conn.execute(text(f'ALTER TABLE {schema}."{load_table}" RENAME TO "{target_table}"'))
+                conn.execute(text(f'DROP TABLE {schema}."{target_table}__old"'))
+                if partition:
+                    # partitions and the uuid index carry the load table's name until now
+                    parts = conn.execute(text("""
+                        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = to_regclass(:parent)
+                    """), {"parent": f'{schema}."{target_table}"'}).scalars().all()
+                    for part in parts:
+                        conn.execute(text(
+                            f'ALTER TABLE {schema}."{part}" RENAME TO "{target_table}{part[len(load_table):]}"'
+                        ))
+                    conn.execute(text(
+                        f'ALTER INDEX {schema}."{load_table}_uuid_key" RENAME TO "{target_table}_uuid_key"'
+                    ))
+                else:
+                    conn.execute(text(
+                        f'ALTER TABLE {schema}."{target_table}" RENAME CONSTRAINT "{load_table}_pkey" TO "{target_table}_pkey"'
+                    ))
+                for index_name, index_cols in indexes:
+                    conn.execute(text(
+                        f'ALTER INDEX {schema}."{index_name}" RENAME TO "{declared_index_name(target_table, index_cols)}"'
+                    ))
+        elif outbox_run_id and n_rows:
+            with db.begin() as conn:
+                lock_change_outbox(conn, schema)
+                last_id = conn.execute(text(f"""
+                    WITH outboxed AS (
+                        INSERT INTO {schema}.change_outbox (run_id, table_name, internal_uuid, op)
+                        SELECT :run_id, :table, "{uuid_col}", 'insert' FROM {schema}."{target_table}"
+                        RETURNING id
+                    )
+                    SELECT MAX(id) FROM outboxed
+                """), {"run_id": outbox_run_id, "table": target_table}).scalar()
+                notify_changes(conn, schema, target_table, outbox_run_id, last_id)
+
+        with db.begin() as conn:
+            conn.execute(text(f'ANALYZE {schema}."{target_table}"'))
+        print(f"[{target_table}] Bulk loaded: {n_rows} rows ({inserted} new), {len(indexes)} declared index(es)")
+
+        stats.phase("write_back_prepare")
+        write_back = prepare_sheet_write_back(
+            db,
+            worksheet,
+            staged[uuid_col],
+            schema,
+            target_table,
+            uuid_col,
+            processed_col,
+            insert_count=len(new_uuids),
+            update_count=n_rows - len(new_uuids),
+            original_rows=[{uuid_col: u} for u in sheet_uuids],
+            headers=sheet_headers,
+            sheet_id=m.get("sheet_id"),
+            name=name,
+        )
+        if write_back is not None:
+            save_checkpoint(
+                db, schema, name, target_table, stats.run_id, "deleted",
+                write_back=write_back,
+                start_row=2,
+                row_count=len(read_ids),
+                identity_checksum=identity_checksum(read_ids),
+                new_uuids=new_uuids,
+            )
+        else:
+            save_checkpoint(db, schema, name, target_table, stats.run_id, "written_back")
+        if sync_state is not None:
+            save_sync_state(db, schema, name, target_table, full_sync=True, **sync_state)
+        mark_mapping_synced(db, schema, name, target_table)
+        record_table_change(db, schema, target_table, stats.run_id)
+        # one commit: a failed bootstrap leaves no half-loaded table behind
+        db.commit()
+
+    return {
+        "name": name,
+        "status": "ok",
+        "bootstrap": "rebuild" if rebuild else "initial_load",
+        "write_back": write_back,
+        "inserted": inserted,
+        "updated": 0,
+        "unchanged": n_rows - inserted,
+        "deleted": deleted,
+    }
+
+def resume_merge(eng, m, checkpoint, read_ids, read_uuids):
+    """
+    Pick up a chunked merge that was interrupted before its write-back was checkpointed.
+    When the rows it covered are unchanged, returns ({read row index: uuid it assigned}, last
+    merged key) so the same rows get the same UUIDs and merging continues behind that key.
+    Otherwise its inserts (which never reached the sheet) are discarded and ({}, None) returned.
+    """
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    schema = m.get("schema")
+    start = checkpoint["start_row"] or 2
+    current = read_ids[start - 2:start - 2 + (checkpoint["row_count"] or 0)]
+    new_uuids = checkpoint["new_uuids"] or []
+    blank = [
+        i for i in range(start - 2, start - 2 + len(current))
+        if not str(read_uuids[i] or "").strip()
+    ]
+
+    if (
+        len(current) == checkpoint["row_count"]
+        and identity_checksum(current) == checkpoint["identity_checksum"]
+        and len(blank) == len(new_uuids)
+    ):
+        print(f"[{name}] resuming chunked merge of run {checkpoint['run_id']}")
+        return dict(zip(blank, new_uuids)), checkpoint["merge_position"]
+
+    n = discard_unsynced_inserts(eng, schema, m.get("target_table"), new_uuids, m.get("uuid_col", "internal_uuid"))
+    set_checkpoint_phase(eng, schema, name, "discarded")
+    print(f"[{name}] sheet changed since run {checkpoint['run_id']} was interrupted mid-merge; "
+          f"discarded {n} unsynced inserts, running a normal sync")
+    return {}, None
+
+def sync_mapping(eng, m, stats=None, row_range=None, rebuild=False):
+    """
+    Run the full pipeline for one mapping on a single MappingSession.
+    Returns {"name", "status", ...}; a failed mapping never stops the others.
+    Phase timings and row counts are recorded on `stats` when given.
+    A pending checkpoint from an earlier run is resumed (write-back retried) or,
+    if the sheet's uuid column moved since, its unsynced inserts are discarded first.
+    row_range=(start_row, end_row) syncs only those sheet rows (dirty-range queue);
+    it is ignored while a checkpoint is pending.
+    A missing target table (or rebuild=True) takes the bulk bootstrap path instead.
+    """
+    if stats is None:
+        stats = MappingStats(str(uuid.uuid4()), m)
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    sheet_id = m.get("sheet_id")
+    sheet_name = m.get("sheet_name")
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    staging_table = m.get("staging_table") or f"{target_table}_stg"
+    uuid_col = m.get("uuid_col", "internal_uuid")
+    processed_col = m.get("processed_col", "processed_at")
+
+    if not sheet_name or not target_table:
+        print(f"[{name}] skipping invalid mapping (missing sheet_name or target_table): {m}")
+        return {"name": name, "status": "skipped"}
+
+    print(f"[{name}] Processing: sheet '{sheet_name}' -> {schema}.{target_table}")
+
+    stats.phase("read")
+    read_mode = m.get("read_mode")
+    date_columns = m.get("date_columns") or []
+    system_cols = (uuid_col, processed_col)
+    select = column_selector(m, system_cols)
+    # columnar: stage straight from column lists + COPY (snapshot_diff still needs row dicts)
+    columnar = bool(m.get("columnar")) and not m.get("snapshot_diff")
+    columns = None
+    n_columnar = 0
+    # csv: full reads come from the tab's CSV export (formatted values only, so not with canonical)
+    read_engine = m.get("read_engine") or "values"
+    if read_engine not in ("values", "csv"):
+        raise RuntimeError(f"[{name}] unknown read_engine: {read_engine}")
+    if read_engine == "csv" and read_mode == "canonical":
+        print(f"[{name}] read_engine csv exports formatted values; using the values API for read_mode canonical")
+        read_engine = "values"
+
+    # no target yet, or an explicit rebuild: bulk-load instead of staging + merge + deletion diff
+    bootstrap = rebuild or not get_table_columns(eng, schema, target_table)
+    if bootstrap:
+        if rebuild and select:
+            raise RuntimeError(f"[{name}] rebuild is not supported together with include_columns/exclude_columns")
+        row_range = None
+
+    partition = partition_spec(m)
+    if not bootstrap and bool(partition) != is_partitioned_table(eng, schema, target_table):
+        raise RuntimeError(
+            f"[{name}] partition_by {'is set but' if partition else 'is not set but'} {schema}.{target_table} "
+            f"{'is a plain table' if partition else 'is partitioned'}; run --rebuild {name} to convert it"
+        )
 
-        print(f"[{name}] Processing: sheet '{sheet_name}' -> {schema}.{target_table}")
+    # append-only ledgers: read only the rows past the last synced position when the tail is intact
+    append_only = bool(m.get("append_only"))
+    tail_window = int(m.get("append_tail_window", 20))
+    tail_plan = None
+    checkpoint = get_checkpoint(eng, schema, name)
+    pending = checkpoint if checkpoint and checkpoint["phase"] in PENDING_CHECKPOINT_PHASES else None
+    merging = checkpoint if checkpoint and checkpoint["phase"] == "merging" else None
+    if bootstrap:
+        # the bulk load writes every sheet row; rows an unfinished run left behind are archived
+        pending = merging = None
+    if (pending or merging) and row_range:
+        print(f"[{name}] checkpoint pending, syncing the whole tab instead of rows {row_range[0]}-{row_range[1]}")
+        row_range = None
+    if append_only and not (pending or merging) and not row_range and not bootstrap:
+        state = get_sync_state(eng, schema, name)
+        tail_plan = plan_append_tail(state, tail_window, m.get("full_sync_interval_hours", 24))
+    # partial reads (append tail, dirty range) can't tell deleted rows from unread ones
+    partial = bool(tail_plan or row_range)
 
-        try:
-            rows, worksheet = read_sheet(sheet_id, sheet_name)
-            # --- normalize sheet column names ---
-            if rows:
-                original_cols = list(rows[0].keys())
-                normalized_cols = normalize_columns(original_cols)
-
-                col_map = dict(zip(original_cols, normalized_cols))
-
-                # warn if anything changed
-                changed = [(o, n) for o, n in col_map.items() if o != n]
-                if changed:
-                    print(f"[{name}] WARNING: non-snake-case columns detected:")
-                    for o, n in changed:
-                        print(f"    {o} -> {n}")
-
-                # apply normalization to each row
+    try:
+        header_row = None
+        window_rows = []
+        if tail_plan:
+            start_row, window_len = tail_plan
+            header_row, rows, worksheet = read_sheet_tail(sheet_id, sheet_name, start_row, read_mode, date_columns)
+            header_key = rows_checksum([{"header": normalize_columns(header_row)}])
+            if header_key != state["header_checksum"] or len(rows) < window_len:
+                print(f"[{name}] append-only: header or row count changed above the tail, falling back to full sync")
+                tail_plan = None
+            else:
+                window_rows, rows = rows[:window_len], rows[window_len:]
+
+        if row_range:
+            header_row, rows, worksheet = read_sheet_tail(
+                sheet_id, sheet_name, row_range[0], read_mode, date_columns, end_row=row_range[1]
+            )
+            print(f"[{name}] dirty range: sheet rows {row_range[0]}-{row_range[1]}")
+        elif not tail_plan and columnar:
+            if read_engine == "csv":
+                header_row, grid, worksheet = read_sheet_csv(sheet_id, sheet_name)
+            else:
+                header_row, grid, worksheet = read_sheet_grid(sheet_id, sheet_name, read_mode, select)
+            columns, n_columnar = grid_columns(grid, read_mode, date_columns)
+            rows = []
+            del grid
+            if select:
+                columns = {c: v for c, v in columns.items() if select(c)}
+            renamed = [(h, c) for h, c in zip(header_row, normalize_columns(header_row)) if h != c]
+            if renamed:
+                print(f"[{name}] WARNING: non-snake-case columns detected:")
+                for o, n in renamed:
+                    print(f"    {o} -> {n}")
+        elif not tail_plan:
+            if read_engine == "csv":
+                # projection (select) is applied to the rows below; the export has every column
+                header_row, grid, worksheet = read_sheet_csv(sheet_id, sheet_name)
+                rows = records_from_values(grid[0], grid[1:]) if grid else []
+                del grid
+            elif select:
+                header_row, rows, worksheet = read_sheet_columns(sheet_id, sheet_name, select, read_mode, date_columns)
+            elif read_mode:
+                rows, worksheet = read_sheet(sheet_id, sheet_name, read_mode, date_columns)
+                header_row = None
+            else:
+                rows, worksheet = read_sheet(sheet_id, sheet_name)
+                header_row = None
+
+        # --- normalize sheet column names ---
+        if rows or window_rows:
+            original_cols = list((rows or window_rows)[0].keys())
+            normalized_cols = normalize_columns(original_cols)
+
+            col_map = dict(zip(original_cols, normalized_cols))
+
+            # warn if anything changed
+            changed = [(o, n) for o, n in col_map.items() if o != n]
+            if changed:
+                print(f"[{name}] WARNING: non-snake-case columns detected:")
+                for o, n in changed:
+                    print(f"    {o} -> {n}")
+
+            # apply normalization to each row
+            def _normalize_rows(rs):
                 new_rows = []
-                for r in rows:
+                for r in rs:
                     new_r = {}
                     for k, v in r.items():
                         new_k = col_map.get(k, k)
                         new_r[new_k] = v
                     new_rows.append(new_r)
+                return new_rows
+
+            rows = _normalize_rows(rows)
+            window_rows = _normalize_rows(window_rows)
+
+        # drop excluded columns before anything is checksummed, staged or compared
+        if select:
+            rows = [{k: v for k, v in r.items() if select(k)} for r in rows]
+            window_rows = [{k: v for k, v in r.items() if select(k)} for r in window_rows]
+    except Exception as e:
+        print(f"[{name}] Failed to read sheet '{sheet_name}': {e}")
+        traceback.print_exc()
+        return {"name": name, "status": "failed", "error": f"read: {e}"}
+
+    stats.counts["rows_read"] = len(rows) + len(window_rows) + n_columnar
+
+    if tail_plan:
+        if rows_checksum(window_rows, system_cols) != state["tail_checksum"]:
+            # an edit above the new rows: the cheap path is no longer safe
+            print(f"[{name}] append-only: tail checksum mismatch, falling back to full sync")
+            reset_sync_state(eng, schema, name)
+            return sync_mapping(eng, m, stats)
+        if not rows:
+            print(f"[{name}] append-only: no new rows since last sync")
+            mark_mapping_synced(eng, schema, name, target_table)
+            return {"name": name, "status": "ok", "write_back": None}
+        print(f"[{name}] append-only: {len(rows)} new rows after sheet row {tail_plan[0] + len(window_rows) - 1}")
+
+    # remember where this sync ends so the next append-only run can start from there
+    if append_only and not row_range:
+        if columns is not None:
+            synced_rows = [
+                {c: v[i] for c, v in columns.items()}
+                for i in range(max(0, n_columnar - tail_window), n_columnar)
+            ]
+        else:
+            synced_rows = (window_rows + rows)[-tail_window:] if tail_plan else rows[-tail_window:]
+        synced_count = (state["row_count"] if tail_plan else 0) + len(rows) + n_columnar
+        tail_checksum = rows_checksum(synced_rows, system_cols)
 
-                rows = new_rows
-        except Exception as e:
-            print(f"[{name}] Failed to read sheet '{sheet_name}': {e}")
-            traceback.print_exc()
-            continue
+     # print summary
+    print(f"[{name}] total rows:", len(rows) + n_columnar)
+    #print("sample row:", rows[0] if rows else None)
 
-         # print summary
-        print(f"[{name}] total rows:", len(rows))
-        #print("sample row:", rows[0] if rows else None)
+    # read header row (do NOT overwrite `rows`)
+    if header_row is None:
+        header_row = google_call("header", name, lambda: worksheet.row_values(1), hedge=True)
 
-        # read header row (do NOT overwrite `rows`)
-        header_row = worksheet.row_values(1)
+    # write-back addresses cells by their position in the full header
+    sheet_headers = [h.strip().lstrip("\ufeff") for h in header_row]
 
-        clean_headers = [h.strip().lstrip("\ufeff") for h in header_row]
+    # guards and schema drift only see the projected columns
+    if select:
+        header_row = [h for h, c in zip(header_row, header_names(header_row)) if select(c)]
 
-        # ---- HARD GUARD: required system columns must exist ----
-        required_cols = {uuid_col, processed_col}
-        header_set = set(clean_headers)
+    clean_headers = [h.strip().lstrip("\ufeff") for h in header_row]
 
-        missing = required_cols - header_set
-        if missing:
-            raise RuntimeError(
-                f"[{target_table}] Sheet missing required system columns: {missing}. "
-                "Aborting run before any DB writes."
-            )
+    # ---- HARD GUARD: required system columns must exist ----
+    required_cols = {uuid_col, processed_col}
+    header_set = set(clean_headers)
 
-        blank_cols = [i+1 for i,h in enumerate(clean_headers) if not h]
+    missing = required_cols - header_set
+    if missing:
+        raise RuntimeError(
+            f"[{target_table}] Sheet missing required system columns: {missing}. "
+            "Aborting run before any DB writes."
+        )
 
-        if blank_cols:
-            raise RuntimeError(
-                f"[{target_table}] Blank column headers detected at positions: {blank_cols}. "
-                f"All columns must have names."
-            )
+    blank_cols = [i+1 for i,h in enumerate(clean_headers) if not h]
+
+    if blank_cols:
+        raise RuntimeError(
+            f"[{target_table}] Blank column headers detected at positions: {blank_cols}. "
+            f"All columns must have names."
+        )
 
-        raw_cols = [(h.strip().lstrip("\ufeff") or f"_col_{i}") for i, h in enumerate(header_row, start=1)]
-        cols = normalize_columns(raw_cols)
+    raw_cols = [(h.strip().lstrip("\ufeff") or f"_col_{i}") for i, h in enumerate(header_row, start=1)]
+    cols = normalize_columns(raw_cols)
+
+    # ensure uuid + processed columns exist in schema list
+    if uuid_col not in cols:
+        cols.append(uuid_col)
+    if processed_col not in cols:
+        cols.append(processed_col)
+
+    # each read row's identity, before any new UUIDs are assigned (checkpoint checks)
+    if columns is not None:
+        data_cols = [c for c in columns if c not in system_cols]
+        read_uuids = columns.get(uuid_col) or [""] * n_columnar
+        read_ids = row_identities(read_uuids, lambda i: [columns[c][i] for c in data_cols])
+    else:
+        data_cols = [c for c in (rows[0] if rows else {}) if c not in system_cols]
+        read_uuids = [r.get(uuid_col) for r in rows]
+        read_ids = row_identities(read_uuids, lambda i: [rows[i].get(c) for c in data_cols])
+
+    if pending:
+        resumed = resume_checkpoint(eng, m, pending, read_ids, read_uuids, stats)
+        if resumed is not None:
+            return resumed
+
+    # an interrupted chunked merge: the same rows get the UUIDs it already merged
+    reused_uuids = []
+    resume_after = None
+    if merging:
+        prefill, resume_after = resume_merge(eng, m, merging, read_ids, read_uuids)
+        if prefill and columns is not None:
+            columns[uuid_col] = list(read_uuids)
+        for i, u in prefill.items():
+            if columns is not None:
+                columns[uuid_col][i] = u
+            else:
+                rows[i][uuid_col] = u
+        reused_uuids = list(prefill.values())
+
+    # sheet row of the first read row (write-back / checkpoint positions)
+    if row_range:
+        start_row = row_range[0]
+    elif tail_plan:
+        start_row = tail_plan[0] + len(window_rows)
+    else:
+        start_row = 2
+
+    # past its deadline a mapping stops before any DB write; the next run picks it up
+    check_deadline(name)
+
+    if partition:
+        column = partition[0]
+        if columns is not None:
+            dates = columns.get(column) or []
+        else:
+            dates = [r.get(column) for r in rows]
+        check_partition_dates(eng, target_table, column, dates, start_row)
+
+    if bootstrap:
+        sync_state = None
+        if append_only:
+            sync_state = {"row_count": synced_count, "tail_checksum": tail_checksum,
+                          "header_checksum": rows_checksum([{"header": normalize_columns(header_row)}])}
+        if columns is None:
+            columns, n_columnar = rows_to_columns(rows)
+        return bootstrap_mapping(
+            eng, m, stats, columns, n_columnar, cols, sheet_headers, worksheet, read_ids,
+            rebuild=rebuild, sync_state=sync_state,
+        )
 
-        # ensure uuid + processed columns exist in schema list
-        if uuid_col not in cols:
-            cols.append(uuid_col)
-        if processed_col not in cols:
-            cols.append(processed_col)
+    # one connection for the whole mapping; phases commit explicitly below
+    stats.phase("stage")
+    with MappingSession(eng, name) as db:
+        if stats.cost_meter is not None:
+            stats.cost_meter.watch(db)
 
         # get existing DB columns (if table exists)
-        existing_cols = get_table_columns(eng, schema, target_table)
+        existing_cols = get_table_columns(db, schema, target_table)
 
         if not existing_cols:
             # table doesn't exist yet → normal creation path
@@ -686,11 +3819,18 @@ def main():
             new_cols = sheet_cols - db_cols
             missing_cols = db_cols - sheet_cols
 
+            # DB columns outside the projection are left alone (not NULLed, not staged, not compared)
+            if select:
+                untouched = {c for c in missing_cols if not select(c)}
+                missing_cols -= untouched
+                db_cols -= untouched
+
             # add new columns to DB
-            add_new_columns(eng, schema, target_table, new_cols)
+            add_new_columns(db, schema, target_table, new_cols)
 
-            # inject NULLs for removed columns
-            rows = inject_missing_columns(rows, missing_cols, target_table)
+            # inject NULLs for removed columns (the columnar stage does this per column)
+            if columns is None:
+                rows = inject_missing_columns(rows, missing_cols, target_table)
 
             # final column set = union
             final_cols = list(db_cols.union(sheet_cols))
@@ -702,28 +3842,65 @@ def main():
             final_cols.append(processed_col)
 
         # only for testing
-        # drop_table(eng, schema, target_table)
+        # drop_table(db, schema, target_table)
 
         # create empty staging table from headers even if no data rows
-        create_staging_table(eng, schema, staging_table, final_cols)
-
-        # split and assign UUIDs (still use the rows dicts)
-        ins, upd = split_rows(rows, uuid_col)
-        ins = assign_uuids(ins, uuid_col)
-
-        original_sheet_uuids = [r.get(uuid_col) for r in upd if r.get(uuid_col)]
-
-        all_rows = upd + ins
-        print(f"[{target_table}] Staging payload", len(all_rows))
-
-        # load staging (will no-op if all_rows is empty)
-        load_staging(eng, schema, target_table, staging_table, all_rows)
+        create_staging_table(db, schema, staging_table, final_cols)
 
         # create target table if missing
-        create_target_table_if_not_exists(eng, schema, target_table, final_cols)
+        create_target_table_if_not_exists(db, schema, target_table, final_cols, partition)
+
+        snapshot = None
+        skipped_unchanged = 0
+        if columns is not None:
+            staged, sheet_uuids, new_uuids = columnar_stage(
+                columns, n_columnar, final_cols, uuid_col, processed_col, target_table,
+                clean=bool(m.get("clean_values")),
+            )
+            columns = None
+            sheet_uuids_all = staged[uuid_col]
+            # write-back only needs each sheet row's uuid
+            rows = [{uuid_col: u} for u in sheet_uuids]
+
+            print(f"[{target_table}] Staging payload", len(sheet_uuids_all))
+            stats.counts["rows_staged"] = len(sheet_uuids_all)
+            copy_staging(db, schema, target_table, staging_table, staged, processed_col)
+        else:
+            # split and assign UUIDs (still use the rows dicts)
+            ins, upd = split_rows(rows, uuid_col)
+            ins = assign_uuids(ins, uuid_col)
+
+            original_sheet_uuids = [r.get(uuid_col) for r in upd if r.get(uuid_col)]
+
+            all_rows = upd + ins
+            sheet_uuids_all = [r[uuid_col] for r in all_rows]
+
+            # client-side diff: only rows whose digest moved since the last sync go to staging
+            if m.get("snapshot_diff") and not partial:
+                compare_cols = sorted(c for c in final_cols if c not in system_cols)
+                columns_key = rows_checksum([{"cols": compare_cols}])
+                snap_file = snapshot_path(schema, target_table)
+                snapshot = load_snapshot(snap_file)
+                fingerprint = target_fingerprint(db, schema, target_table)
+                if snapshot_is_stale(snapshot, columns_key, fingerprint, m.get("full_sync_interval_hours", 24)):
+                    print(f"[{target_table}] Snapshot missing, stale or due for revalidation, rebuilding from target")
+                    snapshot = {
+                        "digests": rebuild_snapshot_from_target(db, schema, target_table, compare_cols, uuid_col),
+                        "verified_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    }
+
+                all_rows, skipped_unchanged, snapshot_deleted, new_digests = diff_against_snapshot(
+                    all_rows, snapshot["digests"], compare_cols, uuid_col
+                )
+                print(f"[{target_table}] Snapshot diff: {len(all_rows)} changed, {skipped_unchanged} unchanged, {len(snapshot_deleted)} deleted")
 
+            print(f"[{target_table}] Staging payload", len(all_rows))
+            stats.counts["rows_staged"] = len(all_rows)
 
-        new_uuids = [r[uuid_col] for r in ins if r.get(uuid_col)]
+            # load staging (will no-op if all_rows is empty)
+            load_staging(db, schema, target_table, staging_table, all_rows)
+
+            new_uuids = [r[uuid_col] for r in ins if r.get(uuid_col)]
 
         if new_uuids:
             placeholders = ", ".join([f":u{i}" for i in range(len(new_uuids))])
@@ -735,7 +3912,7 @@ def main():
                 WHERE internal_uuid IN ({placeholders})
             ''')
 
-            with eng.connect() as conn:
+            with db.connect() as conn:
                 existing = conn.execute(sql, params).fetchall()
 
             if existing:
@@ -746,32 +3923,92 @@ def main():
 
 
         # upsert, then update sheet ONLY if upsert succeeds
+        stats.phase("upsert")
         try:
-            res = upsert_staging_into_target(
-                eng,
-                schema,
-                staging_table,
-                target_table,
-                final_cols
-            )
+            formatting_only = 0
+            # opt-in: one extra staging/target join per upsert
+            if m.get("report_formatting_updates") and existing_cols:
+                formatting_only = count_formatting_only_updates(
+                    db, schema, staging_table, target_table, final_cols, uuid_col, processed_col
+                )
+
+            chunk_rows = int(m.get("merge_chunk_rows") or 0)
+            outbox_run_id = stats.run_id if m.get("publish_changes") else None
+            if chunk_rows:
+                # every chunk commits on its own; the checkpoint keeps the new UUIDs and
+                # the last merged key so an interrupted merge can continue where it stopped
+                save_checkpoint(
+                    db, schema, name, target_table, stats.run_id, "merging",
+                    start_row=start_row,
+                    row_count=len(read_ids),
+                    identity_checksum=identity_checksum(read_ids),
+                    new_uuids=new_uuids + reused_uuids,
+                )
+                if resume_after:
+                    set_merge_position(db, schema, name, resume_after)
+
+                def _commit_chunk(last_key, chunk):
+                    set_merge_position(db, schema, name, last_key)
+                    if chunk["inserted"] or chunk["updated"]:
+                        record_table_change(db, schema, target_table, stats.run_id)
+                    db.commit()
+
+                res = upsert_staging_in_chunks(
+                    db,
+                    schema,
+                    staging_table,
+                    target_table,
+                    final_cols,
+                    chunk_rows,
+                    after=resume_after,
+                    outbox_run_id=outbox_run_id,
+                    on_chunk=_commit_chunk,
+                    partition=partition,
+                )
+            else:
+                res = upsert_staging_into_target(
+                    db,
+                    schema,
+                    staging_table,
+                    target_table,
+                    final_cols,
+                    outbox_run_id=outbox_run_id,
+                    partition=partition,
+                )
             processed_uuids = res["processed_uuids"]
+            if snapshot is not None:
+                # staging only held the changed rows; the sheet still has all of them
+                processed_uuids = sheet_uuids_all
+                res["unchanged"] += skipped_unchanged
+
+            if append_only and not row_range:
+                save_sync_state(
+                    db, schema, name, target_table,
+                    row_count=synced_count,
+                    tail_checksum=tail_checksum,
+                    header_checksum=rows_checksum([{"header": normalize_columns(header_row)}]),
+                    full_sync=not tail_plan,
+                )
 
             print(f"[{target_table}] Inserted: {res['inserted']}")
             print(f"[{target_table}] Updated: {res['updated']}")
             print(f"[{target_table}] Unchanged: {res['unchanged']}")
-
-
+            if m.get("report_formatting_updates"):
+                print(f"[{target_table}] Formatting-only updates: {formatting_only}")
 
         except Exception as e:
             print("Target upsert failed. Sheet will NOT be updated.")
             print("Error:", e)
             traceback.print_exc()
-            return
+            db.rollback()
+            return {"name": name, "status": "failed", "error": f"upsert: {e}"}
 
+        stats.phase("write_back_prepare")
         try:
-            # update sheet using the rows we already read (avoid another read)
-            update_sheet_with_results(
-                eng,
+            # build the write-back from the rows we already read (avoid another read);
+            # it is sent later together with the other tabs of the same spreadsheet
+            write_back = prepare_sheet_write_back(
+                db,
                 worksheet,
                 processed_uuids,
                 schema,
@@ -780,29 +4017,80 @@ def main():
                 processed_col,
                 insert_count=res["inserted"],
                 update_count=res["updated"],
-                original_rows=rows
+                original_rows=rows,
+                headers=sheet_headers,
+                sheet_id=sheet_id,
+                name=name,
+                start_row=start_row,
             )
-            print(f"[{target_table}] Sheet updated. Proceeding to drop staging table")
+
+            # checkpoint the UUID map in the same transaction as the merge, so a crash
+            # before the sheet is written can't leave inserted rows without a way back
+            if write_back is not None:
+                save_checkpoint(
+                    db, schema, name, target_table, stats.run_id, "upserted",
+                    write_back=write_back,
+                    start_row=start_row,
+                    row_count=len(read_ids),
+                    identity_checksum=identity_checksum(read_ids),
+                    new_uuids=new_uuids + reused_uuids,
+                )
+            else:
+                save_checkpoint(db, schema, name, target_table, stats.run_id, "written_back")
+            if res["inserted"] or res["updated"]:
+                record_table_change(db, schema, target_table, stats.run_id)
+
+            # phase boundary: schema drift, staging, merge and checkpoint become durable together
+            db.commit()
+            print(f"[{target_table}] Sheet write-back queued. Proceeding to drop staging table")
 
         except Exception as e:
             print("Sheet update failed")
             print("Error:", e)
             traceback.print_exc()
-            return
+            db.rollback()
+            return {"name": name, "status": "failed", "error": f"write_back: {e}"}
 
+        stats.phase("deletion")
         try:
             # delete staging table
-            drop_table(eng, schema, staging_table)
+            drop_table(db, schema, staging_table)
 
             # detect deletions (rows removed from sheet)
             sheet_uuids = processed_uuids
 
-            deletion_res = handle_deleted_rows(
-                eng,
-                schema,
-                target_table,
-                sheet_uuids
-            )
+            if partial:
+                # only part of the tab was read, so absence from it says nothing about deletions
+                print(f"[{target_table}] partial sync: deletion detection deferred to next full sync")
+                deletion_res = {"deleted": 0}
+            else:
+                # full reads always check the target itself; the snapshot only narrows the upsert
+                deletion_res = handle_deleted_rows(
+                    db,
+                    schema,
+                    target_table,
+                    sheet_uuids,
+                    outbox_run_id=stats.run_id if m.get("publish_changes") else None,
+                )
+
+            # a dirty-range sync doesn't count towards the full reconciliation interval
+            if not row_range:
+                mark_mapping_synced(db, schema, name, target_table)
+            if (deletion_res or {}).get("deleted"):
+                record_table_change(db, schema, target_table, stats.run_id)
+
+            # after the run's last change_seq bump, so the next run sees the state it leaves
+            if snapshot is not None:
+                fingerprint = target_fingerprint(db, schema, target_table)
+            if write_back is not None:
+                set_checkpoint_phase(db, schema, name, "deleted")
+
+            # phase boundary: archive + delete
+            db.commit()
+
+            # snapshot only moves forward once the DB state it describes is committed
+            if snapshot is not None:
+                save_snapshot(snap_file, columns_key, new_digests, fingerprint, snapshot.get("verified_at"))
 
             deleted_count = (deletion_res or {}).get("deleted", 0)
 
@@ -812,8 +4100,910 @@ def main():
             print("Deletion handling failed AFTER sheet sync")
             print("Error:", e)
             traceback.print_exc()
-            return
+            db.rollback()
+            return {"name": name, "status": "failed", "error": f"deletion: {e}"}
+
+    return {
+        "name": name,
+        "status": "ok",
+        "write_back": write_back,
+        "inserted": res["inserted"],
+        "updated": res["updated"],
+        "unchanged": res["unchanged"],
+        "deleted": deleted_count,
+        "formatting_only_updates": formatting_only,
+    }
+
+# --- post-sync maintenance ---
+STORAGE_SETTING_RE = re.compile(r"^(fillfactor|(toast\.)?autovacuum_[a-z_]+)$")
+
+def _same_reloption(current, wanted):
+    # reloptions keep the text they were set with: 90 / 90.0 and 0.05 / 0.050 are the same value
+    if current is None:
+        return False
+    try:
+        return float(current) == float(wanted)
+    except ValueError:
+        return current.lower() == str(wanted).lower()
+
+def apply_table_storage_settings(engine, schema, table, settings):
+    """
+    Apply per-table storage parameters from mappings.yml (fillfactor, autovacuum_*),
+    only issuing ALTER TABLE when a value actually differs.
+    A fillfactor below 100 leaves room on each page so processed_at rewrites can stay HOT.
+    Returns the changed settings; for a partitioned table, {partition: changed settings}.
+    """
+    if not settings:
+        return {}
+
+    with engine.connect() as conn:
+        found = conn.execute(text("""
+            SELECT c.relkind, c.reloptions
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema
+            AND c.relname = :table
+        """), {"schema": schema, "table": table}).first()
+        leaves = []
+        if found and found.relkind == "p":
+            leaves = conn.execute(text("""
+                SELECT c.relname
+                FROM pg_partition_tree(to_regclass(:parent)) t
+                JOIN pg_class c ON c.oid = t.relid
+                WHERE t.isleaf
+                ORDER BY c.relname
+            """), {"parent": f'{schema}."{table}"'}).scalars().all()
+
+    # a partitioned parent has no storage of its own (and rejects the ALTER): the settings go
+    # on each partition instead; ones created later get them after the run that creates them
+    if found and found.relkind == "p":
+        changed = {}
+        for leaf in leaves:
+            leaf_changes = apply_table_storage_settings(engine, schema, leaf, settings)
+            if leaf_changes:
+                changed[leaf] = leaf_changes
+        return changed
+
+    current = dict(o.split("=", 1) for o in (found.reloptions if found else None) or [])
+
+    changes = {}
+    for k, v in settings.items():
+        if not STORAGE_SETTING_RE.match(str(k)):
+            raise ValueError(f"[{table}] unsupported storage setting in mappings.yml: {k}")
+        if isinstance(v, bool):
+            v = "true" if v else "false"
+        elif not isinstance(v, (int, float)):
+            raise ValueError(f"[{table}] storage setting {k} must be a number or boolean")
+        if not _same_reloption(current.get(k), v):
+            changes[k] = v
+
+    if changes:
+        assignments = ", ".join(f"{k} = {v}" for k, v in changes.items())
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {schema}."{table}" SET ({assignments})'))
+        print(f"[{table}] storage settings applied: {assignments}")
+    return changes
+
+def table_health(engine, schema, table):
+    # live/dead tuples and a simple bloat estimate (dead share of the heap size)
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT
+                s.n_live_tup,
+                s.n_dead_tup,
+                pg_table_size(s.relid) AS size_bytes,
+                s.last_autovacuum,
+                s.last_analyze,
+                s.last_autoanalyze,
+                (SELECT c.relkind FROM pg_class c WHERE c.oid = s.relid) AS relkind
+            FROM pg_stat_user_tables s
+            WHERE s.schemaname = :schema
+            AND s.relname = :table
+        """), {"schema": schema, "table": table}).mappings().fetchone()
+        if row is not None and row["relkind"] == "p":
+            # the parent holds no rows: add up its partitions
+            row = conn.execute(text("""
+                SELECT
+                    SUM(s.n_live_tup)::bigint AS n_live_tup,
+                    SUM(s.n_dead_tup)::bigint AS n_dead_tup,
+                    SUM(pg_table_size(s.relid))::bigint AS size_bytes,
+                    MAX(s.last_autovacuum) AS last_autovacuum,
+                    MAX(s.last_analyze) AS last_analyze,
+                    MAX(s.last_autoanalyze) AS last_autoanalyze
+                FROM pg_stat_user_tables s
+                WHERE s.relid IN (SELECT relid FROM pg_partition_tree(to_regclass(:parent)))
+            """), {"parent": f'{schema}."{table}"'}).mappings().fetchone()
+
+    if row is None:
+        return None
+
+    live = row["n_live_tup"] or 0
+    dead = row["n_dead_tup"] or 0
+    dead_ratio = dead / (live + dead) if (live + dead) else 0.0
+    return {
+        "live_rows": live,
+        "dead_rows": dead,
+        "size_bytes": row["size_bytes"] or 0,
+        "dead_ratio": dead_ratio,
+        "est_bloat_bytes": int((row["size_bytes"] or 0) * dead_ratio),
+        "last_autovacuum": row["last_autovacuum"],
+        "last_analyze": max([d for d in (row["last_analyze"], row["last_autoanalyze"]) if d], default=None),
+    }
+
+def declared_index_name(table, cols):
+    return f"idx_{table}_{'_'.join(cols)}"[:63]
+
+def ensure_declared_indexes(engine, schema, table, indexes):
+    """
+    Create the mapping's declared indexes (mappings.yml indexes: [sku, [order_id, line_no]])
+    when missing. Returns [(index name, columns)].
+    """
+    created = []
+    for spec in indexes or []:
+        cols = normalize_columns([spec] if isinstance(spec, str) else list(spec))
+        index_name = declared_index_name(table, cols)
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON {schema}."{table}" ({col_list})'))
+        created.append((index_name, cols))
+    return created
+
+def run_table_maintenance(engine, m, result):
+    """
+    After a mapping synced: apply its storage settings, ANALYZE only if the run's churn
+    passed the threshold, and return a health/bloat report for the run summary.
+    """
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    maintenance = m.get("maintenance") or {}
+
+    apply_table_storage_settings(engine, schema, target_table, maintenance.get("storage"))
+    ensure_declared_indexes(engine, schema, target_table, m.get("indexes"))
+
+    churn = result.get("inserted", 0) + result.get("updated", 0) + result.get("deleted", 0)
+    health = table_health(engine, schema, target_table) or {}
+    live = health.get("live_rows", 0)
+
+    min_rows = maintenance.get("analyze_min_churn_rows", ANALYZE_MIN_CHURN_ROWS)
+    ratio = maintenance.get("analyze_churn_ratio", ANALYZE_CHURN_RATIO)
+    analyzed = False
+    if churn > 0 and churn >= min_rows and churn >= ratio * live:
+        with engine.begin() as conn:
+            conn.execute(text(f'ANALYZE {schema}."{target_table}"'))
+        analyzed = True
+        print(f"[{target_table}] ANALYZE after churn of {churn} rows")
+
+    return {"churn": churn, "analyzed": analyzed, **health}
+
+# --- parquet snapshots ---
+# <PARQUET_DIR>/<schema>/<table>/v000001.parquet ... plus manifest.json listing every kept
+# version. Files are written next to their final name and renamed, so readers never see a
+# partial snapshot; manifest.json is replaced the same way once the file is in place.
+PARQUET_TYPES = {
+    "uuid": "string",
+    "text": "string",
+    "character varying": "string",
+    "jsonb": "string",
+    "json": "string",
+    "numeric": "string",
+    "integer": "int32",
+    "smallint": "int16",
+    "bigint": "int64",
+    "double precision": "float64",
+    "real": "float32",
+    "boolean": "bool_",
+    "date": "date32",
+    "timestamp with time zone": "timestamptz",
+    "timestamp without time zone": "timestamp",
+}
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("parquet_snapshot needs pyarrow (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet
+
+def parquet_schema(engine, schema, table):
+    pa, _ = _import_pyarrow()
+    with engine.connect() as conn:
+        cols = conn.execute(text("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :table
+            ORDER BY ordinal_position
+        """), {"schema": schema, "table": table}).fetchall()
+
+    def _type(data_type):
+        kind = PARQUET_TYPES.get(data_type, "string")
+        if kind == "timestamptz":
+            return pa.timestamp("us", tz="UTC")
+        if kind == "timestamp":
+            return pa.timestamp("us")
+        return getattr(pa, kind)()
+
+    return pa.schema([pa.field(name, _type(data_type)) for name, data_type in cols])
+
+def parquet_manifest_path(out_dir, schema, table):
+    return os.path.join(out_dir, schema, table, "manifest.json")
+
+def load_parquet_manifest(out_dir, schema, table):
+    path = parquet_manifest_path(out_dir, schema, table)
+    if not os.path.exists(path):
+        return {"schema": schema, "table": table, "versions": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_json_atomic(path, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+def export_parquet_snapshot(engine, schema, table, out_dir=None, run_id=None,
+                            row_group_rows=None, compression=None, keep_versions=None):
+    """
+    Stream schema.table into a new Parquet version (one row group per fetched batch, so
+    memory stays bounded by row_group_rows) and record it in the table's manifest.
+    Returns the manifest entry of the new version.
+    """
+    pa, pq = _import_pyarrow()
+    out_dir = out_dir or PARQUET_DIR
+    row_group_rows = row_group_rows or PARQUET_ROW_GROUP_ROWS
+    compression = compression or PARQUET_COMPRESSION
+    keep_versions = PARQUET_KEEP_VERSIONS if keep_versions is None else keep_versions
+
+    table_dir = os.path.join(out_dir, schema, table)
+    os.makedirs(table_dir, exist_ok=True)
+    manifest = load_parquet_manifest(out_dir, schema, table)
+    version = max((v["version"] for v in manifest["versions"]), default=0) + 1
+    file_name = f"v{version:06d}.parquet"
+    path = os.path.join(table_dir, file_name)
+    tmp = f"{path}.tmp"
+
+    arrow_schema = parquet_schema(engine, schema, table)
+    if not len(arrow_schema):
+        raise RuntimeError(f"[{table}] target table not found, nothing to snapshot")
+    string_cols = [i for i, f in enumerate(arrow_schema) if pa.types.is_string(f.type)]
+
+    rows = 0
+    row_groups = 0
+    col_list = ", ".join(f'"{f.name}"' for f in arrow_schema)
+    try:
+        with pq.ParquetWriter(tmp, arrow_schema, compression=compression) as writer, engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=row_group_rows).execute(
+                text(f'SELECT {col_list} FROM {schema}."{table}"')
+            )
+            for batch in result.partitions(row_group_rows):
+                columns = [list(c) for c in zip(*batch)]
+                for i in string_cols:
+                    columns[i] = [None if v is None else str(v) for v in columns[i]]
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(c, type=f.type) for c, f in zip(columns, arrow_schema)],
+                    schema=arrow_schema,
+                ))
+                rows += len(batch)
+                row_groups += 1
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    entry = {
+        "version": version,
+        "file": file_name,
+        "run_id": run_id,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "rows": rows,
+        "row_groups": row_groups,
+        "bytes": os.path.getsize(path),
+        "compression": compression,
+        "columns": [f.name for f in arrow_schema],
+    }
+    manifest["versions"].append(entry)
+
+    # drop the oldest versions beyond keep_versions (0 = keep everything)
+    expired = manifest["versions"][:-keep_versions] if keep_versions > 0 else []
+    manifest["versions"] = manifest["versions"][len(expired):]
+    manifest["latest"] = file_name
+    _write_json_atomic(parquet_manifest_path(out_dir, schema, table), manifest)
+    for old in expired:
+        try:
+            os.remove(os.path.join(table_dir, old["file"]))
+        except FileNotFoundError:
+            pass
+
+    print(f"[{table}] parquet snapshot {file_name}: {rows} rows, {row_groups} row groups, {entry['bytes'] // 1024}kB")
+    return entry
+
+def run_parquet_export(engine, m, result, run_id=None, out_dir=None):
+    """
+    Post-sync stage for mappings with parquet_snapshot: write a new version only when the
+    run changed the table (or no snapshot exists yet). Returns the entry, or None if skipped.
+    """
+    if not m.get("parquet_snapshot"):
+        return None
+    schema = m.get("schema")
+    target_table = m.get("target_table")
+    out_dir = out_dir or PARQUET_DIR
+
+    churn = result.get("inserted", 0) + result.get("updated", 0) + result.get("deleted", 0)
+    if not churn and load_parquet_manifest(out_dir, schema, target_table)["versions"]:
+        print(f"[{target_table}] unchanged, parquet snapshot kept")
+        return None
+    options = m["parquet_snapshot"] if isinstance(m["parquet_snapshot"], dict) else {}
+    return export_parquet_snapshot(
+        engine, schema, target_table, out_dir, run_id,
+        row_group_rows=options.get("row_group_rows"),
+        compression=options.get("compression"),
+        keep_versions=options.get("keep_versions"),
+    )
+
+def print_run_summary(results):
+    print("==== run summary ====")
+    for r in results:
+        line = f"[{r['name']}] {r['status']}"
+        if "inserted" in r:
+            line += f" ins={r['inserted']} upd={r['updated']} unch={r['unchanged']} del={r['deleted']}"
+            if r.get("formatting_only_updates"):
+                line += f" fmt_only={r['formatting_only_updates']}"
+        st = r.get("stats")
+        if st is not None and st.ended_at:
+            line += f" {(st.ended_at - st.started_at).total_seconds():.1f}s google_calls={st.google_calls}"
+        mt = r.get("maintenance")
+        if mt:
+            line += f" analyzed={'yes' if mt['analyzed'] else 'no'}"
+            if "live_rows" in mt:
+                line += (
+                    f" live={mt['live_rows']} dead={mt['dead_rows']}"
+                    f" ({mt['dead_ratio']:.0%}) est_bloat={mt['est_bloat_bytes'] // 1024}kB"
+                )
+        if r.get("parquet"):
+            line += f" parquet={r['parquet']['file']}"
+        if r.get("archive"):
+            line += f" archived={r['archive']['archived']}"
+        print(line)
+
+def _fmt_bytes(n):
+    for unit in ("B", "kB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+def print_db_cost(results):
+    rows = [(r["name"], r["stats"]) for r in results if r.get("stats") is not None and r["stats"].db_cost]
+    if not rows:
+        return
+    print(f"==== db cost per phase ({rows[0][1].cost_meter.source}) ====")
+    for name, st in rows:
+        heaviest = max(st.db_cost.items(), key=lambda kv: kv[1]["wal_bytes"])[0]
+        for phase, c in st.db_cost.items():
+            if not any(c.values()):
+                continue
+            print(
+                f"[{name}] {phase:<20} wal={_fmt_bytes(c['wal_bytes'])} hit={c['blks_hit']} "
+                f"read={c['blks_read']} rows={c['rows']} lock_wait={c['lock_wait_s']:.2f}s"
+                + ("  <- most WAL" if phase == heaviest and c["wal_bytes"] else "")
+            )
+
+def create_sync_runs_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.sync_runs (
+                run_id UUID,
+                mapping_name TEXT,
+                target_table TEXT,
+                started_at TIMESTAMPTZ,
+                ended_at TIMESTAMPTZ,
+                outcome TEXT,
+                error TEXT,
+                phase_seconds JSONB,
+                rows_read INTEGER,
+                rows_staged INTEGER,
+                inserted INTEGER,
+                updated INTEGER,
+                unchanged INTEGER,
+                deleted INTEGER,
+                google_calls INTEGER,
+                google_bytes BIGINT,
+                retries INTEGER,
+                PRIMARY KEY (run_id, mapping_name)
+            );
+        """))
+        add_columns_if_missing(conn, schema, "sync_runs", {
+            "formatting_only_updates": "INTEGER",
+            "db_cost": "JSONB",
+        })
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_sync_runs_mapping_started
+            ON {schema}.sync_runs (mapping_name, started_at);
+        """))
+
+def write_sync_runs(engine, all_stats):
+    """
+    Append one sync_runs row per mapping for this run: a single batched INSERT per schema,
+    done once at the end so the ledger never slows the pipeline itself.
+    """
+    by_schema = {}
+    for st in all_stats:
+        if st.schema and st.outcome:
+            by_schema.setdefault(st.schema, []).append(st.as_row())
+
+    for schema, rows in by_schema.items():
+        create_sync_runs_table_if_not_exists(engine, schema)
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {schema}.sync_runs (
+                    run_id, mapping_name, target_table, started_at, ended_at, outcome, error,
+                    phase_seconds, db_cost, rows_read, rows_staged, inserted, updated, unchanged, deleted,
+                    formatting_only_updates, google_calls, google_bytes, retries
+                ) VALUES (
+                    :run_id, :mapping_name, :target_table, :started_at, :ended_at, :outcome, :error,
+                    :phase_seconds, :db_cost, :rows_read, :rows_staged, :inserted, :updated, :unchanged, :deleted,
+                    :formatting_only_updates, :google_calls, :google_bytes, :retries
+                )
+            """), rows)
+
+# --- push notifications: dirty-range queue ---
+# The sheet-side trigger posts {spreadsheet_id, sheet_name, start_row, end_row} to the receiver,
+# which queues it in <schema>.sheet_dirty_ranges. Workers claim a tab's queued ranges,
+# coalesce them and sync only those rows; interval_minutes full syncs reconcile the rest.
+def create_dirty_ranges_table_if_not_exists(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.sheet_dirty_ranges (
+                id BIGSERIAL PRIMARY KEY,
+                mapping_name TEXT NOT NULL,
+                start_row INTEGER,
+                end_row INTEGER,
+                received_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMPTZ,
+                done_at TIMESTAMPTZ
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_sheet_dirty_ranges_open
+            ON {schema}.sheet_dirty_ranges (mapping_name, id)
+            WHERE done_at IS NULL
+        """))
+
+def enqueue_dirty_range(engine, schema, mapping_name, start_row=None, end_row=None):
+    # start_row/end_row None = the whole tab changed (rows inserted/removed, sort, paste)
+    create_dirty_ranges_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        return conn.execute(text(f"""
+            INSERT INTO {schema}.sheet_dirty_ranges (mapping_name, start_row, end_row)
+            VALUES (:name, :start, :end)
+            RETURNING id
+        """), {"name": mapping_name, "start": start_row, "end": end_row}).scalar()
+
+def claim_dirty_ranges(engine, schema, mapping_name, stale_minutes=10):
+    """
+    Claim every open range of a tab (claims older than stale_minutes are considered
+    abandoned by a dead worker). Returns [(id, start_row, end_row)].
+    """
+    create_dirty_ranges_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            UPDATE {schema}.sheet_dirty_ranges
+            SET claimed_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM {schema}.sheet_dirty_ranges
+                WHERE mapping_name = :name
+                  AND done_at IS NULL
+                  AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - make_interval(mins => :stale))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, start_row, end_row
+        """), {"name": mapping_name, "stale": stale_minutes}).fetchall()
+    return sorted(tuple(r) for r in rows)
+
+def finish_dirty_ranges(engine, schema, ids, ok):
+    # done on success; otherwise unclaim so the next pass retries
+    if not ids:
+        return
+    assignment = "done_at = CURRENT_TIMESTAMP" if ok else "claimed_at = NULL"
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {schema}.sheet_dirty_ranges SET {assignment} WHERE id = ANY(:ids)
+        """), {"ids": list(ids)})
+
+def coalesce_dirty_ranges(ranges, max_span=None):
+    """
+    Merge a burst of (start_row, end_row) edits into one row range to read.
+    Returns None when the tab needs a full sync (whole-tab event or span too wide).
+    """
+    max_span = max_span or DIRTY_RANGE_MAX_SPAN
+    if not ranges or any(start is None or end is None for start, end in ranges):
+        return None
+    start = max(2, min(r[0] for r in ranges))
+    end = max(r[1] for r in ranges)
+    if end < start or end - start + 1 > max_span:
+        return None
+    return (start, end)
+
+def resolve_mapping(mappings, spreadsheet_id, sheet_name):
+    for m in mappings:
+        if m.get("sheet_id") == spreadsheet_id and m.get("sheet_name") == sheet_name:
+            return m
+    return None
+
+def handle_notification(engine, mappings, payload, token=None):
+    """
+    Validate one edit notification and queue it. Returns (http_status, response_body).
+    Kept apart from the HTTP handler so it can be exercised directly.
+    """
+
+    if not RECEIVER_TOKEN or not hmac.compare_digest(str(token or ""), RECEIVER_TOKEN):
+        return 401, {"error": "bad token"}
+    if not isinstance(payload, dict):
+        return 400, {"error": "expected a JSON object"}
+
+    m = resolve_mapping(mappings, payload.get("spreadsheet_id"), payload.get("sheet_name"))
+    if m is None:
+        return 404, {"error": "no mapping for this tab"}
+
+    start_row, end_row = payload.get("start_row"), payload.get("end_row")
+    if (start_row is None) != (end_row is None):
+        return 400, {"error": "start_row and end_row go together"}
+    if start_row is not None:
+        try:
+            start_row, end_row = int(start_row), int(end_row)
+        except (TypeError, ValueError):
+            return 400, {"error": "start_row/end_row must be integers"}
+        if start_row < 1 or end_row < start_row:
+            return 400, {"error": "invalid row range"}
+        if start_row == 1:
+            # header edit: column set may have changed, reconcile the whole tab
+            start_row = end_row = None
+
+    name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+    queued_id = enqueue_dirty_range(engine, m.get("schema"), name, start_row, end_row)
+    return 202, {"queued": queued_id, "mapping": name}
+
+def run_receiver(eng, mappings, port=None):
+    """--receiver: accept POST /notify from the sheet-side trigger and queue dirty ranges."""
+
+    if not RECEIVER_TOKEN:
+        raise RuntimeError("RECEIVER_TOKEN must be set to run the receiver.")
+
+    class NotifyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Prometheus text format: write-back queue depth / oldest entry per schema
+            if self.path != "/metrics":
+                return self._reply(404, {"error": "not found"})
+            lines = []
+            for schema in sorted({m.get("schema") for m in mappings if m.get("schema")}):
+                q = write_back_queue_metrics(eng, schema)
+                lines.append(f'sheets_write_back_queue_depth{{schema="{schema}"}} {q["depth"]}')
+                lines.append(f'sheets_write_back_queue_oldest_seconds{{schema="{schema}"}} {q["oldest_age_s"]:.1f}')
+                lines.append(f'sheets_write_back_queue_retrying{{schema="{schema}"}} {q["retrying"]}')
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != "/notify":
+                return self._reply(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"null")
+            except (ValueError, json.JSONDecodeError):
+                return self._reply(400, {"error": "invalid JSON"})
+            token = self.headers.get("X-Receiver-Token") or (payload or {}).get("token")
+            try:
+                status, body = handle_notification(eng, mappings, payload, token)
+            except Exception as e:
+                traceback.print_exc()
+                status, body = 500, {"error": str(e)}
+            self._reply(status, body)
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            print(f"[receiver] {self.address_string()} {fmt % args}")
+
+    server = ThreadingHTTPServer(("0.0.0.0", port or RECEIVER_PORT), NotifyHandler)
+    print(f"[receiver] listening on :{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def run_dirty_ranges(eng, mappings, profile=False, db_cost=False):
+    """
+    Sync the queued dirty ranges: one coalesced row range per tab (or a full sync when
+    the burst is too wide). Claims are marked done once the write-back has landed.
+    """
+    claims = []
+    row_ranges = {}
+    for m in mappings:
+        name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+        claimed = claim_dirty_ranges(eng, m.get("schema"), name)
+        if not claimed:
+            continue
+        row_ranges[name] = coalesce_dirty_ranges([(start, end) for _, start, end in claimed])
+        claims.append((m, [i for i, _, _ in claimed]))
+        print(f"[{name}] {len(claimed)} queued edit(s) -> "
+              f"{'rows %d-%d' % row_ranges[name] if row_ranges[name] else 'full sync'}")
+
+    if not claims:
+        return []
+
+    results = run_mappings(eng, [m for m, _ in claims], profile=profile, row_ranges=row_ranges, db_cost=db_cost)
+    status = {r["name"]: r.get("status") for r in results}
+    for m, ids in claims:
+        name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+        finish_dirty_ranges(eng, m.get("schema"), ids, ok=status.get(name) == "ok")
+    return results
+
+def run_mappings(eng, mappings, require_due=False, profile=False, row_ranges=None, rebuild=(), db_cost=False):
+    """
+    Sync the given mappings once. Each mapping is only processed under its lease;
+    mappings leased by another worker (or not yet due when require_due) are skipped.
+    Leases are held until the deferred write-back has been flushed so no other
+    worker can re-read a tab before its new UUIDs reach the sheet; all of them sit on one
+    connection outside the pool, so the number of mappings doesn't bound the pool.
+    With profile, every phase runs under cProfile + tracemalloc (see PhaseProfiler).
+    row_ranges={name: (start_row, end_row)} limits those mappings to a dirty row range.
+    Mappings named in rebuild have their target bulk-reloaded (see bootstrap_mapping).
+    With db_cost (or DB_COST_REPORT), each phase's database cost is measured (see DbCostMeter).
+    """
+    global _ACTIVE_STATS, _MAPPING_DEADLINE
+
+    run_id = str(uuid.uuid4())
+    reset_google_retry_budget()
+    profile_dir = None
+    if profile:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        profile_dir = os.path.join(PROFILE_DIR, f"{stamp}_{run_id[:8]}")
+
+    # one meter for the run: mappings are synced one after another
+    cost_meter = DbCostMeter(eng) if db_cost or DB_COST_REPORT else None
+
+    def new_stats(m):
+        return MappingStats(run_id, m, PhaseProfiler(profile_dir) if profile else None, cost_meter)
+
+    # write-backs are queued as each mapping commits and sent by the drainer in the background;
+    # the shared flushes are attributed evenly to the tabs they carried
+    flush_stats = MappingStats(run_id, {"name": "write_back_flush"})
+    drainer = WriteBackDrainer(eng, run_id, flush_stats)
+    write_backs = []
+    results = []
+    leases = []
+    lease_conn = open_lease_connection(eng)
+    all_stats = []
+
+    try:
+        for m in mappings:
+            name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+            lease = MappingLease(eng, m.get("schema"), m.get("target_table"), conn=lease_conn)
+            if not lease.acquire():
+                print(f"[{name}] leased by another worker, skipping")
+                results.append({"name": name, "status": "leased"})
+                continue
+            leases.append(lease)
+
+            # re-check after claiming: another worker may have just finished it
+            if require_due and not is_mapping_due(eng, m):
+                lease.release()
+                continue
+
+            stats = new_stats(m)
+            all_stats.append(stats)
+            _ACTIVE_STATS = stats
+            deadline = float(m.get("deadline_seconds") or MAPPING_DEADLINE_SECONDS)
+            _MAPPING_DEADLINE = time.monotonic() + deadline if deadline > 0 else None
+            try:
+                result = sync_mapping(
+                    eng, m, stats, row_range=(row_ranges or {}).get(name), rebuild=name in rebuild
+                )
+            except Exception as e:
+                # guards raise; one broken tab must not stop the others
+                print(f"[{name}] failed: {e}")
+                traceback.print_exc()
+                result = {"name": name, "status": "failed", "error": f"{stats._phase or 'setup'}: {e}"}
+            finally:
+                _ACTIVE_STATS = None
+                _MAPPING_DEADLINE = None
+            result["stats"] = stats
+            results.append(result)
+            if result.get("write_back"):
+                write_backs.append(result["write_back"])
+                try:
+                    drainer.enqueue(result["write_back"])
+                except Exception as e:
+                    # the checkpoint still holds the payload; the next run resumes from it
+                    print(f"[{name}] failed to queue write-back: {e}")
+                    traceback.print_exc()
+            if result["status"] == "ok" and "inserted" in result:
+                stats.phase("maintenance")
+                try:
+                    result["maintenance"] = run_table_maintenance(eng, m, result)
+                except Exception as e:
+                    print(f"[{result['name']}] maintenance failed: {e}")
+                    traceback.print_exc()
+                if m.get("parquet_snapshot"):
+                    stats.phase("parquet_export")
+                    try:
+                        result["parquet"] = run_parquet_export(eng, m, result, run_id)
+                    except Exception as e:
+                        print(f"[{result['name']}] parquet snapshot failed: {e}")
+                        traceback.print_exc()
+            stats.finish(result)
+            _report_profile(stats)
+
+        flushed = drainer.close()
+        flush_stats.finish({})
+        flushed_stats = [r["stats"] for r in results if r.get("write_back") and "stats" in r]
+        share = len(flushed_stats)
+        for i, st in enumerate(flushed_stats):
+            st.phase_seconds["write_back_flush"] = flush_stats.phase_seconds.get("write_back_flush", 0.0) / share
+            # even split; the last tab takes the remainder so the totals match what was sent
+            for attr in ("google_calls", "google_bytes", "retries"):
+                total = getattr(flush_stats, attr)
+                part = total // share + (total % share if i == share - 1 else 0)
+                setattr(st, attr, getattr(st, attr) + part)
+            if not flushed.get(st.name):
+                st.outcome = "write_back_failed"
+
+        for r in results:
+            if r.get("write_back") and not flushed.get(r["name"]):
+                r["status"] = "write_back_failed"
+
+        # an append-only tab whose UUIDs never reached the sheet must be fully re-read next time
+        for m in mappings:
+            name = m.get("name") or f"mapping_{m.get('sheet_name')}"
+            if m.get("append_only") and name in {wb["name"] for wb in write_backs} and not flushed.get(name):
+                reset_sync_state(eng, m.get("schema"), name)
+
+        # sheet-side archival only once the tab's write-back has landed: deleting rows shifts
+        # every position a pending write-back was computed for
+        by_name = {r["name"]: r for r in results}
+        for m in mappings:
+            r = by_name.get(m.get("name") or f"mapping_{m.get('sheet_name')}")
+            if not m.get("archive") or r is None or r["status"] != "ok" or "stats" not in r:
+                continue
+            stats = r["stats"]
+            _ACTIVE_STATS = stats
+            stats.phase("sheet_archive")
+            try:
+                r["archive"] = archive_sheet_rows(eng, m, run_id)
+                if r["archive"]["archived"] and m.get("append_only"):
+                    reset_sync_state(eng, m.get("schema"), r["name"])
+            except Exception as e:
+                print(f"[{r['name']}] sheet archival failed: {e}")
+                traceback.print_exc()
+            finally:
+                stats._close_phase()
+                _ACTIVE_STATS = None
+    finally:
+        drainer.close()
+        try:
+            for lease in leases:
+                lease.release()
+        finally:
+            # closing the session drops any lock a failed release left behind
+            lease_conn.close()
+        if profile:
+            stop_profiling()
+        if cost_meter is not None:
+            cost_meter.close()
+
+    if not failed_results(results):
+        # drop expired deleted_rows_log partitions once per schema
+        for schema in sorted({m.get("schema") for m in mappings if m.get("schema")}):
+            try:
+                apply_deleted_log_retention(eng, schema)
+            except Exception as e:
+                print(f"[{schema}.deleted_rows_log] retention failed: {e}")
+                traceback.print_exc()
+            try:
+                pruned = prune_change_outbox(eng, schema)
+                if pruned:
+                    print(f"[{schema}.change_outbox] pruned {pruned} rows older than {CHANGE_OUTBOX_RETENTION_DAYS} days")
+            except Exception as e:
+                print(f"[{schema}.change_outbox] retention failed: {e}")
+                traceback.print_exc()
+
+    try:
+        write_sync_runs(eng, all_stats)
+    except Exception as e:
+        print(f"[sync_runs] failed to record run {run_id}: {e}")
+        traceback.print_exc()
+
+    print_run_summary(results)
+    print_write_back_queue(eng, drainer.schemas)
+    print_db_cost(results)
+    print_google_latency()
+    return results
+
+FAILED_STATUSES = ("failed", "write_back_failed")
+
+def failed_results(results):
+    return [r for r in results if r.get("status") in FAILED_STATUSES]
+
+def run_exit_code(results):
+    """0 = every mapping ok/skipped, 1 = some mappings failed, 2 = every attempted mapping failed."""
+    failed = failed_results(results)
+    attempted = [r for r in results if r.get("status") not in ("skipped", "leased")]
+    if not failed:
+        return 0
+    names = ", ".join(f"{r['name']} ({r.get('error') or r['status']})" for r in failed)
+    print(f"==== {len(failed)} of {len(attempted)} mappings failed: {names}")
+    return 2 if len(failed) == len(attempted) else 1
+
+def run_worker(eng, poll_seconds=30, once=False, profile=False, db_cost=False):
+    """
+    Worker mode: any number of exporter processes/containers can run this loop.
+    Each pass claims the due, unleased mappings (longest-waiting first) and syncs them.
+    With once, returns the pass's exit code (see run_exit_code).
+    """
+
+    while True:
+        # pushed edits first: they are small and someone is waiting for them
+        results = run_dirty_ranges(eng, MAPPINGS, profile=profile, db_cost=db_cost)
+        due = [m for m in MAPPINGS if is_mapping_due(eng, m)]
+        # never-synced first, then the ones that have waited longest
+        epoch = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        due.sort(key=lambda m: mapping_last_success(eng, m) or epoch)
+        if due:
+            results += run_mappings(eng, due, require_due=True, profile=profile, db_cost=db_cost)
+        if once:
+            return run_exit_code(results)
+        time.sleep(poll_seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Google Sheets tabs into Postgres.")
+    parser.add_argument("--worker", action="store_true",
+                        help="keep running, claiming due mappings not leased by another worker")
+    parser.add_argument("--poll-seconds", type=int, default=30,
+                        help="worker mode: pause between passes")
+    parser.add_argument("--once", action="store_true",
+                        help="worker mode: do a single pass and exit")
+    parser.add_argument("--receiver", action="store_true",
+                        help=f"run the edit-notification endpoint (POST /notify on RECEIVER_PORT, default {RECEIVER_PORT})")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"cProfile + tracemalloc every mapping phase; reports go to {PROFILE_DIR}")
+    parser.add_argument("--db-cost", action="store_true",
+                        help="report each phase's database cost (WAL, buffers, rows, lock wait); also DB_COST_REPORT=1")
+    parser.add_argument("--rebuild", action="append", default=[], metavar="MAPPING",
+                        help="bulk-reload this mapping's target table from the sheet (repeatable); keeps its "
+                             "grants, comments and storage settings, but fails if views depend on the table "
+                             "(drop and recreate them around the rebuild)")
+    args = parser.parse_args(argv)
+
+    eng = get_engine()
+
+    if args.receiver:
+        return run_receiver(eng, MAPPINGS)
+    if args.worker:
+        return run_worker(eng, poll_seconds=args.poll_seconds, once=args.once, profile=args.profile,
+                          db_cost=args.db_cost)
+    if args.rebuild:
+        names = {m.get("name") for m in MAPPINGS}
+        unknown = sorted(set(args.rebuild) - names)
+        if unknown:
+            parser.error(f"unknown mapping(s) for --rebuild: {', '.join(unknown)}")
+        selected = [m for m in MAPPINGS if m.get("name") in args.rebuild]
+        return run_exit_code(run_mappings(eng, selected, profile=args.profile, rebuild=args.rebuild,
+                                          db_cost=args.db_cost))
+    return run_exit_code(run_mappings(eng, MAPPINGS, profile=args.profile, db_cost=args.db_cost))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
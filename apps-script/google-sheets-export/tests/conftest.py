@@ -1,6 +1,12 @@
 import pytest
 from sqlalchemy import create_engine, text
+from collections.abc import MutableMapping
 import os
+import sys
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
 
 @pytest.fixture(scope="session")
 def engine():
@@ -35,4 +41,206 @@ def engine():
                     EXECUTE 'DROP SCHEMA IF EXISTS ' || quote_ident(r.schema_name) || ' CASCADE';
                 END LOOP;
             END $$;
-        """))
\ No newline at end of file
+        """))
+
+# --- Google Sheets fakes ---
+# One in-memory worksheet/client for every test that runs a sync: reads are served from a
+# list-of-lists grid and write-backs / row deletes are applied to it, so a second run sees what
+# the first one wrote. Use the worksheet, fake_sheets and mapping fixtures below.
+
+
+class _RowView(MutableMapping):
+    """A data row of a FakeWorksheet as a dict keyed by header; writes go to the grid."""
+
+    def __init__(self, ws, values):
+        self.ws = ws
+        self.values = values
+
+    def _index(self, key):
+        return self.ws.grid[0].index(key)
+
+    def __getitem__(self, key):
+        i = self._index(key)
+        return self.values[i] if i < len(self.values) else ""
+
+    def __setitem__(self, key, value):
+        i = self._index(key)
+        self.values.extend([""] * (i + 1 - len(self.values)))
+        self.values[i] = value
+
+    def __delitem__(self, key):
+        raise TypeError("cells can't be removed, only cleared")
+
+    def __iter__(self):
+        return iter(self.ws.grid[0])
+
+    def __len__(self):
+        return len(self.ws.grid[0])
+
+
+class FakeWorksheet:
+    """
+    grid[0] is the header. formatted, when given, is what get_all_records() sees (the
+    FORMATTED_VALUE grid) while get()/batch_get() serve grid. on_read is called before every
+    full read. Counters: full_reads, batch_reads (the ranges of each batch_get), render_options,
+    writes (A1 ranges written back).
+    """
+
+    id = 7
+
+    def __init__(self, grid, title="orders", formatted=None, on_read=None):
+        self.grid = grid
+        self.title = title
+        self.formatted = formatted
+        self.on_read = on_read
+        self.full_reads = 0
+        self.batch_reads = []
+        self.render_options = []
+        self.writes = []
+
+    @classmethod
+    def from_records(cls, header, rows, title="orders"):
+        ws = cls([list(header)], title)
+        ws.rows = rows
+        return ws
+
+    @property
+    def rows(self):
+        return [_RowView(self, r) for r in self.grid[1:]]
+
+    @rows.setter
+    def rows(self, rows):
+        rows = [dict(r) for r in rows]
+        header = list(self.grid[0])
+        for r in rows:
+            header += [k for k in r if k not in header]
+        self.grid[:] = [header] + [[r.get(h, "") for h in header] for r in rows]
+
+    @property
+    def row_count(self):
+        return len(self.grid) + 100
+
+    def _read(self):
+        if self.on_read is not None:
+            self.on_read(self)
+        self.full_reads += 1
+
+    def get_all_records(self):
+        from src.sheets_exporter import records_from_values
+        self._read()
+        grid = self.formatted or self.grid
+        return records_from_values(grid[0], grid[1:])
+
+    def get(self, pad_values=False, value_render_option=None, date_time_render_option=None):
+        self._read()
+        self.render_options.append(value_render_option)
+        return [list(r) for r in self.grid]
+
+    def get_values(self):
+        self._read()
+        return [list(r) for r in self.grid]
+
+    def row_values(self, i):
+        return list(self.grid[i - 1])
+
+    def col_values(self, col):
+        return [row[col - 1] if len(row) >= col else "" for row in self.grid]
+
+    def batch_get(self, ranges, value_render_option=None, date_time_render_option=None):
+        from gspread.utils import a1_range_to_grid_range
+        self.batch_reads.append(list(ranges))
+        out = []
+        for r in ranges:
+            first, last = r.split(":")
+            if first.isdigit():
+                out.append([list(row) for row in self.grid[int(first) - 1:int(last)]])
+            else:
+                a, b = (a1_range_to_grid_range(f"{c}1")["startColumnIndex"] for c in (first, last))
+                out.append([row[a:b + 1] for row in self.grid])
+        return out
+
+    def write(self, range_name, values):
+        from gspread.utils import a1_range_to_grid_range
+        g = a1_range_to_grid_range(range_name)
+        for grid in filter(None, (self.grid, self.formatted)):
+            for offset, (v,) in enumerate(values):
+                row = grid[g["startRowIndex"] + offset]
+                row.extend([""] * (g["startColumnIndex"] + 1 - len(row)))
+                row[g["startColumnIndex"]] = v
+        self.writes.append(range_name)
+
+
+class FakeSpreadsheet:
+    """requests: the ranges of each values_batch_update; a request touching a tab in fail_tabs raises (not retried)."""
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.requests = []
+        self.batch_updates = []
+        self.fail_tabs = set()
+
+    def worksheet(self, name):
+        return self.sheets[name]
+
+    def values_batch_update(self, body):
+        ranges = [d["range"] for d in body["data"]]
+        if any(r.split("!", 1)[0].strip("'") in self.fail_tabs for r in ranges):
+            raise RuntimeError(f"write to {sorted(self.fail_tabs)} refused")
+        self.requests.append(ranges)
+        for d in body["data"]:
+            tab, rng = d["range"].split("!", 1)
+            self.sheets[tab.strip("'")].write(rng, d["values"])
+
+    def batch_update(self, body):
+        self.batch_updates.append(body)
+        for req in body["requests"]:
+            r = req["deleteDimension"]["range"]
+            ws = next(ws for ws in self.sheets.values() if ws.id == r["sheetId"])
+            assert r["dimension"] == "ROWS"
+            del ws.grid[r["startIndex"]:r["endIndex"]]
+
+
+class FakeClient:
+    def __init__(self, sheets):
+        self.spreadsheet = FakeSpreadsheet(sheets)
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+@pytest.fixture
+def worksheet():
+    """The FakeWorksheet class: worksheet(grid, title) or worksheet.from_records(header, rows)."""
+    return FakeWorksheet
+
+
+@pytest.fixture
+def fake_sheets(monkeypatch):
+    """
+    fake_sheets(ws) or fake_sheets({tab: ws, ...}) routes get_gspread_client() to those
+    worksheets (a single ws is served under its own title) and returns the FakeClient.
+    """
+    from src import sheets_exporter
+
+    def install(sheets):
+        if isinstance(sheets, FakeWorksheet):
+            sheets = {sheets.title: sheets}
+        client = FakeClient(sheets)
+        monkeypatch.setattr(sheets_exporter, "get_gspread_client", lambda: client)
+        return client
+
+    return install
+
+
+@pytest.fixture
+def mapping():
+    """mapping(schema, name="orders", **extra): a mapping whose tab, target and name are all `name`."""
+
+    def make(schema, name="orders", **extra):
+        return {
+            "name": name, "sheet_id": "dummy", "sheet_name": name,
+            "schema": schema, "target_table": name,
+            **extra,
+        }
+
+    return make
@@ -0,0 +1,123 @@
+import pytest
+import sys
+import os
+import datetime
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+@pytest.fixture
+def ledger(mapping):
+    def make(schema):
+        return mapping(schema, "ledger", append_only=True, append_tail_window=2)
+    return make
+
+
+def run(sheets_exporter, engine, m):
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["status"] == "ok"
+    if res.get("write_back"):
+        flushed = sheets_exporter.flush_write_backs([res["write_back"]])
+        assert flushed == {"ledger": True}
+        # as run_mappings does after the flush
+        sheets_exporter.confirm_write_backs(engine, [res["write_back"]], flushed)
+    return res
+
+
+def test_append_only_reads_tail_and_falls_back_on_edit(engine, worksheet, fake_sheets, ledger):
+    from src import sheets_exporter
+
+    schema = "test_append1"
+    ws = worksheet([
+        ["internal_uuid", "sku", "qty", "processed_at"],
+        ["", "a", "1", ""],
+        ["", "b", "2", ""],
+        ["", "c", "3", ""],
+    ], title="ledger")
+    fake_sheets(ws)
+
+    # first run: no state yet -> full sync
+    run(sheets_exporter, engine, ledger(schema))
+    assert ws.full_reads == 1
+    state = sheets_exporter.get_sync_state(engine, schema, "ledger")
+    assert state["row_count"] == 3
+
+    # rows appended at the bottom -> only the tail is read and staged
+    ws.grid.append(["", "d", "4", ""])
+    ws.grid.append(["", "e", "5", ""])
+    res = run(sheets_exporter, engine, ledger(schema))
+
+    assert ws.full_reads == 1
+    assert [r[1] for r in ws.batch_reads] == ["3:106"]
+    assert res["write_back"]["data"][0]["range"] == "A5:A6"
+    assert all(row[0] for row in ws.grid[1:])
+
+    with engine.connect() as conn:
+        n = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."ledger"')).scalar()
+    assert n == 5
+    assert sheets_exporter.get_sync_state(engine, schema, "ledger")["row_count"] == 5
+
+    # nothing new -> no DB work at all
+    res = run(sheets_exporter, engine, ledger(schema))
+    assert res["write_back"] is None
+    assert ws.full_reads == 1
+
+    # an edit inside the checksum window forces a full sync
+    ws.grid[4][2] = "40"
+    run(sheets_exporter, engine, ledger(schema))
+    assert ws.full_reads == 2
+
+    with engine.connect() as conn:
+        qty = conn.execute(text(f"""SELECT qty FROM {schema}."ledger" WHERE sku = 'd'""")).scalar()
+    assert qty == "40"
+
+
+def test_idle_append_only_mapping_is_not_due_again(engine, worksheet, fake_sheets, ledger, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_append3"
+    ws = worksheet([
+        ["internal_uuid", "sku", "qty", "processed_at"],
+        ["", "a", "1", ""],
+    ], title="ledger")
+    fake_sheets(ws)
+    m = {**ledger(schema), "interval_minutes": 60}
+    monkeypatch.setattr(sheets_exporter, "MAPPINGS", [m])
+    synced = []
+    real_sync = sheets_exporter.sync_mapping
+    monkeypatch.setattr(sheets_exporter, "sync_mapping", lambda *a, **kw: synced.append(1) or real_sync(*a, **kw))
+
+    def interval_passed():
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                UPDATE {schema}.sync_state SET last_success_at = last_success_at - interval '2 hours'
+                WHERE mapping_name = 'ledger'
+            """))
+
+    assert sheets_exporter.run_worker(engine, once=True) == 0
+    assert len(synced) == 1
+
+    # due again, but nothing was appended: the idle sync still counts as a success
+    interval_passed()
+    assert sheets_exporter.run_worker(engine, once=True) == 0
+    assert len(synced) == 2
+    assert sheets_exporter.run_worker(engine, once=True) == 0
+    assert len(synced) == 2
+
+
+def test_plan_append_tail():
+    from src.sheets_exporter import plan_append_tail
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    state = {"row_count": 10, "tail_checksum": "x", "full_synced_at": now}
+
+    assert plan_append_tail(None, 5, 24) is None
+    assert plan_append_tail(state, 5, 24) == (7, 5)
+    assert plan_append_tail({**state, "row_count": 3}, 5, 24) == (2, 3)
+
+    stale = {**state, "full_synced_at": now - datetime.timedelta(hours=30)}
+    assert plan_append_tail(stale, 5, 24) is None
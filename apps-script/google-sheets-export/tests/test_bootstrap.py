@@ -0,0 +1,162 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+import pytest
+from sqlalchemy import text
+
+
+def indexes_of(engine, schema, table):
+    with engine.connect() as conn:
+        return sorted(r[0] for r in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = :s AND tablename = :t"
+        ), {"s": schema, "t": table}))
+
+
+def test_missing_target_is_bulk_loaded(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_boot1"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "qty", "processed_at"],
+        [{"internal_uuid": "", "sku": f"s{i}", "qty": i, "processed_at": ""} for i in range(4)],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema), "indexes": ["sku"]}
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["bootstrap"] == "initial_load"
+    assert (res["inserted"], res["deleted"]) == (4, 0)
+    assert indexes_of(engine, schema, "orders") == ["idx_orders_sku", "orders_pkey"]
+    with engine.connect() as conn:
+        assert conn.execute(text(f"""
+            SELECT column_default FROM information_schema.columns
+            WHERE table_schema = '{schema}' AND table_name = 'orders' AND column_name = 'processed_at'
+        """)).scalar() is None
+
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    assert all(r["internal_uuid"] and r["processed_at"] for r in ws.rows)
+
+    # the next run is a normal merge and sees the bulk-loaded values as unchanged
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert "bootstrap" not in res
+    assert (res["inserted"], res["updated"], res["unchanged"]) == (0, 0, 4)
+
+
+def test_rebuild_swaps_in_a_fresh_table(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_boot2"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "processed_at"],
+        [{"internal_uuid": "", "sku": f"s{i}", "processed_at": ""} for i in range(3)],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema), "indexes": ["sku"]}
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    kept = [r["internal_uuid"] for r in ws.rows[:2]]
+
+    # a row removed and a column added on the sheet, then an explicit rebuild
+    ws.rows = [{**r, "colour": "red"} for r in ws.rows[:2]] + [
+        {"internal_uuid": "", "sku": "new", "colour": "blue", "processed_at": ""},
+    ]
+
+    res = sheets_exporter.sync_mapping(engine, m, rebuild=True)
+    assert res["bootstrap"] == "rebuild"
+    assert (res["inserted"], res["unchanged"], res["deleted"]) == (1, 2, 1)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f'SELECT internal_uuid::text, sku, colour FROM {schema}."orders" ORDER BY sku')).fetchall()
+        archived = conn.execute(text(f"SELECT COUNT(*) FROM {schema}.deleted_rows_log")).scalar()
+        leftovers = conn.execute(text(
+            "SELECT COUNT(*) FROM pg_tables WHERE schemaname = :s AND tablename LIKE 'orders\\_\\_%'"
+        ), {"s": schema}).scalar()
+
+    assert [r[1:] for r in rows] == [("new", "blue"), ("s0", "red"), ("s1", "red")]
+    assert [r[0] for r in rows[1:]] == kept
+    assert archived == 1
+    assert leftovers == 0
+    assert indexes_of(engine, schema, "orders") == ["idx_orders_sku", "orders_pkey"]
+
+
+def test_rebuild_from_an_empty_sheet_leaves_the_target_untouched(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_boot5"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "processed_at"],
+        [{"internal_uuid": "", "sku": f"s{i}", "processed_at": ""} for i in range(3)],
+    )
+    fake_sheets(ws)
+    m = mapping(schema)
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    # a wiped tab (header row only) must not rebuild the target into an empty table
+    ws.rows = []
+    with pytest.raises(RuntimeError, match="zero UUIDs"):
+        sheets_exporter.sync_mapping(engine, m, rebuild=True)
+
+    with engine.connect() as conn:
+        kept = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders"')).scalar()
+        # the failed rebuild rolled back whole, deleted_rows_log included
+        logged = conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.deleted_rows_log"}).scalar()
+        leftovers = conn.execute(text(
+            "SELECT COUNT(*) FROM pg_tables WHERE schemaname = :s AND tablename LIKE 'orders\\_\\_%'"
+        ), {"s": schema}).scalar()
+    assert (kept, logged, leftovers) == (3, None, 0)
+
+
+def test_rebuild_keeps_grants_comments_and_storage_settings(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_boot4"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "processed_at"],
+        [{"internal_uuid": "", "sku": "a", "processed_at": ""}],
+    )
+    fake_sheets(ws)
+    m = mapping(schema)
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {schema}.orders SET (fillfactor = 85)"))
+        conn.execute(text(f"COMMENT ON TABLE {schema}.orders IS 'synced from: the orders tab'"))
+        conn.execute(text(f"COMMENT ON COLUMN {schema}.orders.sku IS 'stock keeping unit'"))
+        conn.execute(text(f"GRANT SELECT, UPDATE ON {schema}.orders TO PUBLIC"))
+
+    res = sheets_exporter.sync_mapping(engine, m, rebuild=True)
+    assert res["bootstrap"] == "rebuild"
+
+    with engine.connect() as conn:
+        kept = conn.execute(text(f"""
+            SELECT c.reloptions, obj_description(c.oid, 'pg_class'),
+                   col_description(c.oid, (SELECT attnum FROM pg_attribute WHERE attrelid = c.oid AND attname = 'sku')),
+                   has_table_privilege('public', c.oid, 'SELECT'),
+                   has_table_privilege('public', c.oid, 'UPDATE'),
+                   has_table_privilege('public', c.oid, 'DELETE')
+            FROM pg_class c WHERE c.oid = '{schema}.orders'::regclass
+        """)).one()
+    assert tuple(kept) == (["fillfactor=85"], "synced from: the orders tab", "stock keeping unit", True, True, False)
+
+
+def test_failed_bootstrap_leaves_no_table(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_boot3"
+    dup = "11111111-1111-1111-1111-111111111111"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "processed_at"],
+        [{"internal_uuid": dup, "sku": "a", "processed_at": ""}, {"internal_uuid": dup, "sku": "b", "processed_at": ""}],
+    )
+    fake_sheets(ws)
+
+    res = sheets_exporter.run_mappings(engine, [mapping(schema)])
+    assert res[0]["status"] == "failed"
+    assert sheets_exporter.get_table_columns(engine, schema, "orders") == []
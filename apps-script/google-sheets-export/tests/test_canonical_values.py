@@ -0,0 +1,87 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import canonical_cell_text, canonical_records
+
+
+def test_canonical_cell_text():
+    assert canonical_cell_text(1) == "1"
+    assert canonical_cell_text(1.0) == "1"
+    assert canonical_cell_text(1000.5) == "1000.5"
+    assert canonical_cell_text(True) == "true"
+    assert canonical_cell_text("") == ""
+    assert canonical_cell_text(None) == ""
+    assert canonical_cell_text("SKU-1") == "SKU-1"
+
+    # date serials only become dates for declared date columns
+    assert canonical_cell_text(45292, is_date=True) == "2024-01-01"
+    assert canonical_cell_text(45292.5, is_date=True) == "2024-01-01 12:00:00"
+    assert canonical_cell_text(45292) == "45292"
+
+
+def test_canonical_records_pads_and_marks_dates():
+    rows = canonical_records(
+        ["Order Date", "Qty", "Paid"],
+        [[45292, 3.0, True], [45293.25]],
+        date_columns=["order_date"],
+    )
+    assert rows == [
+        {"Order Date": "2024-01-01", "Qty": "3", "Paid": "true"},
+        {"Order Date": "2024-01-02 06:00:00", "Qty": "", "Paid": ""},
+    ]
+
+
+def test_format_change_is_not_an_update_in_canonical_mode(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_canonical1"
+    header = ["internal_uuid", "amount", "processed_at"]
+    ws = worksheet(
+        [header, ["", 1000, ""]],
+        formatted=[header, ["", "1000", ""]],
+    )
+    fake_sheets(ws)
+    m = mapping(schema, report_formatting_updates=True)
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    # someone switches the column to "#,##0.00": the formatted read now differs
+    ws.formatted[1][1] = "1,000.00"
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["updated"] == 1
+    assert res["formatting_only_updates"] == 1
+
+    # the canonical read doesn't see the format at all; restore the DB value first
+    with engine.begin() as conn:
+        conn.execute(text(f"""UPDATE {schema}."orders" SET amount = '1000'"""))
+
+    res = sheets_exporter.sync_mapping(engine, {**m, "read_mode": "canonical"})
+    assert ws.render_options == ["UNFORMATTED_VALUE"]
+    assert res["updated"] == 0
+    assert res["unchanged"] == 1
+
+
+def test_formatting_report_is_opt_in(engine, worksheet, fake_sheets, mapping, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_canonical2"
+    ws = worksheet([["internal_uuid", "amount", "processed_at"], ["", "1000", ""]])
+    fake_sheets(ws)
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError("formatting report ran without report_formatting_updates")
+
+    monkeypatch.setattr(sheets_exporter, "count_formatting_only_updates", unexpected)
+    ws.grid[1][1] = "1,000.00"
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+
+    assert res["status"] == "ok" and res["updated"] == 1
+    assert res["formatting_only_updates"] == 0
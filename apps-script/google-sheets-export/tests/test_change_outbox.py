@@ -0,0 +1,120 @@
+import sys
+import os
+import json
+
+import psycopg2
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def test_outbox_records_changes_and_notifies(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_outbox1"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [
+            {"internal_uuid": "", "name": "a", "processed_at": ""},
+            {"internal_uuid": "", "name": "b", "processed_at": ""},
+            {"internal_uuid": "", "name": "c", "processed_at": ""},
+        ],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema), "publish_changes": True}
+
+    # a dedicated connection, outside the engine's pool, as a downstream consumer would use
+    url = engine.url
+    listener = psycopg2.connect(
+        host=url.host, port=url.port, dbname=url.database, user=url.username, password=url.password
+    )
+    try:
+        listener.autocommit = True
+        listener.cursor().execute(f"LISTEN {sheets_exporter.CHANGE_OUTBOX_CHANNEL}")
+
+        stats = sheets_exporter.MappingStats("run-1", m)
+        res = sheets_exporter.sync_mapping(engine, m, stats)
+        sheets_exporter.flush_write_backs([res["write_back"]])
+
+        first = sheets_exporter.read_change_outbox(engine, schema)
+        assert [(c["op"], c["run_id"]) for c in first] == [("insert", "run-1")] * 3
+
+        # one edit, one removal
+        ws.rows[0]["name"] = "a2"
+        edited, removed = ws.rows[0]["internal_uuid"], ws.rows[2]["internal_uuid"]
+        ws.rows = ws.rows[:2]
+        res = sheets_exporter.sync_mapping(engine, m, sheets_exporter.MappingStats("run-2", m))
+        assert res["status"] == "ok"
+
+        changes = sheets_exporter.read_change_outbox(engine, schema, after_id=first[-1]["id"])
+        assert [(c["op"], str(c["internal_uuid"])) for c in changes] == [
+            ("update", edited),
+            ("delete", removed),
+        ]
+
+        listener.poll()
+        payloads = [json.loads(n.payload) for n in listener.notifies]
+    finally:
+        listener.close()
+
+    assert [(p["table"], p["run_id"]) for p in payloads] == [
+        ("orders", "run-1"), ("orders", "run-2"), ("orders", "run-2"),
+    ]
+    # each notification carries the last id its own statement wrote (bootstrap, merge, deletion)
+    assert [p["last_id"] for p in payloads] == [first[-1]["id"], changes[0]["id"], changes[1]["id"]]
+
+
+def test_outbox_is_opt_in_and_pruned(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_outbox2"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [{"internal_uuid": "", "name": "a", "processed_at": ""}],
+    )
+    fake_sheets(ws)
+
+    sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert sheets_exporter.prune_change_outbox(engine, schema) == 0
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.change_outbox"}).scalar() is None
+
+    sheets_exporter.create_change_outbox_table_if_not_exists(engine, schema)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.change_outbox (run_id, table_name, internal_uuid, op, created_at)
+            VALUES ('old', 'orders', gen_random_uuid(), 'insert', CURRENT_TIMESTAMP - interval '30 days'),
+                   ('new', 'orders', gen_random_uuid(), 'insert', CURRENT_TIMESTAMP)
+        """))
+
+    assert sheets_exporter.prune_change_outbox(engine, schema, retention_days=7) == 1
+    assert [c["run_id"] for c in sheets_exporter.read_change_outbox(engine, schema)] == ["new"]
+
+
+def test_chunked_merge_notifies_per_chunk(engine, worksheet, fake_sheets, mapping, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_outbox3"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [{"internal_uuid": "", "name": n, "processed_at": ""} for n in "abc"],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema), "publish_changes": True, "merge_chunk_rows": 2}
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    seen = sheets_exporter.read_change_outbox(engine, schema)[-1]["id"]
+
+    for r in ws.rows:
+        r["name"] += "2"
+    sent = []
+    real_notify = sheets_exporter.notify_changes
+    monkeypatch.setattr(sheets_exporter, "notify_changes", lambda conn, *a: sent.append(a[-1]) or real_notify(conn, *a))
+    res = sheets_exporter.sync_mapping(engine, m)
+
+    assert res["status"] == "ok" and res["updated"] == 3
+    ids = [c["id"] for c in sheets_exporter.read_change_outbox(engine, schema, after_id=seen)]
+    assert sent == [ids[1], ids[2]]
@@ -0,0 +1,119 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def count(engine, schema, table="orders"):
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT COUNT(*) FROM {schema}."{table}"')).scalar()
+
+
+def test_rerun_after_lost_write_back_resumes_without_duplicates(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_checkpoint1"
+    ws = worksheet([
+        ["internal_uuid", "name", "processed_at"],
+        ["", "a", ""],
+        ["", "b", ""],
+    ])
+    fake_sheets(ws)
+
+    # the merge commits, then the process dies before the sheet is written
+    first = sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert sheets_exporter.get_checkpoint(engine, schema, "orders")["phase"] == "deleted"
+
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert res["resumed"] is True
+    assert res["inserted"] == 0
+    assert res["write_back"]["data"] == first["write_back"]["data"]
+    assert count(engine, schema) == 2
+
+    flushed = sheets_exporter.flush_write_backs([res["write_back"]])
+    sheets_exporter.confirm_write_backs(engine, [res["write_back"]], flushed)
+    assert sheets_exporter.get_checkpoint(engine, schema, "orders")["phase"] == "written_back"
+    assert all(row[0] for row in ws.grid[1:])
+
+    # back to normal syncs
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert "resumed" not in res
+    assert (res["inserted"], res["unchanged"]) == (0, 2)
+
+
+def test_rerun_after_partly_landed_write_back_retries_it(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_checkpoint4"
+    ws = worksheet([
+        ["internal_uuid", "name", "processed_at"],
+        ["", "a", ""],
+        ["", "b", ""],
+        ["", "c", ""],
+    ])
+    fake_sheets(ws)
+
+    # the run dies after only the first row's UUID reached the sheet
+    first = sheets_exporter.sync_mapping(engine, mapping(schema))
+    landed = first["write_back"]["data"][0]["values"][0][0]
+    ws.grid[1][0] = landed
+
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert res["resumed"] is True
+    assert res["write_back"]["data"] == first["write_back"]["data"]
+    assert count(engine, schema) == 3
+
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+    assert "resumed" not in res
+    assert (res["inserted"], res["unchanged"], res["deleted"]) == (0, 3, 0)
+    assert ws.grid[1][0] == landed
+
+
+def test_rerun_after_sheet_moved_discards_unsynced_inserts(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_checkpoint2"
+    ws = worksheet([
+        ["internal_uuid", "name", "processed_at"],
+        ["", "a", ""],
+        ["", "b", ""],
+    ])
+    fake_sheets(ws)
+
+    sheets_exporter.sync_mapping(engine, mapping(schema))
+
+    # a row is inserted at the top before the next run: the stored positions are stale
+    ws.grid.insert(1, ["", "z", ""])
+    res = sheets_exporter.sync_mapping(engine, mapping(schema))
+
+    assert res["status"] == "ok"
+    assert res["inserted"] == 3
+    assert count(engine, schema) == 3
+    with engine.connect() as conn:
+        archived = conn.execute(text(f"SELECT COUNT(*) FROM {schema}.deleted_rows_log")).scalar()
+    assert archived == 0
+
+
+def test_failing_mapping_does_not_stop_the_others(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_checkpoint3"
+    broken = worksheet([["name"], ["a"]], title="broken")
+    good = worksheet([["internal_uuid", "name", "processed_at"], ["", "a", ""]], title="good")
+    fake_sheets({"broken": broken, "good": good})
+
+    results = sheets_exporter.run_mappings(engine, [mapping(schema, "broken"), mapping(schema, "good")])
+
+    by_name = {r["name"]: r for r in results}
+    assert by_name["broken"]["status"] == "failed"
+    assert "missing required system columns" in by_name["broken"]["error"]
+    assert by_name["good"]["status"] == "ok"
+    assert good.grid[1][0]
+    assert sheets_exporter.run_exit_code(results) == 1
+    assert sheets_exporter.run_exit_code([by_name["broken"]]) == 2
+    assert sheets_exporter.run_exit_code([by_name["good"]]) == 0
@@ -0,0 +1,121 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def chunked_mapping(engine, mapping, schema):
+    from src.sheets_exporter import create_target_table_if_not_exists
+
+    # an existing target takes the merge path (a missing one would be bulk-loaded)
+    create_target_table_if_not_exists(engine, schema, "orders", ["internal_uuid", "name", "processed_at"])
+    return {**mapping(schema), "merge_chunk_rows": 2}
+
+
+def sheet(worksheet, n):
+    return worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [{"internal_uuid": "", "name": f"r{i}", "processed_at": ""} for i in range(n)],
+    )
+
+
+def test_chunked_merge_matches_single_statement(engine, worksheet, fake_sheets, mapping, capsys):
+    from src import sheets_exporter
+
+    schema = "test_chunk1"
+    ws = sheet(worksheet, 5)
+    fake_sheets(ws)
+    m = chunked_mapping(engine, mapping, schema)
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    out = capsys.readouterr().out
+    assert (res["inserted"], res["updated"], res["unchanged"]) == (5, 0, 0)
+    assert "merge chunk 3: 1 rows (+1 ~0) 5/5" in out
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    assert all(r["internal_uuid"] and r["processed_at"] for r in ws.rows)
+
+    ws.rows[3]["name"] = "r3b"
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert (res["inserted"], res["updated"], res["unchanged"]) == (0, 1, 4)
+
+
+def test_interrupted_chunked_merge_resumes_with_same_uuids(engine, worksheet, fake_sheets, mapping, monkeypatch, capsys):
+    from src import sheets_exporter
+
+    schema = "test_chunk2"
+    ws = sheet(worksheet, 5)
+    fake_sheets(ws)
+    m = chunked_mapping(engine, mapping, schema)
+
+    # the process dies while committing the second chunk
+    real_set_position = sheets_exporter.set_merge_position
+    calls = []
+
+    def dying_set_position(*args):
+        calls.append(args[-1])
+        if len(calls) == 2:
+            raise RuntimeError("connection lost")
+        real_set_position(*args)
+
+    monkeypatch.setattr(sheets_exporter, "set_merge_position", dying_set_position)
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["status"] == "failed"
+    assert not any(r["internal_uuid"] for r in ws.rows)
+
+    with engine.connect() as conn:
+        merged = {str(r[0]) for r in conn.execute(text(f'SELECT internal_uuid FROM {schema}."orders"'))}
+    assert len(merged) == 2
+    checkpoint = sheets_exporter.get_checkpoint(engine, schema, "orders")
+    assert checkpoint["phase"] == "merging" and checkpoint["merge_position"] == calls[0]
+
+    monkeypatch.setattr(sheets_exporter, "set_merge_position", real_set_position)
+    capsys.readouterr()
+    res = sheets_exporter.sync_mapping(engine, m)
+    out = capsys.readouterr().out
+    assert res["status"] == "ok"
+    assert "2/5 rows already merged" in out
+    assert res["inserted"] == 3
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    with engine.connect() as conn:
+        target = {str(r[0]) for r in conn.execute(text(f'SELECT internal_uuid FROM {schema}."orders"'))}
+    # the rows merged before the interruption kept their UUIDs; nothing was duplicated
+    assert merged < target
+    assert target == {r["internal_uuid"] for r in ws.rows}
+
+
+def test_interrupted_merge_discarded_when_rows_move(engine, worksheet, fake_sheets, mapping, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_chunk3"
+    ws = sheet(worksheet, 4)
+    fake_sheets(ws)
+    m = chunked_mapping(engine, mapping, schema)
+
+    real_set_position = sheets_exporter.set_merge_position
+    calls = []
+
+    def dying_set_position(*args):
+        calls.append(args[-1])
+        if len(calls) == 2:
+            raise RuntimeError("connection lost")
+        real_set_position(*args)
+
+    monkeypatch.setattr(sheets_exporter, "set_merge_position", dying_set_position)
+    assert sheets_exporter.sync_mapping(engine, m)["status"] == "failed"
+    monkeypatch.setattr(sheets_exporter, "set_merge_position", real_set_position)
+
+    # first chunk committed; then a row is inserted at the top, so positions no longer match
+    ws.grid.insert(1, ["", "new", ""])
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["status"] == "ok" and res["inserted"] == 5
+    assert sheets_exporter.get_checkpoint(engine, schema, "orders")["phase"] == "deleted"
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    with engine.connect() as conn:
+        n = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders"')).scalar()
+    assert n == 5
@@ -0,0 +1,89 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import column_selector, _column_blocks
+
+
+def run(sheets_exporter, engine, m):
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["status"] == "ok"
+    if res.get("write_back"):
+        sheets_exporter.flush_write_backs([res["write_back"]])
+    return res
+
+
+def test_column_selector():
+    assert column_selector({}) is None
+
+    select = column_selector({"exclude_columns": ["helper_*", "notes"]}, ("internal_uuid",))
+    assert select("qty")
+    assert not select("helper_2")
+    assert not select("notes")
+
+    select = column_selector({"include_columns": ["sku", "qty*"], "exclude_columns": ["qty_calc"]}, ("internal_uuid",))
+    assert select("internal_uuid")
+    assert select("qty_ordered")
+    assert not select("qty_calc")
+    assert not select("price")
+
+    assert _column_blocks([0, 1, 3, 4, 5, 8]) == [(0, 1), (3, 5), (8, 8)]
+
+
+def test_excluded_columns_are_not_read_staged_or_overwritten(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_projection1"
+    ws = worksheet([
+        ["internal_uuid", "sku", "Helper 1", "helper_2", "qty", "processed_at"],
+        ["", "a", "x", "y", "1", ""],
+        ["", "b", "x", "y", "2", ""],
+    ])
+    fake_sheets(ws)
+    m = mapping(schema)
+
+    # synced once without a projection: helper_1 exists in the DB
+    run(sheets_exporter, engine, m)
+    assert ws.batch_reads == []
+
+    ws.grid[1][2] = "changed"
+    ws.grid[1][4] = "10"
+    m = {**m, "exclude_columns": ["helper_*"]}
+    res = run(sheets_exporter, engine, m)
+
+    # only the kept column blocks were requested
+    assert ws.batch_reads == [["A:B", "E:F"]]
+    assert res["updated"] == 1
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT sku, qty, helper_1 FROM {schema}."orders" ORDER BY sku
+        """)).fetchall()
+    # qty followed the sheet, the excluded helper_1 kept its last synced value
+    assert [tuple(r) for r in rows] == [("a", "10", "x"), ("b", "2", "x")]
+    assert "helper_2" in sheets_exporter.get_table_columns(engine, schema, "orders")
+
+
+def test_include_columns_keeps_system_columns(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_projection2"
+    ws = worksheet([
+        ["internal_uuid", "sku", "scratch", "processed_at"],
+        ["", "a", "tmp", ""],
+    ])
+    fake_sheets(ws)
+    m = mapping(schema, include_columns=["sku"])
+
+    run(sheets_exporter, engine, m)
+
+    assert ws.batch_reads == [["A:B", "D:D"]]
+    assert sorted(sheets_exporter.get_table_columns(engine, schema, "orders")) == [
+        "internal_uuid", "processed_at", "sku",
+    ]
+    # UUID + processed_at still reached the sheet
+    assert ws.grid[1][0] and ws.grid[1][3]
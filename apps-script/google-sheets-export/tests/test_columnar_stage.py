@@ -0,0 +1,118 @@
+import pytest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import (
+    grid_columns,
+    columnar_stage,
+    copy_staging,
+    create_staging_table,
+    records_from_values,
+)
+
+
+def test_grid_columns_matches_get_all_records_text():
+    header = ["Order No", "qty"]
+    cells = ["007", "1,000", "1.50", "abc", "", "1e3", "3_2", " 12 ", "nan"]
+    grid = [header] + [[c, c] for c in cells]
+
+    columns, n = grid_columns(grid)
+
+    # what the row path stored: numericised values rendered by Postgres as TEXT
+    expected = [str(r["qty"]) for r in records_from_values(header, grid[1:])]
+    expected[-1] = "NaN"
+    assert n == len(cells)
+    assert list(columns) == ["order_no", "qty"]
+    assert columns["qty"] == expected
+
+
+def test_columnar_stage_orders_existing_first_and_injects_nulls():
+    u1 = "11111111-1111-1111-1111-111111111111"
+    columns = {
+        "internal_uuid": ["", f" {u1} ", ""],
+        "name": ["a", " b ", ""],
+    }
+
+    staged, sheet_uuids, new_uuids = columnar_stage(
+        columns, 3, ["internal_uuid", "name", "gone", "processed_at"],
+        "internal_uuid", "processed_at", "orders", clean=True,
+    )
+
+    assert len(new_uuids) == 2
+    assert sheet_uuids == [new_uuids[0], u1, new_uuids[1]]
+    assert staged["internal_uuid"] == [u1] + new_uuids
+    assert staged["name"] == ["b", "a", None]
+    assert staged["gone"] == [None, None, None]
+    assert "processed_at" not in staged
+
+
+def test_columnar_stage_rejects_invalid_uuids():
+    with pytest.raises(RuntimeError, match=r"sheet rows \[3\]"):
+        columnar_stage(
+            {"internal_uuid": ["", "not-a-uuid"], "name": ["a", "b"]}, 2,
+            ["internal_uuid", "name", "processed_at"], "internal_uuid", "processed_at", "orders",
+        )
+
+
+def test_copy_staging_keeps_nulls_and_awkward_text(engine):
+    schema = "test_columnar1"
+    create_staging_table(engine, schema, "orders_stg", ["internal_uuid", "note", "processed_at"])
+
+    copy_staging(engine, schema, "orders", "orders_stg", {
+        "internal_uuid": [
+            "11111111-1111-1111-1111-111111111111",
+            "22222222-2222-2222-2222-222222222222",
+            "33333333-3333-3333-3333-333333333333",
+            "44444444-4444-4444-4444-444444444444",
+            "55555555-5555-5555-5555-555555555555",
+        ],
+        "note": [None, "", 'comma, "quote"\nnewline', "\\N", "NULL"],
+    })
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT note, processed_at IS NOT NULL FROM {schema}."orders_stg" ORDER BY internal_uuid
+        """)).fetchall()
+
+    # a literal \N or NULL typed into a cell is text, not a NULL marker
+    assert [tuple(r) for r in rows] == [
+        (None, True), ("", True), ('comma, "quote"\nnewline', True), ("\\N", True), ("NULL", True),
+    ]
+
+
+def test_columnar_sync_is_interchangeable_with_row_path(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_columnar2"
+    ws = worksheet([
+        ["internal_uuid", "Order No", "qty", "processed_at"],
+        ["", "007", "1,000", ""],
+        ["", "A-2", "", ""],
+    ])
+    fake_sheets(ws)
+    m = mapping(schema)
+
+    # first sync on the row path, then switch to columnar: nothing should look changed
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    ws.grid.append(["", "A-3", "5", ""])
+    res = sheets_exporter.sync_mapping(engine, {**m, "columnar": True})
+    assert res["status"] == "ok"
+    assert (res["inserted"], res["updated"], res["unchanged"]) == (1, 0, 2)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+    assert all(row[0] and row[3] for row in ws.grid[1:])
+
+    # a removed row is still detected as a deletion
+    del ws.grid[2]
+    res = sheets_exporter.sync_mapping(engine, {**m, "columnar": True})
+    assert (res["updated"], res["deleted"]) == (0, 1)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f'SELECT order_no, qty FROM {schema}."orders" ORDER BY order_no')).fetchall()
+    assert [tuple(r) for r in rows] == [("7", "1000"), ("A-3", "5")]
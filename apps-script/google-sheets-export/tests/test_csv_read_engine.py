@@ -0,0 +1,81 @@
+import sys
+import os
+import csv
+import io
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_parse_csv_stream_survives_any_chunk_split():
+    from src.sheets_exporter import parse_csv_stream
+
+    body = '﻿sku,note,qty\r\nä1,"multi\nline, with comma",3\r\nö2,"say ""hi""\x0bthere",\r\n€3,,007'
+    expected = list(csv.reader(io.StringIO(body.lstrip("﻿"), newline="")))
+    data = body.encode("utf-8")
+
+    for size in (1, 2, 3, 7, len(data)):
+        assert list(parse_csv_stream(_chunks(data, size))) == expected
+
+
+def test_csv_grid_trims_blank_tail():
+    from src.sheets_exporter import csv_grid
+
+    rows = [
+        ["a", "b", "", ""],
+        ["1", "", "", ""],
+        ["", "2", "", ""],
+        ["", "", "", ""],
+        ["", "", "", ""],
+    ]
+    assert csv_grid(iter(rows)) == [["a", "b"], ["1", ""], ["", "2"]]
+    assert csv_grid(iter([])) == []
+
+
+def _export(tmp_path, ws):
+    path = tmp_path / "0.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerows(ws.grid)
+        # formatted-but-empty rows the export keeps
+        w.writerow([""] * len(ws.grid[0]))
+    return f"file://{tmp_path}/{{gid}}.csv"
+
+
+def test_csv_engine_stores_what_get_all_records_would(engine, worksheet, fake_sheets, mapping, monkeypatch, tmp_path):
+    from src import sheets_exporter
+
+    header = ["internal_uuid", "Item Name", "qty", "processed_at"]
+    rows = [
+        {"internal_uuid": "", "Item Name": "a, b", "qty": "007", "processed_at": ""},
+        {"internal_uuid": "", "Item Name": "line\nbreak", "qty": "1.50", "processed_at": ""},
+    ]
+    stored = {}
+    for columnar in (False, True):
+        schema = f"test_csvread_{int(columnar)}"
+        ws = worksheet.from_records(header, [dict(r) for r in rows])
+        ws.id = 0
+        fake_sheets(ws)
+        monkeypatch.setattr(sheets_exporter, "CSV_EXPORT_URL", _export(tmp_path, ws))
+        m = {**mapping(schema), "read_engine": "csv", "columnar": columnar}
+
+        res = sheets_exporter.sync_mapping(engine, m)
+        assert res["status"] == "ok"
+        sheets_exporter.flush_write_backs([res["write_back"]])
+        assert all(r["internal_uuid"] for r in ws.rows)
+
+        with engine.connect() as conn:
+            stored[columnar] = [tuple(r) for r in conn.execute(text(
+                f'SELECT item_name, qty FROM {schema}."orders" ORDER BY item_name'
+            ))]
+
+    # numericised like get_all_records(), quoted commas / line breaks intact
+    assert stored[False] == [("a, b", "7"), ("line\nbreak", "1.5")]
+    assert stored[True] == stored[False]
@@ -0,0 +1,126 @@
+import sys
+import os
+import threading
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def test_meter_reports_wal_and_lock_wait(engine):
+    from src.sheets_exporter import DbCostMeter, MappingSession
+
+    schema = "test_dbcost1"
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {schema}.t (id INT, v TEXT)"))
+
+    meter = DbCostMeter(engine, lock_sample_ms=20)
+    try:
+        with MappingSession(engine, "t") as db:
+            meter.watch(db)
+            meter.start("write")
+            with db.begin() as conn:
+                conn.execute(text(f"INSERT INTO {schema}.t SELECT g, repeat('x', 100) FROM generate_series(1, 2000) g"))
+            db.commit()
+            write = meter.stop()
+
+        # another connection holds the table lock while the mapping's backend waits for it
+        holder = engine.connect()
+        holder.execute(text(f"LOCK TABLE {schema}.t IN ACCESS EXCLUSIVE MODE"))
+        releaser = threading.Timer(0.5, holder.rollback)
+        releaser.start()
+        try:
+            with MappingSession(engine, "t") as db:
+                meter.watch(db)
+                meter.start("blocked")
+                with db.begin() as conn:
+                    conn.execute(text(f"SELECT COUNT(*) FROM {schema}.t"))
+                blocked = meter.stop()
+        finally:
+            releaser.join()
+            holder.close()
+    finally:
+        meter.close()
+
+    assert meter.source in ("pg_stat_statements", "pg_stat_database")
+    assert write["wal_bytes"] > 100 * 2000
+    assert write["lock_wait_s"] == 0
+    assert blocked["lock_wait_s"] >= 0.2
+
+
+def test_sync_runs_records_db_cost(engine, worksheet, fake_sheets, mapping, capsys):
+    from src import sheets_exporter
+
+    schema = "test_dbcost2"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [{"internal_uuid": "", "name": n, "processed_at": ""} for n in "abc"],
+    )
+    fake_sheets(ws)
+
+    results = sheets_exporter.run_mappings(engine, [mapping(schema)], db_cost=True)
+    out = capsys.readouterr().out
+
+    assert results[0]["status"] == "ok"
+    assert "==== db cost per phase" in out
+    assert "<- most WAL" in out
+
+    with engine.connect() as conn:
+        db_cost = conn.execute(text(f"""
+            SELECT db_cost FROM {schema}.sync_runs WHERE mapping_name = 'orders'
+        """)).scalar()
+
+    assert db_cost["bulk_load"]["wal_bytes"] > 0
+    assert set(db_cost["bulk_load"]) == {"wal_bytes", "blks_hit", "blks_read", "rows", "lock_wait_s"}
+
+
+def test_meter_turns_itself_off_on_errors(capsys):
+    from src.sheets_exporter import DbCostMeter, MappingStats
+
+    class BrokenEngine:
+        def connect(self):
+            raise RuntimeError("permission denied for pg_stat_database")
+
+    stats = MappingStats("r1", {"name": "x", "target_table": "x"}, cost_meter=DbCostMeter(BrokenEngine()))
+    stats.phase("read")
+    stats.phase("stage")
+    stats.finish({"status": "ok"})
+
+    assert not stats.cost_meter.enabled
+    assert stats.db_cost == {}
+    assert stats.as_row()["db_cost"] is None
+    assert capsys.readouterr().out.count("database cost report disabled") == 1
+
+
+def test_cost_report_is_opt_in(engine, worksheet, fake_sheets, mapping, capsys):
+    from src import sheets_exporter
+
+    schema = "test_dbcost3"
+    fake_sheets(worksheet([["internal_uuid", "name", "processed_at"], ["", "a", ""]]))
+
+    results = sheets_exporter.run_mappings(engine, [mapping(schema)])
+
+    assert results[0]["status"] == "ok"
+    assert "==== db cost per phase" not in capsys.readouterr().out
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT db_cost FROM {schema}.sync_runs")).scalar() is None
+
+
+def test_sampler_shares_the_meters_connection(engine):
+    from src.sheets_exporter import DbCostMeter, MappingSession
+
+    meter = DbCostMeter(engine, lock_sample_ms=10)
+    try:
+        with MappingSession(engine, "t") as db:
+            before = engine.pool.checkedout()
+            meter.watch(db)
+            meter.start("phase")
+            threading.Event().wait(0.1)
+            assert engine.pool.checkedout() == before + 1
+            assert meter.stop() is not None
+    finally:
+        meter.close()
+    assert meter.enabled
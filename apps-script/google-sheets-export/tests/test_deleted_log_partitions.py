@@ -0,0 +1,116 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import (
+    create_deleted_log_table_if_not_exists,
+    ensure_deleted_log_partition,
+    apply_deleted_log_retention,
+)
+
+
+def _relkind(conn, schema, name):
+    return conn.execute(text("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :s AND c.relname = :t
+    """), {"s": schema, "t": name}).scalar()
+
+
+def test_deleted_log_created_partitioned_with_brin(engine):
+    schema = "test_dlog1"
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+
+    create_deleted_log_table_if_not_exists(engine, schema)
+    # second call is a no-op
+    create_deleted_log_table_if_not_exists(engine, schema)
+
+    with engine.connect() as conn:
+        assert _relkind(conn, schema, "deleted_rows_log") == "p"
+        amname = conn.execute(text("""
+            SELECT am.amname FROM pg_class c
+            JOIN pg_am am ON am.oid = c.relam
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :s AND c.relname = 'idx_deleted_timestamp_brin'
+        """), {"s": schema}).scalar()
+
+    assert amname == "brin"
+
+
+def test_legacy_deleted_log_is_migrated(engine):
+    schema = "test_dlog2"
+
+    # pre-partitioning layout with rows in two different months
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE {schema}.deleted_rows_log (
+                internal_uuid UUID,
+                table_name TEXT,
+                deleted_timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                deleted_row_json JSONB
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX idx_deleted_uuid_table ON {schema}.deleted_rows_log (internal_uuid, table_name)
+        """))
+        conn.execute(text(f"""
+            INSERT INTO {schema}.deleted_rows_log VALUES
+            (gen_random_uuid(), 'orders', '2024-01-15', '{{"a": 1}}'),
+            (gen_random_uuid(), 'orders', '2024-03-02', '{{"a": 2}}'),
+            (gen_random_uuid(), 'items', '2024-03-20', '{{"a": 3}}')
+        """))
+
+    create_deleted_log_table_if_not_exists(engine, schema)
+
+    with engine.connect() as conn:
+        assert _relkind(conn, schema, "deleted_rows_log") == "p"
+        assert _relkind(conn, schema, "deleted_rows_log_legacy") is None
+        assert _relkind(conn, schema, "deleted_rows_log_2024_01") == "r"
+        assert _relkind(conn, schema, "deleted_rows_log_2024_03") == "r"
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {schema}.deleted_rows_log")).scalar()
+
+    assert total == 3
+
+
+def test_retention_rolls_up_and_drops_old_partitions(engine):
+    schema = "test_dlog3"
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+
+    create_deleted_log_table_if_not_exists(engine, schema)
+
+    with engine.begin() as conn:
+        import datetime
+        ensure_deleted_log_partition(conn, schema, datetime.date(2020, 5, 1))
+        conn.execute(text(f"""
+            INSERT INTO {schema}.deleted_rows_log (internal_uuid, table_name, deleted_timestamp, deleted_row_json)
+            VALUES
+            (gen_random_uuid(), 'orders', '2020-05-10', '{{}}'),
+            (gen_random_uuid(), 'orders', '2020-05-11', '{{}}'),
+            (gen_random_uuid(), 'orders', CURRENT_TIMESTAMP, '{{}}')
+        """))
+
+    dropped = apply_deleted_log_retention(engine, schema, retention_months=6)
+
+    assert dropped == ["deleted_rows_log_2020_05"]
+
+    with engine.connect() as conn:
+        remaining = conn.execute(text(f"SELECT COUNT(*) FROM {schema}.deleted_rows_log")).scalar()
+        rollup = conn.execute(text(f"""
+            SELECT table_name, rows_deleted FROM {schema}.deleted_rows_log_rollup
+        """)).fetchall()
+
+    assert remaining == 1
+    assert [tuple(r) for r in rollup] == [("orders", 2)]
+
+
+def test_retention_disabled_is_noop(engine):
+    assert apply_deleted_log_retention(engine, "test_dlog3", retention_months=0) == []
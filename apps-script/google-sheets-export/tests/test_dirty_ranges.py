@@ -0,0 +1,107 @@
+import pytest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+@pytest.fixture
+def tickets(mapping):
+    def make(schema):
+        return mapping(schema, "tickets", sheet_id="sheet-1")
+    return make
+
+
+def test_coalesce_dirty_ranges():
+    from src.sheets_exporter import coalesce_dirty_ranges
+
+    assert coalesce_dirty_ranges([(5, 6), (3, 3), (10, 12)]) == (3, 12)
+    assert coalesce_dirty_ranges([(1, 4)]) == (2, 4)
+    # a whole-tab event or a too-wide burst means a full sync
+    assert coalesce_dirty_ranges([(5, 6), (None, None)]) is None
+    assert coalesce_dirty_ranges([(2, 50)], max_span=10) is None
+    assert coalesce_dirty_ranges([]) is None
+
+
+def test_notifications_are_validated_and_queued(engine, tickets, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_dirty1"
+    monkeypatch.setattr(sheets_exporter, "RECEIVER_TOKEN", "s3cret")
+    mappings = [tickets(schema)]
+    payload = {"spreadsheet_id": "sheet-1", "sheet_name": "tickets", "start_row": 4, "end_row": 5}
+
+    handle = sheets_exporter.handle_notification
+    assert handle(engine, mappings, payload, "wrong")[0] == 401
+    assert handle(engine, mappings, {**payload, "sheet_name": "other"}, "s3cret")[0] == 404
+    assert handle(engine, mappings, {**payload, "end_row": 2}, "s3cret")[0] == 400
+    assert handle(engine, mappings, {**payload, "end_row": None}, "s3cret")[0] == 400
+
+    status, body = handle(engine, mappings, payload, "s3cret")
+    assert status == 202 and body["mapping"] == "tickets"
+    # header edits queue a whole-tab sync
+    handle(engine, mappings, {**payload, "start_row": 1}, "s3cret")
+
+    claimed = sheets_exporter.claim_dirty_ranges(engine, schema, "tickets")
+    assert [(s, e) for _, s, e in claimed] == [(4, 5), (None, None)]
+    # claimed ranges are not handed to a second worker
+    assert sheets_exporter.claim_dirty_ranges(engine, schema, "tickets") == []
+
+    # a failed sync releases the claim, a successful one closes it
+    ids = [i for i, _, _ in claimed]
+    sheets_exporter.finish_dirty_ranges(engine, schema, ids, ok=False)
+    assert len(sheets_exporter.claim_dirty_ranges(engine, schema, "tickets")) == 2
+    sheets_exporter.finish_dirty_ranges(engine, schema, ids, ok=True)
+    with engine.connect() as conn:
+        open_ranges = conn.execute(text(
+            f"SELECT COUNT(*) FROM {schema}.sheet_dirty_ranges WHERE done_at IS NULL"
+        )).scalar()
+    assert open_ranges == 0
+
+
+def test_dirty_range_syncs_only_those_rows(engine, worksheet, fake_sheets, tickets, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_dirty2"
+    ws = worksheet([
+        ["internal_uuid", "title", "processed_at"],
+        ["", "a", ""],
+        ["", "b", ""],
+        ["", "c", ""],
+    ], title="tickets")
+    fake_sheets(ws)
+    monkeypatch.setattr(sheets_exporter, "RECEIVER_TOKEN", "s3cret")
+    mappings = [tickets(schema)]
+
+    results = sheets_exporter.run_mappings(engine, mappings)
+    assert results[0]["status"] == "ok"
+    assert ws.full_reads == 1
+
+    # row 3 is edited and a row 5 is added; the trigger reports both
+    ws.grid[2][1] = "b2"
+    ws.grid.append(["", "d", ""])
+    ws.writes.clear()
+    for start, end in ((3, 3), (5, 5)):
+        payload = {"spreadsheet_id": "sheet-1", "sheet_name": "tickets", "start_row": start, "end_row": end}
+        assert sheets_exporter.handle_notification(engine, mappings, payload, "s3cret")[0] == 202
+
+    results = sheets_exporter.run_dirty_ranges(engine, mappings)
+    assert results[0]["status"] == "ok"
+    assert ws.full_reads == 1
+    assert [r[1] for r in ws.batch_reads] == ["3:5"]
+    assert ws.writes == ["A3:A5", "C3:C5"]
+    assert ws.grid[4][0]
+
+    with engine.connect() as conn:
+        titles = conn.execute(text(f'SELECT title FROM {schema}."tickets" ORDER BY title')).fetchall()
+        open_ranges = conn.execute(text(
+            f"SELECT COUNT(*) FROM {schema}.sheet_dirty_ranges WHERE done_at IS NULL"
+        )).scalar()
+    # rows outside the range were neither re-read nor treated as deleted
+    assert [r[0] for r in titles] == ["a", "b2", "c", "d"]
+    assert open_ranges == 0
+    assert sheets_exporter.run_dirty_ranges(engine, mappings) == []
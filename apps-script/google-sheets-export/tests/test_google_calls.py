@@ -0,0 +1,163 @@
+import sys
+import os
+import time
+
+import pytest
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from src import sheets_exporter
+from src.sheets_exporter import LatencyHistogram, google_call, is_transient_google_error
+
+
+@pytest.fixture(autouse=True)
+def fresh_policy(monkeypatch):
+    monkeypatch.setattr(sheets_exporter, "GOOGLE_LATENCY", {})
+    monkeypatch.setattr(sheets_exporter, "_RETRY_BUDGET", {"left": 10})
+    monkeypatch.setattr("time.sleep", lambda s: None)
+
+
+def api_error(status, body=None):
+    import gspread
+    import requests
+
+    response = requests.Response()
+    response.status_code = status
+    response._content = (body or f'{{"error": {{"code": {status}, "message": "backend says {status}"}}}}').encode()
+    return gspread.exceptions.APIError(response)
+
+
+def flaky(errors, value="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return value
+
+    return fn, calls
+
+
+def test_transient_errors_are_retried_others_are_not():
+    import requests
+
+    assert is_transient_google_error(requests.exceptions.ReadTimeout())
+    assert is_transient_google_error(api_error(503))
+    assert is_transient_google_error(api_error(429))
+    assert not is_transient_google_error(api_error(403))
+    # a proxy's HTML error page: no JSON error code, the response status decides
+    assert is_transient_google_error(api_error(502, body="<html>Bad Gateway</html>"))
+    # status-like numbers in a message are not a status
+    assert not is_transient_google_error(RuntimeError("row 503 has 429 columns"))
+    assert not is_transient_google_error(api_error(400, body='{"error": {"code": 400, "message": "range A1:B500 invalid"}}'))
+
+    fn, calls = flaky([api_error(500), requests.exceptions.ConnectionError()])
+    assert google_call("read", "orders", fn) == "ok"
+    assert len(calls) == 3
+    assert sheets_exporter._RETRY_BUDGET["left"] == 8
+
+    fn, calls = flaky([api_error(404)])
+    with pytest.raises(sheets_exporter.gspread.exceptions.APIError):
+        google_call("read", "orders", fn)
+    assert len(calls) == 1
+
+
+def test_retry_budget_is_shared_by_the_run():
+    sheets_exporter.reset_google_retry_budget(1)
+    fn, calls = flaky([api_error(429)] * 3)
+
+    with pytest.raises(sheets_exporter.gspread.exceptions.APIError):
+        google_call("read", "orders", fn)
+    # one retry from the budget, then the error surfaces
+    assert len(calls) == 2
+    assert sheets_exporter._RETRY_BUDGET["left"] == 0
+
+
+def test_deadline_stops_further_calls(monkeypatch):
+    monkeypatch.setattr(sheets_exporter, "_MAPPING_DEADLINE", time.monotonic() - 1)
+    with pytest.raises(sheets_exporter.DeadlineExceeded):
+        google_call("read", "orders", lambda: "ok")
+
+
+def test_slow_read_is_hedged(monkeypatch):
+    monkeypatch.setattr(sheets_exporter, "GOOGLE_HEDGE_PERCENTILE", 0.95)
+    monkeypatch.setattr(sheets_exporter, "GOOGLE_HEDGE_MIN_SAMPLES", 5)
+    hist = sheets_exporter.GOOGLE_LATENCY.setdefault("read", LatencyHistogram())
+    for _ in range(10):
+        hist.record(0.01)
+
+    import threading
+    slow = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            slow.wait(5)  # the first request hangs
+            return "late"
+        return "hedged"
+
+    started = time.monotonic()
+    try:
+        assert google_call("read", "orders", fn, hedge=True) == "hedged"
+    finally:
+        slow.set()
+    assert time.monotonic() - started < 2
+    assert len(calls) == 2
+
+    # without hedge=True (writes) the slow call is simply waited for
+    calls.clear()
+    slow.clear()
+    threading.Timer(0.2, slow.set).start()
+    assert google_call("read", "orders", fn) == "late"
+    assert len(calls) == 1
+
+
+def test_hedged_call_runs_in_its_callers_context(monkeypatch):
+    monkeypatch.setattr(sheets_exporter, "GOOGLE_HEDGE_PERCENTILE", 0.95)
+    monkeypatch.setattr(sheets_exporter, "GOOGLE_HEDGE_MIN_SAMPLES", 5)
+    hist = sheets_exporter.GOOGLE_LATENCY.setdefault("read", LatencyHistogram())
+    for _ in range(10):
+        hist.record(0.01)
+
+    # the main thread is syncing a mapping that is past its deadline
+    monkeypatch.setattr(sheets_exporter, "_ACTIVE_STATS", "mapping stats")
+    monkeypatch.setattr(sheets_exporter, "_MAPPING_DEADLINE", time.monotonic() - 1)
+
+    import threading
+    slow = threading.Event()
+    seen = []
+
+    def fn():
+        seen.append((sheets_exporter._current_stats(), sheets_exporter._current_deadline()))
+        if len(seen) == 1:
+            slow.wait(5)  # the first request hangs, so a hedge is sent
+        return "ok"
+
+    result = []
+
+    def drainer():
+        sheets_exporter._THREAD_CONTEXT.stats = "drainer stats"
+        result.append(google_call("read", "write-back", fn, hedge=True))
+
+    t = threading.Thread(target=drainer)
+    t.start()
+    t.join(5)
+    slow.set()
+    assert result == ["ok"]
+    assert seen == [("drainer stats", None)] * 2
+
+
+def test_latency_histogram_percentiles():
+    hist = LatencyHistogram()
+    for v in (0.05, 0.2, 0.3, 0.4, 3.0):
+        hist.record(v)
+
+    d = hist.as_dict()
+    assert d["count"] == 5
+    assert d["p50"] == 0.3
+    assert d["max"] == 3.0
+    assert d["buckets"] == {"<=0.1s": 1, "<=0.25s": 1, "<=0.5s": 2, "<=5s": 1}
@@ -0,0 +1,101 @@
+import sys
+import os
+import datetime
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from src.sheets_exporter import MappingLease, is_mapping_due, mark_mapping_synced
+
+
+def test_lease_is_exclusive_until_released(engine):
+    a = MappingLease(engine, "test_lease", "orders")
+    b = MappingLease(engine, "test_lease", "orders")
+    other = MappingLease(engine, "test_lease", "items")
+
+    assert a.acquire() is True
+    assert b.acquire() is False
+    assert other.acquire() is True
+
+    a.release()
+    assert b.acquire() is True
+
+    b.release()
+    other.release()
+
+
+def test_run_mappings_skips_leased_mapping(engine, monkeypatch):
+    from src import sheets_exporter
+
+    def no_google():
+        raise AssertionError("a leased mapping must not be read")
+
+    monkeypatch.setattr(sheets_exporter, "get_gspread_client", no_google)
+
+    m = {"name": "orders", "sheet_id": "x", "sheet_name": "orders",
+         "schema": "test_lease", "target_table": "orders"}
+
+    held = MappingLease(engine, "test_lease", "orders")
+    assert held.acquire()
+    try:
+        results = sheets_exporter.run_mappings(engine, [m])
+    finally:
+        held.release()
+
+    assert [r["status"] for r in results] == ["leased"]
+
+
+def test_is_mapping_due_respects_interval(engine):
+    m = {"name": "orders", "schema": "test_lease_due", "target_table": "orders", "interval_minutes": 60}
+
+    assert is_mapping_due(engine, {**m, "interval_minutes": 0}) is True
+    assert is_mapping_due(engine, m) is True   # never synced
+
+    mark_mapping_synced(engine, "test_lease_due", "orders", "orders")
+    assert is_mapping_due(engine, m) is False
+
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=61)
+    assert is_mapping_due(engine, m, now=later) is True
+
+
+def test_bookkeeping_reads_do_not_wait_on_another_mappings_transaction(engine):
+    from sqlalchemy import create_engine
+    from src.sheets_exporter import MappingSession
+
+    schema = "test_lease_locks"
+    mark_mapping_synced(engine, schema, "orders", "orders")
+    impatient = create_engine(engine.url, connect_args={"options": "-c lock_timeout=2000"})
+
+    # another worker's mapping is mid-transaction with sync_state written: the due check
+    # must not need a lock that conflicts with it
+    with MappingSession(engine, "items") as other:
+        mark_mapping_synced(other, schema, "items", "items")
+        m = {"name": "orders", "schema": schema, "target_table": "orders", "interval_minutes": 60}
+        assert is_mapping_due(impatient, m) is False
+
+    impatient.dispose()
+
+
+def test_run_holds_all_leases_on_one_connection_outside_the_pool(engine, worksheet, fake_sheets, mapping):
+    from sqlalchemy import create_engine
+    from src import sheets_exporter
+
+    # far more mappings than the pool has connections; a pooled connection per lease
+    # would time out waiting for the pool from the third mapping on
+    small = create_engine(engine.url, pool_size=2, max_overflow=0, pool_timeout=2)
+    names = [f"tab{i}" for i in range(8)]
+    fake_sheets({
+        n: worksheet([["internal_uuid", "name", "processed_at"], ["", n, ""]], title=n)
+        for n in names
+    })
+
+    results = sheets_exporter.run_mappings(small, [mapping("test_lease_pool", n) for n in names])
+
+    assert [r["status"] for r in results] == ["ok"] * len(names)
+    assert small.pool.checkedout() == 0
+    # every lease was released with the run
+    lease = MappingLease(engine, "test_lease_pool", "tab0")
+    assert lease.acquire()
+    lease.release()
+    small.dispose()
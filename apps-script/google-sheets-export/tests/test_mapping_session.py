@@ -0,0 +1,74 @@
+import pytest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import event, text
+from src.sheets_exporter import (
+    MappingSession,
+    create_staging_table,
+    load_staging,
+    get_table_columns,
+)
+
+
+def test_session_uses_one_checkout_for_all_helpers(engine):
+    schema = "test_session1"
+    checkouts = []
+
+    def on_checkout(*args):
+        checkouts.append(1)
+
+    event.listen(engine, "checkout", on_checkout)
+    try:
+        with MappingSession(engine, "orders") as db:
+            create_staging_table(db, schema, "orders_stg", ["internal_uuid", "name", "processed_at"])
+            load_staging(db, schema, "orders", "orders_stg", [
+                {"internal_uuid": "11111111-1111-1111-1111-111111111111", "name": "a"},
+            ])
+            cols = get_table_columns(db, schema, "orders_stg")
+    finally:
+        event.remove(engine, "checkout", on_checkout)
+
+    assert len(checkouts) == 1
+    assert cols == ["internal_uuid", "name", "processed_at"]
+
+    # leaving the block committed the work
+    with engine.connect() as conn:
+        n = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders_stg"')).scalar()
+    assert n == 1
+
+
+def test_failed_phase_rolls_back_to_savepoint(engine):
+    schema = "test_session2"
+
+    with MappingSession(engine, "orders") as db:
+        create_staging_table(db, schema, "orders_stg", ["internal_uuid", "processed_at"])
+
+        with pytest.raises(Exception):
+            with db.begin() as conn:
+                conn.execute(text(f'INSERT INTO {schema}."orders_stg" (internal_uuid) VALUES (gen_random_uuid())'))
+                conn.execute(text("SELECT 1/0"))
+
+        # the session is still usable after the failed phase
+        cols = get_table_columns(db, schema, "orders_stg")
+
+    assert cols == ["internal_uuid", "processed_at"]
+
+    with engine.connect() as conn:
+        n = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders_stg"')).scalar()
+    assert n == 0
+
+
+def test_error_in_session_rolls_back_uncommitted_work(engine):
+    schema = "test_session3"
+
+    with pytest.raises(RuntimeError):
+        with MappingSession(engine, "orders") as db:
+            create_staging_table(db, schema, "orders_stg", ["internal_uuid", "processed_at"])
+            raise RuntimeError("guard failed")
+
+    assert get_table_columns(engine, schema, "orders_stg") == []
@@ -0,0 +1,101 @@
+import sys
+import os
+import json
+import datetime
+
+import pytest
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_snapshot_streams_row_groups_and_versions(engine, tmp_path):
+    from src.sheets_exporter import export_parquet_snapshot, load_parquet_manifest
+
+    schema = "test_parquet1"
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f'DROP TABLE IF EXISTS {schema}."sales"'))
+        conn.execute(text(f"""
+            CREATE TABLE {schema}."sales" (
+                internal_uuid UUID PRIMARY KEY, sku TEXT, processed_at TIMESTAMPTZ,
+                paid BOOLEAN, qty INTEGER, boxes SMALLINT, views BIGINT, price DOUBLE PRECISION,
+                ratio REAL, amount NUMERIC, sold_on DATE, seen_at TIMESTAMP
+            )
+        """))
+        conn.execute(text(f"""
+            INSERT INTO {schema}."sales"
+            SELECT gen_random_uuid(), 'sku' || g, CURRENT_TIMESTAMP,
+                   g % 2 = 0, g, g, g * 10000000000, g + 0.5, g / 4.0, g * 1.25,
+                   DATE '2024-01-01' + g, TIMESTAMP '2024-01-01 12:00' + g * interval '1 hour'
+            FROM generate_series(1, 24) g
+        """))
+        conn.execute(text(f"""INSERT INTO {schema}."sales" (internal_uuid, sku) VALUES (gen_random_uuid(), 'blank')"""))
+
+    entry = export_parquet_snapshot(engine, schema, "sales", str(tmp_path), "run-1", row_group_rows=10)
+    assert (entry["version"], entry["rows"], entry["row_groups"]) == (1, 25, 3)
+
+    path = tmp_path / schema / "sales" / entry["file"]
+    meta = pq.ParquetFile(path).metadata
+    assert meta.num_row_groups == 3
+    table = pq.read_table(path)
+    assert table.schema.field("processed_at").type.tz == "UTC"
+    assert sorted(table.column("sku").to_pylist())[:3] == ["blank", "sku1", "sku10"]
+
+    # every mapped Postgres type lands as its Arrow type; NULLs stay null
+    types = {f.name: str(f.type) for f in table.schema}
+    assert types == {
+        "internal_uuid": "string", "sku": "string", "processed_at": "timestamp[us, tz=UTC]",
+        "paid": "bool", "qty": "int32", "boxes": "int16", "views": "int64", "price": "double",
+        "ratio": "float", "amount": "string", "sold_on": "date32[day]", "seen_at": "timestamp[us]",
+    }
+    rows = {r["sku"]: r for r in table.to_pylist()}
+    row = rows["sku2"]
+    assert (row["paid"], row["qty"], row["boxes"], row["views"]) == (True, 2, 2, 20000000000)
+    assert (row["price"], row["ratio"], row["amount"]) == (2.5, 0.5, "2.50")
+    assert row["sold_on"] == datetime.date(2024, 1, 3)
+    assert row["seen_at"] == datetime.datetime(2024, 1, 1, 14, 0)
+    assert rows["sku1"]["paid"] is False
+    assert all(v is None for k, v in rows["blank"].items() if k not in ("internal_uuid", "sku"))
+
+    # only the newest keep_versions files survive
+    for _ in range(2):
+        export_parquet_snapshot(engine, schema, "sales", str(tmp_path), keep_versions=2)
+    manifest = load_parquet_manifest(str(tmp_path), schema, "sales")
+    assert [v["version"] for v in manifest["versions"]] == [2, 3]
+    assert manifest["latest"] == "v000003.parquet"
+    assert sorted(os.listdir(tmp_path / schema / "sales")) == [
+        "manifest.json", "v000002.parquet", "v000003.parquet",
+    ]
+
+
+def test_only_changed_tables_are_exported(engine, worksheet, fake_sheets, mapping, monkeypatch, tmp_path):
+    from src import sheets_exporter
+
+    schema = "test_parquet2"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [{"internal_uuid": "", "name": "a", "processed_at": ""}],
+    )
+    fake_sheets(ws)
+    monkeypatch.setattr(sheets_exporter, "PARQUET_DIR", str(tmp_path))
+    m = {**mapping(schema), "parquet_snapshot": True}
+
+    first = sheets_exporter.run_mappings(engine, [m])
+    assert first[0]["parquet"]["version"] == 1
+
+    second = sheets_exporter.run_mappings(engine, [m])
+    assert second[0]["parquet"] is None
+
+    ws.rows[0]["name"] = "a2"
+    third = sheets_exporter.run_mappings(engine, [m])
+    assert third[0]["parquet"]["version"] == 2
+
+    with open(tmp_path / schema / "orders" / "manifest.json") as f:
+        assert len(json.load(f)["versions"]) == 2
+    assert pq.read_table(tmp_path / schema / "orders" / "v000002.parquet").column("name").to_pylist() == ["a2"]
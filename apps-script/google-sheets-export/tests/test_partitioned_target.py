@@ -0,0 +1,208 @@
+import pytest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+@pytest.fixture
+def sales(mapping):
+    def make(schema, **extra):
+        return mapping(schema, "sales", **{"partition_by": {"column": "sold_on", "interval": "month"}, **extra})
+    return make
+
+
+def run(sheets_exporter, engine, m, **kwargs):
+    res = sheets_exporter.sync_mapping(engine, m, **kwargs)
+    if res.get("write_back"):
+        flushed = sheets_exporter.flush_write_backs([res["write_back"]])
+        sheets_exporter.confirm_write_backs(engine, [res["write_back"]], flushed)
+    return res
+
+
+def partitions(engine, schema):
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f"""
+            SELECT c.relname, (SELECT COUNT(*) FROM {schema}.sales t WHERE t.tableoid = c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = '{schema}.sales'::regclass
+        """)).fetchall())
+
+
+def test_partitioned_target_routes_moves_and_archives(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_partition1"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "a", "2024-01-15", ""],
+        ["", "b", "2024-01-20", ""],
+        ["", "c", "2024-02-03", ""],
+        ["", "d", "", ""],
+    ], title="sales")
+    fake_sheets(ws)
+
+    res = run(sheets_exporter, engine, sales(schema))
+    assert res["status"] == "ok" and res["bootstrap"] == "initial_load"
+    assert sheets_exporter.is_partitioned_table(engine, schema, "sales")
+    assert partitions(engine, schema) == {"sales_default": 1, "sales_p2024_01": 2, "sales_p2024_02": 1}
+
+    # "a" moves to March, a new April row, "c" is deleted; the blank-date row stays put
+    moved_uuid = ws.grid[1][0]
+    ws.grid[1][2] = "2024-03-01"
+    ws.grid.append(["", "e", "2024-04-09", ""])
+    del ws.grid[3]
+    res = run(sheets_exporter, engine, sales(schema))
+
+    assert res["status"] == "ok"
+    assert (res["inserted"], res["updated"], res["deleted"]) == (1, 1, 1)
+    assert partitions(engine, schema) == {
+        "sales_default": 1, "sales_p2024_01": 1, "sales_p2024_02": 0, "sales_p2024_03": 1, "sales_p2024_04": 1,
+    }
+    with engine.connect() as conn:
+        sold_on = conn.execute(text(f"""
+            SELECT sold_on::text FROM {schema}.sales WHERE internal_uuid = :u
+        """), {"u": moved_uuid}).scalars().all()
+        archived = conn.execute(text(f"""
+            SELECT deleted_row_json->>'sold_on' FROM {schema}.deleted_rows_log WHERE table_name = 'sales'
+        """)).scalars().all()
+    assert sold_on == ["2024-03-01"]
+    assert archived == ["2024-02-03"]
+
+    # chunked merges route the same way
+    ws.grid[1][2] = "2024-01-31"
+    res = run(sheets_exporter, engine, sales(schema, merge_chunk_rows=1))
+    assert res["status"] == "ok"
+    assert (res["inserted"], res["updated"]) == (0, 1)
+    assert partitions(engine, schema)["sales_p2024_01"] == 2
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.sales")).scalar() == 4
+
+
+def test_stray_copy_in_another_partition_is_replaced(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_partition2"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "a", "2024-01-15", ""],
+        ["", "b", "2024-02-15", ""],
+    ], title="sales")
+    fake_sheets(ws)
+    run(sheets_exporter, engine, sales(schema))
+
+    # a copy of "a" written outside the exporter, in another month
+    a_uuid = ws.grid[1][0]
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {schema}.sales (internal_uuid, sku, sold_on)
+            VALUES (:u, 'a-copy', '2024-02-01')
+        """), {"u": a_uuid})
+
+    res = run(sheets_exporter, engine, sales(schema))
+
+    assert res["status"] == "ok"
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT sku, sold_on::text FROM {schema}.sales WHERE internal_uuid = :u
+        """), {"u": a_uuid}).fetchall()
+    assert [tuple(r) for r in rows] == [("a", "2024-01-15")]
+
+
+def test_plain_target_needs_rebuild_to_partition(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_partition3"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "a", "2024-01-15", ""],
+        ["", "b", "2023-06-15", ""],
+    ], title="sales")
+    fake_sheets(ws)
+    plain = {k: v for k, v in sales(schema).items() if k != "partition_by"}
+    run(sheets_exporter, engine, plain)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {schema}.sales SET (fillfactor = 90)"))
+
+    try:
+        run(sheets_exporter, engine, sales(schema))
+        raise AssertionError("expected the partition_by mismatch to be rejected")
+    except RuntimeError as e:
+        assert "--rebuild sales" in str(e)
+
+    res = run(sheets_exporter, engine, sales(schema, partition_by={"column": "sold_on", "interval": "year"}), rebuild=True)
+
+    assert res["status"] == "ok" and res["bootstrap"] == "rebuild"
+    assert partitions(engine, schema) == {"sales_default": 0, "sales_p2023": 1, "sales_p2024": 1}
+    with engine.connect() as conn:
+        index = conn.execute(text(f"SELECT to_regclass('{schema}.sales_uuid_key')")).scalar()
+        options = conn.execute(text(f"""
+            SELECT DISTINCT c.reloptions::text
+            FROM pg_partition_tree('{schema}.sales'::regclass) t JOIN pg_class c ON c.oid = t.relid
+            WHERE t.isleaf
+        """)).scalars().all()
+    assert index is not None
+    # the plain table's storage settings moved onto every partition
+    assert options == ["{fillfactor=90}"]
+
+
+def test_storage_settings_go_on_each_partition(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_partition4"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "a", "2024-01-15", ""],
+        ["", "b", "2024-02-15", ""],
+    ], title="sales")
+    fake_sheets(ws)
+    m = sales(schema, maintenance={"storage": {"fillfactor": 80}}, indexes=["sku"])
+    res = run(sheets_exporter, engine, m)
+
+    report = sheets_exporter.run_table_maintenance(engine, m, res)
+
+    assert report["churn"] == 2
+    with engine.connect() as conn:
+        options = dict(conn.execute(text(f"""
+            SELECT c.relname, c.reloptions
+            FROM pg_partition_tree('{schema}.sales'::regclass) t JOIN pg_class c ON c.oid = t.relid
+        """)).fetchall())
+        index = conn.execute(text(f"SELECT to_regclass('{schema}.idx_sales_sku')")).scalar()
+    assert options == {
+        "sales": None,
+        "sales_default": ["fillfactor=80"],
+        "sales_p2024_01": ["fillfactor=80"],
+        "sales_p2024_02": ["fillfactor=80"],
+    }
+    assert index is not None
+
+    # settled: nothing left to change
+    assert sheets_exporter.apply_table_storage_settings(engine, schema, "sales", {"fillfactor": 80}) == {}
+
+
+def test_unparsable_dates_are_reported_before_staging(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_partition5"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "a", "2024-01-15", ""],
+        ["", "b", "", ""],
+    ], title="sales")
+    fake_sheets(ws)
+    run(sheets_exporter, engine, sales(schema))
+
+    ws.grid[2][2] = "TBD"
+    ws.grid.append(["", "c", "2024-02-30", ""])
+    with pytest.raises(RuntimeError) as e:
+        run(sheets_exporter, engine, sales(schema))
+
+    assert "row 3: 'TBD'" in str(e.value)
+    assert "row 4: '2024-02-30'" in str(e.value)
+    assert "row 2" not in str(e.value)
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.sales")).scalar() == 2
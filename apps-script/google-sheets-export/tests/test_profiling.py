@@ -0,0 +1,60 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from src.sheets_exporter import MappingStats, PhaseProfiler, normalize_columns, stop_profiling
+
+
+def busy_transform_stub(seconds=0.05):
+    # pure-Python loop: its own (internal) time tops the phase's stats
+    import time
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+    return n
+
+
+def test_profiler_reports_per_phase(tmp_path):
+    profiler = PhaseProfiler(str(tmp_path / "run"), top_n=5)
+    stats = MappingStats("run-1", {"name": "orders/main"}, profiler)
+
+    try:
+        stats.phase("transform")
+        names = [normalize_columns(f"Column {i}") for i in range(2000)]
+        busy_transform_stub()
+        stats.phase("load")
+        keep = [dict(name=n, payload=n * 20) for n in names]
+        stats.finish({})
+        path = profiler.write(stats.name)
+    finally:
+        stop_profiling()
+
+    assert len(keep) == 2000
+    assert set(stats.phase_seconds) == {"transform", "load"}
+    assert os.path.basename(path) == "orders_main.txt"
+    assert sorted(os.listdir(tmp_path / "run")) == [
+        "orders_main.load.prof", "orders_main.transform.prof", "orders_main.txt",
+    ]
+
+    report = open(path).read()
+    assert "==== transform: peak" in report
+    assert "Ordered by: internal time" in report
+    # the stub lands in its own phase's section, not in the next one
+    sections = {part.split(":", 1)[0]: part for part in report.split("==== ")[1:]}
+    assert "busy_transform_stub" in sections["transform"]
+    assert "busy_transform_stub" not in sections["load"]
+    assert profiler.phases["load"]["peak"] > 2000 * 200  # ~10 chars * 20 per payload
+    hot = profiler.hot_functions(1000)
+    assert hot == sorted(hot, reverse=True)
+    assert any("normalize_columns" in func for _, func in hot)
+
+
+def test_stats_without_profiler_has_no_profile():
+    stats = MappingStats("run-1", {"name": "orders"})
+    stats.phase("read")
+    stats.finish({})
+    assert stats.profiler is None
@@ -0,0 +1,107 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def sync(sheets_exporter, engine, m):
+    res = sheets_exporter.sync_mapping(engine, m)
+    assert res["status"] == "ok"
+    if res.get("write_back"):
+        sheets_exporter.flush_write_backs([res["write_back"]])
+    return res
+
+
+def test_cache_reloads_only_when_a_sync_changes_the_table(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+    from src.reference_cache import ReferenceCache
+
+    schema = "test_refcache1"
+    ws = worksheet.from_records(
+        ["internal_uuid", "sku", "price", "processed_at"],
+        [
+            {"internal_uuid": "", "sku": "A-1", "price": "1.50", "processed_at": ""},
+            {"internal_uuid": "", "sku": "B-2", "price": "2.00", "processed_at": ""},
+            {"internal_uuid": "", "sku": "C-3", "price": "3.25", "processed_at": ""},
+        ],
+        title="sku_pricing",
+    )
+    fake_sheets(ws)
+    m = mapping(schema, "sku_pricing")
+
+    sync(sheets_exporter, engine, m)
+    first = sheets_exporter.get_table_change(engine, schema, "sku_pricing")
+    assert first["change_seq"] >= 1
+
+    cache = ReferenceCache(engine, schema, "sku_pricing", lookup_columns=["sku"], check_interval=0)
+    row = cache.lookup_one("sku", "B-2")
+    assert row.price == "2.0"   # numericised on read, as gspread does
+    assert cache.get(row.internal_uuid) == row
+    assert len(cache) == 3
+    assert cache.loads == 1
+
+    # a run that changes nothing leaves the marker (and so the cache) alone
+    res = sync(sheets_exporter, engine, m)
+    assert res["inserted"] == res["updated"] == res["deleted"] == 0
+    assert sheets_exporter.get_table_change(engine, schema, "sku_pricing")["change_seq"] == first["change_seq"]
+    assert cache.lookup_one("sku", "A-1").price == "1.5"
+    assert cache.loads == 1
+    assert cache.checks >= 2
+
+    # an edit and a removed row move it; the next lookup reloads
+    gone = ws.rows[2]["internal_uuid"]
+    ws.rows[0]["price"] = "1.75"
+    ws.rows = ws.rows[:2]
+    sync(sheets_exporter, engine, m)
+
+    assert cache.lookup_one("sku", "A-1").price == "1.75"
+    assert cache.get(gone) is None
+    assert cache.lookup("sku", "C-3") == []
+    assert cache.loads == 2
+    assert cache.marker == sheets_exporter.get_table_change(engine, schema, "sku_pricing")["change_seq"]
+
+
+def test_cache_without_marker_table(engine):
+    from src.reference_cache import ReferenceCache, get_reference_cache
+
+    schema = "test_refcache2"
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE {schema}.ingredients (
+                internal_uuid UUID, name TEXT, unit TEXT, "class" TEXT
+            )
+        """))
+        conn.execute(text(f"""
+            INSERT INTO {schema}.ingredients VALUES
+            (gen_random_uuid(), 'flour', 'kg', 'dry'),
+            (gen_random_uuid(), 'sugar', 'kg', 'dry'),
+            (gen_random_uuid(), 'milk', 'l', 'wet')
+        """))
+
+    cache = ReferenceCache(engine, schema, "ingredients", lookup_columns=["unit"],
+                           columns=["name"], check_interval=0)
+
+    # non-unique lookup columns keep every row; only the requested columns are loaded
+    assert sorted(r.name for r in cache.lookup("unit", "kg")) == ["flour", "sugar"]
+    assert cache.row_type._fields == ("internal_uuid", "unit", "name")
+    assert cache.marker is None
+
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE {schema}.ingredients SET unit = 'ml' WHERE name = 'milk'"))
+
+    # no marker to compare against: served from memory until forced
+    assert cache.lookup("unit", "ml") == []
+    assert cache.loads == 1
+    assert cache.refresh(force=True)
+    assert cache.lookup_one("unit", "ml").name == "milk"
+
+    # keyword column names are renamed by position
+    full = get_reference_cache(engine, schema, "ingredients")
+    assert len(full) == 3
+    assert full.row_type._fields[3] == "_3"
+    assert get_reference_cache(engine, schema, "ingredients") is full
@@ -0,0 +1,178 @@
+import pytest
+import sys
+import os
+import datetime
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+@pytest.fixture
+def sales(mapping):
+    def make(schema):
+        return mapping(schema, "sales", archive={"column": "sold_on", "older_than_months": 6})
+    return make
+
+
+def test_archived_rows_leave_the_sheet_but_not_the_table(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_archive1"
+    recent = datetime.date.today().isoformat()
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "old1", "2020-01-05", ""],
+        ["", "new1", recent, ""],
+        ["", "old2", "2020-02-05", ""],
+        ["", "old3", "2020-03-05", ""],
+        ["", "new2", recent, ""],
+    ], title="sales")
+    batch_updates = fake_sheets(ws).spreadsheet.batch_updates
+
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["status"] == "ok"
+    assert results[0]["archive"] == {"archived": 3, "ranges": 2}
+    # one request, bottom-most range first
+    assert len(batch_updates) == 1
+    starts = [r["deleteDimension"]["range"]["startIndex"] for r in batch_updates[0]["requests"]]
+    assert starts == [3, 1]
+    assert [row[1] for row in ws.grid[1:]] == ["new1", "new2"]
+
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.sales")).scalar() == 5
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.archived_rows")).scalar() == 3
+
+    # the next sync does not treat the archived rows as deletions
+    ws.grid[1][1] = "new1b"
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["status"] == "ok"
+    assert (results[0]["updated"], results[0]["deleted"]) == (1, 0)
+    assert results[0]["archive"] == {"archived": 0, "ranges": 0}
+    assert len(batch_updates) == 1
+
+    # a real deletion is still archived to deleted_rows_log, and only that one
+    del ws.grid[2]
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["deleted"] == 1
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.sales")).scalar() == 4
+        logged = conn.execute(text(f"SELECT deleted_row_json->>'sku' FROM {schema}.deleted_rows_log")).scalars().all()
+    assert logged == ["new2"]
+
+
+def test_failed_archival_leaves_nothing_archived(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_archive3"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "old1", "2020-01-05", ""],
+        ["", "new", datetime.date.today().isoformat(), ""],
+        ["", "old2", "2020-02-05", ""],
+    ], title="sales")
+    ss = fake_sheets(ws).spreadsheet
+    apply = ss.batch_update
+
+    def refused(body):
+        raise RuntimeError("The caller does not have permission")
+
+    ss.batch_update = refused
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["status"] == "ok" and "archive" not in results[0]
+    assert len(ws.grid) == 4
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.archived_rows")).scalar() == 0
+
+    # a delete that went through but lost its response keeps its bookkeeping
+    def lost_response(body):
+        apply(body)
+        raise RuntimeError("Connection reset by peer")
+
+    ss.batch_update = lost_response
+    sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert [row[1] for row in ws.grid[1:]] == ["new"]
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.archived_rows")).scalar() == 2
+
+    # an archived row pasted back onto the tab is synced, not archived again
+    ss.batch_update = apply
+    with engine.connect() as conn:
+        old1 = conn.execute(text(f"SELECT internal_uuid::text FROM {schema}.sales WHERE sku = 'old1'")).scalar()
+    ws.grid.append([old1, "old1", "2020-01-05", ""])
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["archive"] == {"archived": 0, "ranges": 0}
+    assert len(ws.grid) == 3
+
+
+def test_rows_moved_before_the_delete_are_not_archived(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_archive4"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "old", "2020-01-05", ""],
+        ["", "new", datetime.date.today().isoformat(), ""],
+    ], title="sales")
+    batch_updates = fake_sheets(ws).spreadsheet.batch_updates
+    read = ws.col_values
+    reads = []
+
+    def col_values(col):
+        # a row is inserted at the top between the archival's read and its delete
+        reads.append(col)
+        if len(reads) == 2:
+            ws.grid.insert(1, ["", "typed meanwhile", datetime.date.today().isoformat(), ""])
+        return read(col)
+
+    ws.col_values = col_values
+    results = sheets_exporter.run_mappings(engine, [sales(schema)])
+
+    assert results[0]["archive"] == {"archived": 0, "ranges": 0}
+    assert batch_updates == []
+    assert [row[1] for row in ws.grid[1:]] == ["typed meanwhile", "old", "new"]
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {schema}.archived_rows")).scalar() == 0
+
+
+def test_rebuild_keeps_archived_rows(engine, worksheet, fake_sheets, sales):
+    from src import sheets_exporter
+
+    schema = "test_archive2"
+    ws = worksheet([
+        ["internal_uuid", "sku", "sold_on", "processed_at"],
+        ["", "old", "2020-01-05", ""],
+        ["", "new", datetime.date.today().isoformat(), ""],
+    ], title="sales")
+    fake_sheets(ws)
+    sheets_exporter.run_mappings(engine, [sales(schema)])
+    assert len(ws.grid) == 2
+
+    results = sheets_exporter.run_mappings(engine, [sales(schema)], rebuild=["sales"])
+
+    assert results[0]["status"] == "ok" and results[0]["deleted"] == 0
+    with engine.connect() as conn:
+        skus = conn.execute(text(f"SELECT sku FROM {schema}.sales ORDER BY sku")).scalars().all()
+    assert skus == ["new", "old"]
+
+
+def test_archive_predicate_sql():
+    from src.sheets_exporter import archive_predicate_sql
+
+    assert archive_predicate_sql({"where": "status = 'closed'"}) == "(status = 'closed')"
+    assert "make_interval(months => 6, days => 0)" in archive_predicate_sql({"column": "Sold On", "older_than_months": 6})
+    assert '"sold_on"' in archive_predicate_sql({"column": "Sold On", "older_than_months": 6})
+    for bad in ({}, {"column": "sold_on"}, {"where": "true; DROP TABLE sales"}):
+        try:
+            archive_predicate_sql(bad)
+            raise AssertionError(f"accepted {bad}")
+        except RuntimeError:
+            pass
@@ -0,0 +1,112 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import (
+    row_digest,
+    save_snapshot,
+    load_snapshot,
+    diff_against_snapshot,
+    rebuild_snapshot_from_target,
+    snapshot_is_stale,
+)
+
+U1 = "11111111-1111-1111-1111-111111111111"
+U2 = "22222222-2222-2222-2222-222222222222"
+U3 = "33333333-3333-3333-3333-333333333333"
+
+
+def test_snapshot_roundtrip(tmp_path):
+    import uuid
+    path = str(tmp_path / "s" / "google_sheets.orders.snap")
+    digests = {uuid.UUID(U1).bytes: row_digest({"a": 1}, ["a"])}
+
+    save_snapshot(path, "cols", digests, 3, "2025-01-01T00:00:00+00:00")
+    snap = load_snapshot(path)
+
+    assert snap["columns_key"] == "cols"
+    assert snap["fingerprint"] == 3
+    assert snap["verified_at"] == "2025-01-01T00:00:00+00:00"
+    assert snap["digests"] == digests
+    # 32 bytes per row on disk after the two header lines
+    assert os.path.getsize(path) < 200
+
+
+def test_snapshot_staleness():
+    import datetime
+    now = datetime.datetime(2025, 1, 2, 12, tzinfo=datetime.timezone.utc)
+    snap = {"columns_key": "cols", "fingerprint": 3, "verified_at": "2025-01-02T00:00:00+00:00"}
+
+    assert not snapshot_is_stale(snap, "cols", 3, 24, now)
+    assert snapshot_is_stale(snap, "cols", 4, 24, now)
+    assert snapshot_is_stale(snap, "other", 3, 24, now)
+    assert snapshot_is_stale(snap, "cols", 3, 6, now)
+    assert not snapshot_is_stale(snap, "cols", 3, 0, now)
+    assert snapshot_is_stale({**snap, "verified_at": None}, "cols", 3, 24, now)
+    # a snapshot written with the older [change_seq, row count] fingerprint is rebuilt once
+    assert snapshot_is_stale({**snap, "fingerprint": [3, 10]}, "cols", 3, 24, now)
+    assert snapshot_is_stale(None, "cols", 3, 24, now)
+
+
+def test_missing_or_corrupt_snapshot_is_none(tmp_path):
+    assert load_snapshot(str(tmp_path / "nope.snap")) is None
+
+    bad = tmp_path / "bad.snap"
+    bad.write_bytes(b"garbage")
+    assert load_snapshot(str(bad)) is None
+
+
+def test_diff_against_snapshot():
+    import uuid
+    cols = ["name", "qty"]
+    snap = {
+        uuid.UUID(U1).bytes: row_digest({"name": "a", "qty": 1}, cols),
+        uuid.UUID(U2).bytes: row_digest({"name": "b", "qty": 2}, cols),
+        uuid.UUID(U3).bytes: row_digest({"name": "c", "qty": 3}, cols),
+    }
+    rows = [
+        {"internal_uuid": U1, "name": "a", "qty": 1},    # unchanged
+        {"internal_uuid": U2, "name": "b", "qty": 20},   # updated
+        {"internal_uuid": "44444444-4444-4444-4444-444444444444", "name": "d", "qty": ""},  # new
+    ]
+
+    changed, unchanged, deleted, new_digests = diff_against_snapshot(rows, snap, cols)
+
+    assert [r["name"] for r in changed] == ["b", "d"]
+    assert unchanged == 1
+    assert deleted == [U3]
+    assert len(new_digests) == 3
+
+
+def test_rebuild_matches_sheet_digests(engine):
+    schema = "test_snapshot1"
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE {schema}.orders (
+                internal_uuid UUID PRIMARY KEY,
+                name TEXT,
+                qty TEXT,
+                processed_at TIMESTAMPTZ
+            )
+        """))
+        conn.execute(text(f"""
+            INSERT INTO {schema}.orders VALUES ('{U1}', 'a', '1', now()), ('{U2}', 'b', NULL, now())
+        """))
+
+    digests = rebuild_snapshot_from_target(engine, schema, "orders", ["name", "qty"])
+
+    # numbers read from the sheet and blank cells digest the same as the TEXT stored in Postgres
+    rows = [
+        {"internal_uuid": U1, "name": "a", "qty": 1},
+        {"internal_uuid": U2, "name": "b", "qty": ""},
+    ]
+    changed, unchanged, deleted, _ = diff_against_snapshot(rows, digests, ["name", "qty"])
+    assert changed == []
+    assert unchanged == 2
+    assert deleted == []
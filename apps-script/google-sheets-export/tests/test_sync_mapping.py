@@ -0,0 +1,161 @@
+import sys
+import os
+import datetime
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+# End-to-end run of sync_mapping() against the test Postgres, with Google faked out
+# (see the worksheet / fake_sheets fixtures in conftest.py).
+
+
+def test_sync_mapping_inserts_writes_back_and_deletes(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    schema = "test_sync1"
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [
+            {"internal_uuid": "", "name": "a", "processed_at": ""},
+            {"internal_uuid": "", "name": "b", "processed_at": ""},
+        ],
+    )
+    fake_sheets(ws)
+
+    res = sheets_exporter.sync_mapping(engine, mapping(schema, staging_table="orders_stg"))
+    assert res["status"] == "ok"
+
+    # nothing is written to the sheet until the deferred flush
+    assert not any(r["internal_uuid"] for r in ws.rows)
+    assert sheets_exporter.flush_write_backs([res["write_back"]]) == {"orders": True}
+
+    # UUIDs were written back to the sheet
+    assert all(r["internal_uuid"] for r in ws.rows)
+    assert all(r["processed_at"] for r in ws.rows)
+
+    with engine.connect() as conn:
+        n = conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders"')).scalar()
+    assert n == 2
+
+    # drop one row from the sheet and edit the other
+    ws.rows = ws.rows[:1]
+    ws.rows[0]["name"] = "a2"
+
+    res = sheets_exporter.sync_mapping(engine, mapping(schema, staging_table="orders_stg"))
+    assert res["status"] == "ok"
+
+    with engine.connect() as conn:
+        names = conn.execute(text(f'SELECT name FROM {schema}."orders"')).fetchall()
+        archived = conn.execute(text(f"SELECT COUNT(*) FROM {schema}.deleted_rows_log")).scalar()
+
+    assert [r[0] for r in names] == ["a2"]
+    assert archived == 1
+
+
+def test_sync_mapping_snapshot_diff_stages_only_changes(engine, worksheet, fake_sheets, mapping, monkeypatch, tmp_path, capsys):
+    from src import sheets_exporter
+
+    schema = "test_sync2"
+    monkeypatch.setattr(sheets_exporter, "SNAPSHOT_DIR", str(tmp_path))
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [
+            {"internal_uuid": "", "name": "a", "processed_at": ""},
+            {"internal_uuid": "", "name": "b", "processed_at": ""},
+            {"internal_uuid": "", "name": "c", "processed_at": ""},
+        ],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema, staging_table="orders_stg"), "snapshot_diff": True}
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    sheets_exporter.flush_write_backs([res["write_back"]])
+
+    ws.rows[1]["name"] = "b2"
+    ws.rows = ws.rows[:2]
+    capsys.readouterr()
+
+    res = sheets_exporter.sync_mapping(engine, m)
+    out = capsys.readouterr().out
+
+    assert res["status"] == "ok"
+    assert "Snapshot diff: 1 changed, 1 unchanged, 1 deleted" in out
+    assert "Staging payload 1" in out
+
+    with engine.connect() as conn:
+        names = conn.execute(text(f'SELECT name FROM {schema}."orders" ORDER BY name')).fetchall()
+    assert [r[0] for r in names] == ["a", "b2"]
+
+
+def test_snapshot_fingerprint_is_cheap_and_revalidated_periodically(engine, worksheet, fake_sheets, mapping, monkeypatch, tmp_path, capsys):
+    from src import sheets_exporter
+
+    schema = "test_sync3"
+    monkeypatch.setattr(sheets_exporter, "SNAPSHOT_DIR", str(tmp_path))
+    ws = worksheet.from_records(
+        ["internal_uuid", "name", "processed_at"],
+        [
+            {"internal_uuid": "", "name": "a", "processed_at": ""},
+            {"internal_uuid": "", "name": "b", "processed_at": ""},
+        ],
+    )
+    fake_sheets(ws)
+    m = {**mapping(schema, staging_table="orders_stg"), "snapshot_diff": True, "full_sync_interval_hours": 24}
+    snap_file = sheets_exporter.snapshot_path(schema, "orders")
+
+    def sync():
+        capsys.readouterr()
+        res = sheets_exporter.sync_mapping(engine, m)
+        assert res["status"] == "ok"
+        if res.get("write_back"):
+            sheets_exporter.flush_write_backs([res["write_back"]])
+        return res, capsys.readouterr().out
+
+    def names():
+        with engine.connect() as conn:
+            return conn.execute(text(f'SELECT name FROM {schema}."orders" ORDER BY name')).scalars().all()
+
+    sync()
+    sync()
+
+    # staleness is decided from change_seq alone: the target is never counted for it
+    from sqlalchemy import event
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        ws.rows[0]["name"] = "a2"
+        res, out = sync()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert res["updated"] == 1 and "rebuilding from target" not in out
+    assert not [st for st in statements if f'COUNT(*) FROM {schema}."orders"' in st]
+
+    # a row added outside the exporter is not on the sheet: the deletion scan removes it
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {schema}.orders (internal_uuid, name) VALUES (gen_random_uuid(), 'stray')"))
+    res, out = sync()
+    assert "rebuilding from target" not in out
+    assert res["deleted"] == 1 and names() == ["a2", "b"]
+
+    # out-of-band edits and deletes leave change_seq alone; they wait for the periodic revalidation
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE {schema}.orders SET name = 'edited' WHERE name = 'b'"))
+    res, out = sync()
+    assert "rebuilding from target" not in out
+    assert names() == ["a2", "edited"]
+
+    snap = sheets_exporter.load_snapshot(snap_file)
+    old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=25)
+    sheets_exporter.save_snapshot(snap_file, snap["columns_key"], snap["digests"], snap["fingerprint"], old.isoformat())
+    res, out = sync()
+    assert "rebuilding from target" in out
+    assert "Snapshot diff: 1 changed, 1 unchanged, 0 deleted" in out
+    assert names() == ["a2", "b"]
+    assert sheets_exporter.load_snapshot(snap_file)["verified_at"] > old.isoformat()
@@ -0,0 +1,89 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def test_run_writes_one_ledger_row_per_mapping(engine, worksheet, fake_sheets, mapping):
+    from src import sheets_exporter
+
+    fake_sheets(worksheet([["internal_uuid", "name", "processed_at"], ["", "a", ""], ["", "b", ""]]))
+
+    schema = "test_runs1"
+    m = mapping(schema)
+    # an existing target takes the merge path (a missing one would be bulk-loaded)
+    sheets_exporter.create_target_table_if_not_exists(engine, schema, "orders", ["internal_uuid", "name", "processed_at"])
+
+    results = sheets_exporter.run_mappings(engine, [m])
+    run_id = results[0]["stats"].run_id
+
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT outcome, rows_read, rows_staged, inserted, updated, deleted, phase_seconds
+            FROM {schema}.sync_runs
+            WHERE run_id = :r
+        """), {"r": run_id}).mappings().one()
+
+    assert row["outcome"] == "ok"
+    assert row["rows_read"] == 2
+    assert row["rows_staged"] == 2
+    assert row["inserted"] == 2
+    assert {"read", "stage", "upsert", "deletion", "write_back_flush"} <= set(row["phase_seconds"])
+
+
+def test_google_response_hook_counts_calls_and_bytes():
+    from src import sheets_exporter
+
+    class FakeResponse:
+        def __init__(self, headers, content=b""):
+            self.headers = headers
+            self.content = content
+
+    stats = sheets_exporter.MappingStats("run", {"name": "orders"})
+    sheets_exporter._ACTIVE_STATS = stats
+    try:
+        sheets_exporter._count_google_response(FakeResponse({"Content-Length": "120"}))
+        sheets_exporter._count_google_response(FakeResponse({}, b"x" * 30), stream=False)
+        sheets_exporter._count_google_response(FakeResponse({}, b"ignored"), stream=True)
+    finally:
+        sheets_exporter._ACTIVE_STATS = None
+
+    assert stats.google_calls == 3
+    assert stats.google_bytes == 150
+
+
+def test_flush_stats_split_across_tabs_keeps_the_totals(engine, worksheet, fake_sheets, mapping, monkeypatch):
+    from src import sheets_exporter
+
+    fake_sheets({
+        title: worksheet([["internal_uuid", "name", "processed_at"], ["", "a", ""]], title=title)
+        for title in ("one", "two", "three")
+    })
+    schema = "test_runs2"
+    for title in ("one", "two", "three"):
+        sheets_exporter.create_target_table_if_not_exists(engine, schema, title, ["internal_uuid", "name", "processed_at"])
+
+    real_flush = sheets_exporter.flush_write_backs
+    flushes = []
+
+    def flush(payloads):
+        # 10 calls / 1001 bytes / 2 retries per flush: not divisible by 3 tabs
+        flushes.append(1)
+        stats = sheets_exporter._current_stats()
+        stats.google_calls += 10
+        stats.google_bytes += 1001
+        stats.retries += 2
+        return real_flush(payloads)
+
+    monkeypatch.setattr(sheets_exporter, "flush_write_backs", flush)
+    results = sheets_exporter.run_mappings(engine, [mapping(schema, t) for t in ("one", "two", "three")])
+
+    stats = [r["stats"] for r in results]
+    assert all(r["status"] == "ok" for r in results)
+    assert sum(st.google_calls for st in stats) == 10 * len(flushes)
+    assert sum(st.google_bytes for st in stats) == 1001 * len(flushes)
+    assert sum(st.retries for st in stats) == 2 * len(flushes)
@@ -0,0 +1,88 @@
+import pytest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+from src.sheets_exporter import (
+    apply_table_storage_settings,
+    run_table_maintenance,
+    table_health,
+)
+
+
+def _setup(engine, schema, n):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        conn.execute(text(f"""
+            CREATE TABLE {schema}.orders (
+                internal_uuid UUID PRIMARY KEY,
+                name TEXT,
+                processed_at TIMESTAMPTZ
+            )
+        """))
+        conn.execute(text(f"""
+            INSERT INTO {schema}.orders
+            SELECT gen_random_uuid(), 'x', now() FROM generate_series(1, {n})
+        """))
+
+
+def _reloptions(engine, schema):
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT c.reloptions FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :s AND c.relname = 'orders'
+        """), {"s": schema}).scalar()
+
+
+def test_storage_settings_applied_once(engine):
+    schema = "test_maint1"
+    _setup(engine, schema, 1)
+    settings = {"fillfactor": 85, "autovacuum_vacuum_scale_factor": 0.05}
+
+    assert apply_table_storage_settings(engine, schema, "orders", settings) == settings
+    assert sorted(_reloptions(engine, schema)) == ["autovacuum_vacuum_scale_factor=0.05", "fillfactor=85"]
+
+    # unchanged settings -> no ALTER
+    assert apply_table_storage_settings(engine, schema, "orders", settings) == {}
+
+
+def test_storage_settings_compare_numerically(engine):
+    schema = "test_maint4"
+    _setup(engine, schema, 1)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {schema}.orders SET (autovacuum_vacuum_scale_factor = 0.050, autovacuum_enabled = TRUE)"))
+
+    settings = {"autovacuum_vacuum_scale_factor": 0.05, "autovacuum_enabled": True}
+    assert apply_table_storage_settings(engine, schema, "orders", settings) == {}
+    assert apply_table_storage_settings(engine, schema, "orders", {"autovacuum_vacuum_scale_factor": 0.5}) == {
+        "autovacuum_vacuum_scale_factor": 0.5
+    }
+
+
+def test_storage_settings_reject_unknown_keys(engine):
+    with pytest.raises(ValueError):
+        apply_table_storage_settings(engine, "test_maint1", "orders", {"drop table x; --": 1})
+
+
+def test_analyze_only_above_churn_threshold(engine):
+    schema = "test_maint2"
+    _setup(engine, schema, 50)
+    m = {"schema": schema, "target_table": "orders", "maintenance": {"analyze_min_churn_rows": 10}}
+
+    quiet = run_table_maintenance(engine, m, {"inserted": 1, "updated": 0, "deleted": 0})
+    busy = run_table_maintenance(engine, m, {"inserted": 40, "updated": 5, "deleted": 5})
+
+    assert quiet["analyzed"] is False
+    assert busy["analyzed"] is True
+    assert busy["churn"] == 50
+
+
+def test_table_health_reports_bloat_fields(engine):
+    health = table_health(engine, "test_maint2", "orders")
+    assert set(health) >= {"live_rows", "dead_rows", "size_bytes", "dead_ratio", "est_bloat_bytes"}
+    assert table_health(engine, "test_maint2", "does_not_exist") is None
@@ -0,0 +1,66 @@
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from src.sheets_exporter import flush_write_backs
+
+
+def write_back(name, n_rows):
+    return {
+        "name": name,
+        "sheet_id": "book",
+        "sheet_name": name,
+        "target_table": name,
+        "data": [
+            {"range": f"A2:A{n_rows + 1}", "values": [[f"u{i}"] for i in range(n_rows)]},
+            {"range": f"C2:C{n_rows + 1}", "values": [[f"t{i}"] for i in range(n_rows)]},
+        ],
+        "insert_count": 0,
+        "update_count": 0,
+    }
+
+
+def tabs(worksheet, **n_rows):
+    return {
+        name: worksheet([["internal_uuid", "name", "processed_at"]] + [["", "", ""] for _ in range(n)], title=name)
+        for name, n in n_rows.items()
+    }
+
+
+def test_all_tabs_of_a_spreadsheet_share_one_request(worksheet, fake_sheets):
+    sheets = tabs(worksheet, orders=3, items=2)
+    ss = fake_sheets(sheets).spreadsheet
+
+    res = flush_write_backs([write_back("orders", 3), write_back("items", 2)], max_cells=1000)
+
+    assert res == {"orders": True, "items": True}
+    assert len(ss.requests) == 1
+    assert ss.requests[0] == ["'orders'!A2:A4", "'orders'!C2:C4", "'items'!A2:A3", "'items'!C2:C3"]
+    assert [row[0] for row in sheets["items"].grid[1:]] == ["u0", "u1"]
+
+
+def test_large_tab_is_split_to_respect_cell_limit(worksheet, fake_sheets):
+    ss = fake_sheets(tabs(worksheet, orders=5)).spreadsheet
+
+    res = flush_write_backs([write_back("orders", 5)], max_cells=4)
+
+    assert res == {"orders": True}
+    sent = [r for req in ss.requests for r in req]
+    assert sent == [
+        "'orders'!A2:A5", "'orders'!A6:A6",
+        "'orders'!C2:C5", "'orders'!C6:C6",
+    ]
+
+
+def test_failed_tab_is_reported_without_blocking_others(worksheet, fake_sheets, monkeypatch):
+    ss = fake_sheets(tabs(worksheet, orders=2, items=2)).spreadsheet
+    ss.fail_tabs.add("items")
+    monkeypatch.setattr("time.sleep", lambda s: None)
+
+    res = flush_write_backs([write_back("orders", 2), write_back("items", 2)], max_cells=4, attempts=2)
+
+    assert res == {"orders": True, "items": False}
+    assert ss.requests == [["'orders'!A2:A3", "'orders'!C2:C3"]]
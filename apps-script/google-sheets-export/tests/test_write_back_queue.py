@@ -0,0 +1,96 @@
+import sys
+import os
+import threading
+
+sys.path.append(
+    os.path.abspath("apps-script/google-sheets-export")
+)
+
+from sqlalchemy import text
+
+
+def _grid(*names):
+    return [["internal_uuid", "name", "processed_at"]] + [["", n, ""] for n in names]
+
+
+def _queue(engine, schema):
+    with engine.connect() as conn:
+        return [dict(r) for r in conn.execute(text(f"""
+            SELECT mapping_name, attempts, last_error FROM {schema}.write_back_queue ORDER BY mapping_name
+        """)).mappings()]
+
+
+def _phase(engine, schema, name):
+    with engine.connect() as conn:
+        return conn.execute(text(f"""
+            SELECT phase FROM {schema}.sync_checkpoints WHERE mapping_name = :n
+        """), {"n": name}).scalar()
+
+
+def test_next_mapping_syncs_while_write_back_is_in_flight(engine, worksheet, fake_sheets, mapping, monkeypatch):
+    from src import sheets_exporter
+
+    schema = "test_wbqueue1"
+    first_written = threading.Event()
+    waited = []
+    first = worksheet(_grid("a", "b"), title="first")
+    # the second tab can only be read once the first tab's write-back has landed,
+    # which never happens if write-backs wait for the end of the run
+    second = worksheet(_grid("c"), title="second", on_read=lambda ws: waited.append(first_written.wait(5)))
+
+    spreadsheet = fake_sheets({"first": first, "second": second}).spreadsheet
+    update = spreadsheet.values_batch_update
+
+    def values_batch_update(body):
+        update(body)
+        first_written.set()
+
+    spreadsheet.values_batch_update = values_batch_update
+    monkeypatch.setattr(sheets_exporter, "WRITE_BACK_BATCH_WAIT", 0)
+
+    results = sheets_exporter.run_mappings(engine, [mapping(schema, "first"), mapping(schema, "second")])
+
+    assert [r["status"] for r in results] == ["ok", "ok"]
+    assert waited == [True]
+    assert all(row[0] for row in first.grid[1:] + second.grid[1:])
+    assert _phase(engine, schema, "first") == _phase(engine, schema, "second") == "written_back"
+    assert _queue(engine, schema) == []
+    assert sheets_exporter.write_back_queue_metrics(engine, schema)["depth"] == 0
+
+
+def test_failed_write_back_stays_queued_until_next_run(engine, worksheet, fake_sheets, mapping, monkeypatch, capsys):
+    from src import sheets_exporter
+
+    schema = "test_wbqueue2"
+    ws = worksheet(_grid("a", "b"), title="orders")
+    spreadsheet = fake_sheets(ws).spreadsheet
+    working_update = spreadsheet.values_batch_update
+
+    def failing_update(body):
+        raise RuntimeError("The caller does not have permission")
+
+    spreadsheet.values_batch_update = failing_update
+    monkeypatch.setattr(sheets_exporter, "WRITE_BACK_BATCH_WAIT", 0)
+
+    results = sheets_exporter.run_mappings(engine, [mapping(schema)])
+    out = capsys.readouterr().out
+
+    assert results[0]["status"] == "write_back_failed"
+    assert not any(row[0] for row in ws.grid[1:])
+    queued = _queue(engine, schema)
+    assert [q["mapping_name"] for q in queued] == ["orders"]
+    assert queued[0]["attempts"] >= 1 and "flush failed" in queued[0]["last_error"]
+    assert _phase(engine, schema, "orders") == "deleted"
+    assert "==== write-back queue ====" in out
+    assert "depth=1" in out
+
+    # Google is back: the next run re-validates the checkpoint, re-queues and sends it
+    spreadsheet.values_batch_update = working_update
+    results = sheets_exporter.run_mappings(engine, [mapping(schema)])
+
+    assert results[0]["status"] == "ok"
+    assert results[0].get("resumed")
+    assert all(row[0] for row in ws.grid[1:])
+    assert _queue(engine, schema) == []
+    with engine.connect() as conn:
+        assert conn.execute(text(f'SELECT COUNT(*) FROM {schema}."orders"')).scalar() == 2